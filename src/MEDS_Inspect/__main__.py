@@ -3,8 +3,6 @@ import logging
 import hydra
 from omegaconf import DictConfig
 
-from .app import run_app
-
 
 @hydra.main(version_base=None, config_path="configs", config_name="general")
 def main(cfg: DictConfig):
@@ -14,6 +12,9 @@ def main(cfg: DictConfig):
     # args = parser.parse_args()
 
     # file_path = args.file_path if args.file_path else None
+    # Dash and the app are imported after the configuration was parsed
+    from .app import run_app
+
     run_app(cfg)
 
 
@@ -1,26 +1,56 @@
 import importlib.resources as pkg_resources
-import logging
-import os
+import math
+import time
+from datetime import datetime
+from functools import partial, wraps
 
-import pandas as pd
-import plotly.express as px
+import numpy as np
+import plotly.graph_objects as go
 import polars as pl
-from dash import Dash, Input, Output, State, dash_table, dcc, html
+from dash import Dash, Input, Output, State, ctx, dash_table, dcc, html, no_update
+from dash.dash_table import FormatTemplate
+from dash.exceptions import PreventUpdate
+from flask import Response, g
 from omegaconf import DictConfig
 
-from .cache.cache_results import cache_results, get_metadata
-from .code_search import load_code_metadata, search_codes
-from .utils import is_valid_path, return_data_path
-import math
+from .cache.aggregations import TIME_LEVELS
+from .cache.cache_results import get_cache_dir
+from .cache.cohorts import canonical_cohort, list_splits
+from .cache.jobs import BuildJobs, is_building, read_progress
+from .cache.numeric_summary import rebin
+from .cache.task_index import load_task_labels
+from .compare import (
+    SPREAD,
+    common_numeric_codes,
+    compare_counts,
+    compare_numeric,
+    compare_statistics,
+    compare_time,
+    dataset_labels,
+    share,
+)
+from .figures import (
+    category_bar_figure,
+    code_count_subject_figure,
+    code_count_time_figure,
+    histogram_bar,
+    log_payload_size,
+    share_bar_figure,
+    share_time_figure,
+    subject_timeline_figure,
+    task_label_trace,
+)
+from .metrics import METRICS, enable_json_log, log_event
+from .registry import DatasetRegistry, load_cached_dataset, load_dataset
+from .subject_search import SUBJECT_FILTERS
+from .tasks import list_tasks
+from .utils import format_statistic, is_valid_path
 
 package_name = "MEDS_Inspect"
 sample_data_path = None
-top_codes = None
 app = Dash(__name__, suppress_callback_exceptions=True)
 app.title = "MEDS INSPECT"
 server = app.server
-cached_results = None
-metadata = None
 card_style = {"border": "2px solid #007BFF", "padding": "10px", "borderRadius": "5px"}
 standard_style = {
     "fontfamily": "Helvetica",
@@ -38,11 +68,57 @@ standard_style = {
 }
 
 
-def run_app(cfg: DictConfig = None):
-    global top_codes
-    global cached_results
-    global metadata
+def instrumented_callback(*args, **kwargs):
+    """Registers a callback like ``app.callback`` that records its duration and
+    errors. The size of its response is recorded by ``record_response``."""
+
+    def decorator(func):
+        @wraps(func)
+        def timed(*callback_args, **callback_kwargs):
+            g.callback = func.__name__
+            start = time.perf_counter()
+            try:
+                return func(*callback_args, **callback_kwargs)
+            except PreventUpdate:
+                raise
+            except Exception:
+                METRICS.inc("meds_inspect_callback_errors_total", callback=g.callback)
+                raise
+            finally:
+                g.callback_seconds = time.perf_counter() - start
+                METRICS.observe(
+                    "meds_inspect_callback_seconds",
+                    g.callback_seconds,
+                    callback=g.callback,
+                )
+
+        return app.callback(*args, **kwargs)(timed)
+
+    return decorator
+
+
+@server.after_request
+def record_response(response):
+    if "callback" in g:
+        size = response.calculate_content_length() or 0
+        METRICS.inc("meds_inspect_response_bytes_total", size, callback=g.callback)
+        log_event(
+            "callback",
+            callback=g.callback,
+            seconds=g.get("callback_seconds"),
+            bytes=size,
+            status=response.status_code,
+        )
+    return response
+
+
+@server.route("/metrics")
+def metrics():
+    return Response(METRICS.render(), mimetype="text/plain; version=0.0.4")
 
+
+def create_app(cfg: DictConfig = None):
+    """Sets the layout and registers the callbacks of the app for ``cfg``."""
     sample_data_path = (
         cfg.sample_data_path
         if cfg.sample_data_path
@@ -52,27 +128,81 @@ def run_app(cfg: DictConfig = None):
     # Set the file_path to the downloaded directory
     file_path = cfg.initial_path if cfg.initial_path else sample_data_path
 
-    # Global variable to store cached results
-    cached_results = None
-
-    # file_path=None
-
-    # if file_path and is_valid_path(file_path):
-    logging.info(f"loading cached results at: {file_path}")
-    metadata = get_metadata(file_path)
-    cached_results = cache_results(file_path)
-    code_count_years = cached_results["code_count_years"]
-    code_count_subject = cached_results["code_count_subjects"]
-    top_codes = cached_results["top_codes"]
-    coding_dict = cached_results["coding_dict"]
-    numerical_code_data = cached_results["numerical_code_data"]
-    if (
-        len(cached_results["code_count_subjects"]["Subject ID"])
-        > cfg.limits.subject_ids
-    ):
-        subject_ids = cached_results["code_count_subjects"]["Subject ID"].to_list()
-    else:
-        subject_ids = None
+    # Loaded datasets are shared by all sessions and looked up by their path, so every
+    # callback resolves its data from the "hidden-file-path" of its session
+    json_log = cfg.get("metrics", {}).get("json_log")
+    if json_log:
+        enable_json_log(json_log)
+    cache_options = {"cache_format": cfg.get("cache", {}).get("format", "parquet")}
+    registry = DatasetRegistry(
+        **cfg.get("registry", {}), loader=partial(load_dataset, **cache_options)
+    )
+    # The initial dataset is loaded in the background, so the server starts right away
+    # and the page polls it like a build (see poll_cache_build)
+    registry.preload(file_path)
+    # Compared datasets are only read from their cache, so comparing never scans data
+    comparisons = DatasetRegistry(**cfg.get("compare", {}), loader=load_cached_dataset)
+    # Caches of newly selected datasets are built in background processes
+    jobs_cfg = cfg.get("jobs", {})
+    jobs = BuildJobs(workers=jobs_cfg.get("workers", 1), **cache_options)
+    max_cohorts = cfg.get("cohorts", {}).get("max_stored", 32)
+
+    def get_dataset(file_path, cohort=None):
+        """The dataset at ``file_path`` restricted to the cohort filter, if set."""
+        return registry.get(file_path).cohort(cohort, max_cohorts)
+
+    def get_cached_dataset(file_path):
+        """The dataset at ``file_path`` if it is loaded, otherwise its cache."""
+        if file_path in registry:
+            return registry.get(file_path)
+        return comparisons.get(file_path)
+
+    def comparison_table(table):
+        """A sortable table of a comparison, with shares formatted as percentages."""
+        columns = [
+            {
+                "name": column,
+                "id": column,
+                "type": "numeric",
+                "format": FormatTemplate.percentage(2),
+            }
+            if column.endswith("share") or column == SPREAD
+            else {"name": column, "id": column}
+            for column in table.columns
+        ]
+        return dash_table.DataTable(
+            columns=columns,
+            data=table.to_dicts(),
+            sort_action="native",
+            page_size=cfg.limits.search_page_size,
+            style_table={"overflowX": "auto", "marginBottom": "20px"},
+            style_cell={"textAlign": "left"},
+        )
+
+    timeline_cfg = cfg.get("timeline", {})
+
+    def subject_timeline(file_path, subject_id, task=None, x_range=None):
+        """The timeline figure of a subject with the labels of ``task``, or None if
+        the subject has no events."""
+        events = registry.get(file_path).subject_events(subject_id)
+        if events is None:
+            return None
+        figure = subject_timeline_figure(events, subject_id, x_range, **timeline_cfg)
+        if task:
+            # The labels are indexed by subject when the cache is loaded
+            labels = load_task_labels(get_cache_dir(file_path), task, subject_id)
+            if labels is not None and not labels.is_empty():
+                figure.add_trace(task_label_trace(labels, task))
+                figure.update_layout(
+                    yaxis2=dict(
+                        overlaying="y",
+                        range=[0, 1],
+                        showticklabels=False,
+                        showgrid=False,
+                    )
+                )
+        return log_payload_size("fig_subject_codes", figure)
+
     app.layout = html.Div(
         children=[
             html.Div(
@@ -90,7 +220,7 @@ def run_app(cfg: DictConfig = None):
             dcc.Input(
                 id="hidden-file-path",
                 type="hidden",
-                value=file_path,
+                value=None,
                 style={"textAlign": "center", "fontSize": "20px"},
             ),
             html.Div(
@@ -126,10 +256,45 @@ def run_app(cfg: DictConfig = None):
                         children=[html.Div(id="loading-output")],
                         overlay_style={"visibility": "visible", "filter": "blur(2px)"},
                     ),
+                    html.Div(id="cache-progress", style={"textAlign": "center"}),
+                    dcc.Store(id="pending-path", data=file_path),
+                    dcc.Interval(
+                        id="build-poll",
+                        interval=jobs_cfg.get("poll_interval_ms", 500),
+                        disabled=False,
+                    ),
                 ],
                 style={"marginTop": "20px"},
             ),
             html.Div(id="general-stats"),
+            html.Div(
+                [
+                    html.Span("Cohort:"),
+                    dcc.Dropdown(
+                        id="cohort-split",
+                        placeholder="All splits",
+                        style={"width": "200px"},
+                    ),
+                    dcc.Dropdown(
+                        id="cohort-task",
+                        placeholder="All subjects (no task)",
+                        style={"width": "320px"},
+                    ),
+                    dcc.DatePickerRange(
+                        id="cohort-window",
+                        clearable=True,
+                        start_date_placeholder_text="From",
+                        end_date_placeholder_text="Until",
+                    ),
+                    dcc.Store(id="cohort-filter"),
+                ],
+                style={
+                    "display": "flex",
+                    "gap": "10px",
+                    "alignItems": "center",
+                    "marginBottom": "20px",
+                },
+            ),
             dcc.Tabs(
                 id="tabs",
                 value="tab-1",
@@ -141,6 +306,7 @@ def run_app(cfg: DictConfig = None):
                     dcc.Tab(label="📊 Code Distribution", value="tab-5"),
                     dcc.Tab(label="🔍 Code Search", value="tab-6"),
                     dcc.Tab(label="📖 Coding Dictionary", value="tab-7"),
+                    dcc.Tab(label="⚖️ Compare Datasets", value="tab-8"),
                 ],
             ),
             dcc.Loading(
@@ -152,20 +318,20 @@ def run_app(cfg: DictConfig = None):
         style={"fontFamily": "Helvetica", "marginLeft": "30px", "marginRight": "30px"},
     )
 
-    @app.callback(
-        Output("hidden-file-path", "value"),
+    @instrumented_callback(
+        Output("pending-path", "data"),
+        Output("build-poll", "disabled"),
         Output("path-feedback", "children"),
         Output("loading-output", "children"),
         Input("submit-path", "n_clicks"),
         State("input-path", "value"),
-        State("hidden-file-path", "value"),
     )
-    def update_hidden_path(n_clicks, input_path, current_path):
-        global cached_results
-        global metadata
+    def update_hidden_path(n_clicks, input_path):
         if n_clicks == 0:
+            # The initial dataset may still be loading, see poll_cache_build
             return (
-                current_path,
+                no_update,
+                no_update,
                 (
                     "Enter the path to your MEDS data folder to get started. "
                     "The first time we will run several (lazily evaluated) queries on the dataset "
@@ -175,59 +341,123 @@ def run_app(cfg: DictConfig = None):
                 "",
             )
         if n_clicks > 0 and is_valid_path(input_path):
-            print(f"loading cached results at: {input_path}")
-            cached_results = cache_results(input_path)
-            metadata = get_metadata(input_path)
-            feedback_message = f"Selected folder: {input_path}. Caching complete."
-            return input_path, feedback_message, ""
-        return current_path, "Invalid folder path. Please try again.", ""
-
-    @app.callback(
+            # A build that is already running for this path is reused; for a loaded
+            # dataset the build checks whether its shards changed
+            jobs.submit(input_path)
+            return input_path, False, f"Caching {input_path}...", ""
+        return None, True, "Invalid folder path. Please try again.", ""
+
+    @instrumented_callback(
+        Output("hidden-file-path", "value"),
+        Output("path-feedback", "children", allow_duplicate=True),
+        Output("cache-progress", "children"),
+        Output("build-poll", "disabled", allow_duplicate=True),
+        Input("build-poll", "n_intervals"),
+        State("pending-path", "data"),
+        State("hidden-file-path", "value"),
+        prevent_initial_call=True,
+    )
+    def poll_cache_build(n_intervals, pending_path, current_path):
+        if pending_path is None:
+            return current_path, no_update, "", True
+        status = jobs.status(pending_path)
+        if status["state"] == "running":
+            if "stage" not in status:
+                return no_update, no_update, "Starting...", False
+            return (
+                no_update,
+                no_update,
+                [
+                    html.Div(f"{status['stage']}: {status['n']}/{status['total']}"),
+                    html.Progress(value=status["n"], max=status["total"]),
+                ],
+                False,
+            )
+        if status["state"] == "failed":
+            return (
+                current_path,
+                f"Caching {pending_path} failed: {status['error']}",
+                "",
+                True,
+            )
+        cache_dir = get_cache_dir(pending_path)
+        # A build in another process (e.g. another app worker) is followed through
+        # its progress file, loading the dataset now would wait for it in the request
+        if registry.is_loading(pending_path) or is_building(cache_dir):
+            progress = read_progress(cache_dir)
+            if progress is None:
+                return no_update, f"Loading {pending_path}...", "", False
+            return (
+                no_update,
+                f"Loading {pending_path}...",
+                [
+                    html.Div(
+                        f"{progress['stage']}: {progress['n']}/{progress['total']}"
+                    ),
+                    html.Progress(value=progress["n"], max=progress["total"]),
+                ],
+                False,
+            )
+        # The build refreshed the cache if the shards changed since it was loaded
+        registry.evict_outdated(pending_path)
+        try:
+            registry.get(pending_path)
+        except Exception as e:
+            return current_path, f"Loading {pending_path} failed: {e}", "", True
+        feedback_message = f"Selected folder: {pending_path}. Caching complete."
+        return pending_path, feedback_message, "", True
+
+    @instrumented_callback(
         Output("tabs-content", "children"),
         Input("tabs", "value"),
-        State("hidden-file-path", "value"),
+        Input("hidden-file-path", "value"),
+        Input("cohort-filter", "data"),
     )
-    def render_content(tab, file_path):
+    def render_content(tab, file_path, cohort):
+        if tab == "tab-8":
+            return comparison_layout(file_path)
         if not file_path:
             return html.Div(
                 "No folder selected. Please enter a valid folder path to proceed."
             )
+        dataset = get_dataset(file_path, cohort)
+        if dataset is None:
+            return html.Div("No events match the cohort filter.")
+        time_pyramid = dataset["time_pyramid"]
+        code_count_subject = dataset["code_count_subjects"]
+        numeric_summary = dataset["numeric_summary"]
 
         # Get unique subject IDs and codes
         # codes = top_codes['code'].unique().to_list()
 
-        numerical_codes = (
-            numerical_code_data.select("code").unique().collect()["code"].to_list()
-        )
+        numerical_codes = numeric_summary["code"].to_list()
 
         if tab == "tab-1":
-            fig_code_count_years = px.histogram(
-                code_count_years,
-                x="Date",
-                y="Amount of codes",
-                nbins=len(code_count_years),
-            )
+            fig_code_count_years = code_count_time_figure(time_pyramid)
             return html.Div(
                 [
                     html.H2(
                         children="Code count over time", style={"textAlign": "center"}
                     ),
-                    html.P(children="Adjust the number of bins:"),
-                    dcc.Slider(
-                        id="bins-slider-years",
-                        min=1,
-                        max=len(code_count_years + 1),
-                        step=1,
-                        value=len(code_count_years),
-                        marks={
-                            i: str(i)
-                            for i in range(
-                                1,
-                                len(code_count_years) + 1,
-                                max(1, len(code_count_years) // 10),
-                            )
-                        },
-                        tooltip={"placement": "bottom", "always_visible": True},
+                    html.P(children="Select the time granularity:"),
+                    dcc.Dropdown(
+                        id="granularity-dropdown-years",
+                        options=[
+                            {"label": level.capitalize(), "value": level}
+                            for level in TIME_LEVELS
+                        ],
+                        value="month",
+                        clearable=False,
+                    ),
+                    dcc.Checklist(
+                        id="breakdown-checklist-years",
+                        options=[
+                            {
+                                "label": " Break down by coding dictionary",
+                                "value": "coding_dict",
+                            }
+                        ],
+                        value=[],
                     ),
                     html.P(children="Select the histogram normalization:"),
                     dcc.Dropdown(
@@ -258,14 +488,9 @@ def run_app(cfg: DictConfig = None):
                 style=card_style,
             )
         elif tab == "tab-2":
-            fig_code_count_subject = px.histogram(
-                code_count_subject,
-                y="Subject ID",
-                x="Code count",
-                histfunc="count",
-                histnorm="probability",
-                title="Code count distribution per subject",
-            ).update_layout(yaxis_title="Segment of Subjects")
+            fig_code_count_subject = code_count_subject_figure(
+                code_count_subject, 10, "probability"
+            ).update_layout(title="Code count distribution per subject")
             return html.Div(
                 [
                     html.H2(
@@ -358,25 +583,30 @@ def run_app(cfg: DictConfig = None):
                 style=card_style,
             )
         elif tab == "tab-4":
-            subject_input = (
-                dcc.Input(
-                    id="subject-input",
-                    type="number",
-                    placeholder="Enter a subject ID",
-                    value=None,
-                    style=dict({"width": "100%"}, **standard_style),
-                )
-                if not subject_ids
-                else dcc.Dropdown(
-                    id="subject-input",
-                    options=[{"label": pid, "value": pid} for pid in subject_ids],
-                    placeholder="Select a subject ID",
-                    value=None,
-                    multi=False,
-                    searchable=True,
-                    clearable=True,
-                    style={"width": "100%"},
-                )
+            # Subject IDs are looked up on the server as they are typed
+            subject_input = html.Div(
+                [
+                    dcc.RadioItems(
+                        id="subject-filter",
+                        options=[
+                            {"label": f" {label}", "value": value}
+                            for value, label in SUBJECT_FILTERS.items()
+                        ],
+                        value="most_events",
+                        inline=True,
+                        inputStyle={"marginLeft": "10px"},
+                    ),
+                    dcc.Dropdown(
+                        id="subject-input",
+                        options=[],
+                        placeholder="Type a subject ID",
+                        value=None,
+                        multi=False,
+                        searchable=True,
+                        clearable=True,
+                        style={"width": "100%"},
+                    ),
+                ]
             )
             return html.Div(
                 [
@@ -389,6 +619,7 @@ def run_app(cfg: DictConfig = None):
                         id="task-dropdown",
                         placeholder="Select a task",
                     ),
+                    html.Div(id="task-summary", style={"marginTop": "10px"}),
                     html.Button(
                         "Confirm",
                         id="confirm-button",
@@ -402,6 +633,8 @@ def run_app(cfg: DictConfig = None):
                     html.Div(
                         id="feedback", style={"color": "red", "marginTop": "10px"}
                     ),
+                    # The subject and task of the drawn timeline, to redraw it on zoom
+                    dcc.Store(id="timeline-subject"),
                     dcc.Loading(
                         id="loading-fig-subject-codes",
                         type="default",
@@ -499,6 +732,21 @@ def run_app(cfg: DictConfig = None):
                         type="default",
                         children=html.Div(id="search-results"),
                     ),
+                    # Only the visible page of results is sent to the browser
+                    dash_table.DataTable(
+                        id="search-table",
+                        columns=[],
+                        data=[],
+                        page_action="custom",
+                        page_current=0,
+                        page_size=cfg.limits.search_page_size,
+                        page_count=0,
+                        style_table={"width": "100%"},
+                        style_cell={"textAlign": "left", "whiteSpace": "normal"},
+                        style_data_conditional=[
+                            {"if": {"row_index": "odd"}, "backgroundColor": "#f2f2f2"}
+                        ],
+                    ),
                 ],
                 style=card_style,
             )
@@ -531,36 +779,270 @@ def run_app(cfg: DictConfig = None):
                 style=card_style,
             )
 
-    # Add this callback
-    @app.callback(
-        Output("general-stats", "children"), Input("hidden-file-path", "value")
+    def comparison_layout(file_path):
+        return html.Div(
+            [
+                html.H2(children="Compare Datasets", style={"textAlign": "center"}),
+                html.P(
+                    children="Cached datasets to compare, one path per line (cache "
+                    "new ones with MEDS_Inspect_cache):"
+                ),
+                dcc.Textarea(
+                    id="compare-paths",
+                    value=f"{file_path}\n" if file_path else "",
+                    style={"width": "100%", "height": "100px"},
+                ),
+                html.P(children="Compare the top codes of every dataset:"),
+                dcc.Dropdown(
+                    id="compare-top-n",
+                    options=[{"label": str(i), "value": i} for i in [10, 20, 50, 100]],
+                    value=20,
+                ),
+                html.P(children="Compare the codes over time per:"),
+                dcc.Dropdown(
+                    id="compare-level",
+                    options=[
+                        {"label": level.capitalize(), "value": level}
+                        for level in TIME_LEVELS
+                    ],
+                    value="month",
+                ),
+                html.Button(
+                    "Compare",
+                    id="compare-button",
+                    n_clicks=0,
+                    style={
+                        "display": "block",
+                        "margin": "20px auto",
+                        "fontSize": "20px",
+                    },
+                ),
+                html.Div(id="compare-feedback", style={"color": "red"}),
+                # The paths of the compared datasets, to compare their numeric codes
+                dcc.Store(id="compare-datasets"),
+                dcc.Loading(
+                    id="loading-compare-results",
+                    type="default",
+                    children=html.Div(id="compare-results"),
+                ),
+                html.H3(children="Numeric values"),
+                dcc.Dropdown(
+                    id="compare-code",
+                    placeholder="Select a code summarized in every dataset",
+                ),
+                dcc.Loading(
+                    id="loading-fig-compare-numeric",
+                    type="default",
+                    children=[
+                        dcc.Graph(
+                            id="fig_compare_numeric",
+                            style={"width": "90hh", "height": "50vh"},
+                        ),
+                        html.Div(id="compare-numeric-table"),
+                    ],
+                ),
+            ],
+            style=card_style,
+        )
+
+    @instrumented_callback(
+        Output("compare-results", "children"),
+        Output("compare-feedback", "children"),
+        Output("compare-datasets", "data"),
+        Output("compare-code", "options"),
+        Output("compare-code", "value"),
+        Input("compare-button", "n_clicks"),
+        Input("compare-top-n", "value"),
+        Input("compare-level", "value"),
+        State("compare-paths", "value"),
     )
-    def update_general_stats(file_path):
-        if file_path:
-            general_statistics = cached_results["general_statistics"]
-            metadata = get_metadata(file_path)
+    def update_comparison(n_clicks, top_n, level, paths):
+        """Aligns the cached aggregates of the datasets and draws their differences."""
+        if not n_clicks:
+            raise PreventUpdate
+        file_paths = list(
+            dict.fromkeys(line.strip() for line in (paths or "").splitlines())
+        )
+        file_paths = [file_path for file_path in file_paths if file_path]
+        if len(file_paths) < 2:
+            return None, "Enter at least two dataset paths.", None, [], None
+        datasets = {}
+        errors = []
+        for name, file_path in zip(dataset_labels(file_paths), file_paths):
+            try:
+                datasets[name] = get_cached_dataset(file_path)
+            except FileNotFoundError as e:
+                errors.append(str(e))
+        if errors:
+            return None, " ".join(errors), None, [], None
+
+        shares = {name: share(name) for name in datasets}
+        codes = compare_counts(
+            {name: dataset["top_codes"] for name, dataset in datasets.items()},
+            "code",
+            top_n,
+        )
+        coding_dicts = compare_counts(
+            {name: dataset["coding_dict"] for name, dataset in datasets.items()},
+            "coding_dict",
+            cfg.limits.coding_dict,
+        )
+        over_time = compare_time(
+            {name: dataset["time_pyramid"] for name, dataset in datasets.items()},
+            level,
+        )
+        statistics = compare_statistics(
+            {name: dataset["general_statistics"] for name, dataset in datasets.items()}
+        )
+        numeric_codes = common_numeric_codes(
+            {name: dataset["numeric_summary"] for name, dataset in datasets.items()}
+        )
+        bar_height = max(400, 12 * len(datasets) * len(codes))
+        results = html.Div(
+            [
+                html.H3(children="General statistics"),
+                comparison_table(statistics),
+                html.H3(
+                    children=f"Top {top_n} codes of every dataset, by the spread of "
+                    f"their share"
+                ),
+                dcc.Graph(
+                    figure=share_bar_figure(codes, "code", shares, height=bar_height)
+                ),
+                comparison_table(codes),
+                html.H3(children="Coding dictionaries"),
+                dcc.Graph(
+                    figure=share_bar_figure(
+                        coding_dicts,
+                        "coding_dict",
+                        shares,
+                        height=max(400, 12 * len(datasets) * len(coding_dicts)),
+                    )
+                ),
+                comparison_table(coding_dicts),
+                html.H3(children=f"Codes per {level}"),
+                dcc.Graph(figure=share_time_figure(over_time, shares)),
+                comparison_table(over_time),
+            ]
+        )
+        return (
+            results,
+            "",
+            file_paths,
+            numeric_codes,
+            numeric_codes[0] if numeric_codes else None,
+        )
 
-            # Convert Polars DataFrame to Pandas DataFrame
-            general_statistics_df = general_statistics.to_pandas()
+    @instrumented_callback(
+        Output("fig_compare_numeric", "figure"),
+        Output("compare-numeric-table", "children"),
+        Input("compare-code", "value"),
+        State("compare-datasets", "data"),
+    )
+    def update_compare_numeric(code, file_paths):
+        """Overlays the numeric values of a code in the compared datasets, re-binned
+        from their cached histograms to shared bins."""
+        if not code or not file_paths:
+            return {}, None
+        table, edges, counts = compare_numeric(
+            {
+                name: get_cached_dataset(file_path)["numeric_summary"]
+                for name, file_path in zip(dataset_labels(file_paths), file_paths)
+            },
+            code,
+        )
+        if table is None:
+            return {}, None
+        figure = go.Figure(
+            [
+                histogram_bar(edges, values, "probability", name=name, opacity=0.6)
+                for name, values in counts.items()
+            ]
+        ).update_layout(
+            title=f"Numerical distribution for code {code}",
+            xaxis_title="numeric_value",
+            yaxis_title="probability",
+            barmode="overlay",
+            bargap=0,
+        )
+        return figure, comparison_table(table)
 
-            # Apply formatting only to numerical columns
-            general_statistics_df[
-                general_statistics_df.select_dtypes(include=["number"]).columns
-            ] = general_statistics_df.select_dtypes(include=["number"]).map(
-                lambda x: f"{x:,}"
-            )
+    @instrumented_callback(
+        Output("cohort-split", "options"),
+        Output("cohort-split", "value"),
+        Output("cohort-task", "options"),
+        Output("cohort-task", "value"),
+        Output("cohort-window", "min_date_allowed"),
+        Output("cohort-window", "max_date_allowed"),
+        Output("cohort-window", "start_date"),
+        Output("cohort-window", "end_date"),
+        Input("hidden-file-path", "value"),
+    )
+    def update_cohort_options(file_path):
+        """Lists the splits and tasks of a newly selected dataset and clears the
+        cohort filter."""
+        if not file_path:
+            return [], None, [], None, None, None, None, None
+        days = (
+            registry.get(file_path)["time_pyramid"]
+            .filter(pl.col("level") == "day")["period"]
+            .cast(pl.Date)
+        )
+        first, last = (None, None) if days.is_empty() else (days.min(), days.max())
+        return (
+            list_splits(file_path),
+            None,
+            list_tasks(file_path),
+            None,
+            first,
+            last,
+            None,
+            None,
+        )
+
+    @instrumented_callback(
+        Output("cohort-filter", "data"),
+        Input("cohort-split", "value"),
+        Input("cohort-task", "value"),
+        Input("cohort-window", "start_date"),
+        Input("cohort-window", "end_date"),
+        State("cohort-filter", "data"),
+    )
+    def update_cohort_filter(split, task, start, end, current):
+        cohort = canonical_cohort(
+            {"split": split, "task": task, "start": start, "end": end}
+        )
+        # Unchanged filters (e.g. clearing an empty filter) do not redraw the tabs
+        return no_update if cohort == current else cohort
 
-            # Ensure all values are of type string, number, or boolean
-            general_statistics_df = general_statistics_df.astype(str)
+    @instrumented_callback(
+        Output("general-stats", "children"),
+        Input("hidden-file-path", "value"),
+        Input("cohort-filter", "data"),
+    )
+    def update_general_stats(file_path, cohort):
+        if file_path:
+            dataset = get_dataset(file_path, cohort)
+            if dataset is None:
+                return html.Div(
+                    "No events match the cohort filter.", style={"textAlign": "center"}
+                )
+            general_statistics = dataset["general_statistics"]
+            metadata = dataset.metadata
 
-            stats_data = general_statistics_df.to_dict(orient="records")
-            stats_columns = [
-                {"name": i, "id": i} for i in general_statistics_df.columns
+            # Table cells are strings, numbers get thousands separators
+            approximations = dataset.get("approximations") or {}
+            stats_data = [
+                {
+                    column: format_statistic(value, approximations.get(column))
+                    for column, value in row.items()
+                }
+                for row in general_statistics.to_dicts()
             ]
+            stats_columns = [{"name": i, "id": i} for i in general_statistics.columns]
 
-            metadata_df = metadata.to_pandas()
-            metadata_data = metadata_df.to_dict(orient="records")
-            metadata_columns = [{"name": i, "id": i} for i in metadata_df.columns]
+            metadata_data = metadata.to_dicts()
+            metadata_columns = [{"name": i, "id": i} for i in metadata.columns]
 
             stats_table = dash_table.DataTable(
                 columns=stats_columns,
@@ -586,7 +1068,10 @@ def run_app(cfg: DictConfig = None):
 
             card = html.Div(
                 [
-                    html.H2("Dataset overview", style={"textAlign": "center"}),
+                    html.H2(
+                        "Cohort overview" if cohort else "Dataset overview",
+                        style={"textAlign": "center"},
+                    ),
                     html.Div(
                         metadata_table,
                         style={"display": "block", "marginBottom": "20px"},
@@ -603,142 +1088,151 @@ def run_app(cfg: DictConfig = None):
             )
         return "No folder selected. Please enter a valid folder path to proceed."
 
-    @app.callback(
+    @instrumented_callback(
         Output("fig_code_count_years", "figure"),
-        Input("bins-slider-years", "value"),
+        Input("granularity-dropdown-years", "value"),
         Input("histnorm-dropdown-years", "value"),
+        Input("breakdown-checklist-years", "value"),
+        State("hidden-file-path", "value"),
+        State("cohort-filter", "data"),
     )
-    def update_code_count_years(bins, histnorm):
-        fig_code_count_years = px.histogram(
-            code_count_years,
-            x="Date",
-            y="Amount of codes",
-            nbins=bins,
-            histnorm=histnorm,
-            # title="Code count over the years"
+    def update_code_count_years(level, histnorm, breakdown, file_path, cohort):
+        # The counts of every granularity are precomputed in the time pyramid
+        fig_code_count_years = code_count_time_figure(
+            get_dataset(file_path, cohort)["time_pyramid"],
+            level,
+            histnorm,
+            breakdown=bool(breakdown),
         )
-        return fig_code_count_years
+        return log_payload_size("fig_code_count_years", fig_code_count_years)
 
-    @app.callback(
+    @instrumented_callback(
         Output("fig_code_count_subject", "figure"),
         Input("bins-slider", "value"),
         Input("histnorm-dropdown", "value"),
         Input("scale-dropdown", "value"),
+        State("hidden-file-path", "value"),
+        State("cohort-filter", "data"),
     )
-    def update_code_count_subject(bins, histnorm, scale):
-        fig_code_count_subject = px.histogram(
-            code_count_subject,
-            y="Subject ID",
-            x="Code count",
-            histfunc="count",
-            histnorm=histnorm,
-            # title="Code count distribution per subject",
-            nbins=bins,
-            log_y=True if scale == "log" else False,
-        ).update_layout(yaxis_title="Segment of Subjects")
-        return fig_code_count_subject
-
-    @app.callback(
+    def update_code_count_subject(bins, histnorm, scale, file_path, cohort):
+        code_count_subject = get_dataset(file_path, cohort)["code_count_subjects"]
+        fig_code_count_subject = code_count_subject_figure(
+            code_count_subject, bins, histnorm, scale
+        )
+        return log_payload_size("fig_code_count_subject", fig_code_count_subject)
+
+    @instrumented_callback(
         Output("search-results", "children"),
+        Output("search-table", "columns"),
+        Output("search-table", "data"),
+        Output("search-table", "page_count"),
+        Output("search-table", "page_current"),
         Input("search-button", "n_clicks"),
         Input("search-term", "n_submit"),
+        Input("search-table", "page_current"),
         State("search-term", "value"),
         State("search-options", "value"),
         State("hidden-file-path", "value"),
     )
     def update_search_results(
-        n_clicks, n_submit, search_term, search_options, file_path
+        n_clicks, n_submit, page_current, search_term, search_options, file_path
     ):
         if (n_clicks is None and n_submit == 0) or not search_term:
-            return "Enter a search term to find codes."
+            return "Enter a search term to find codes.", [], [], 0, 0
 
-        code_metadata = load_code_metadata(file_path + "/metadata/codes.parquet")
-        results = search_codes(code_metadata, search_term, search_options)
-        num_rows = 0
-        half = 0
+        limit = cfg.limits.search_results
+        # One more result than shown tells whether the search was cut off
+        results = registry.get(file_path).search(search_term, search_options, limit + 1)
+        truncated = len(results) > limit
+        results = results.head(limit)
         if len(results) == 0:
-            return "No results found."
-        else:
-            num_rows = len(results)
-            half = math.ceil(num_rows / 2)
-            rows_left = [
-                html.Tr(
-                    [html.Td(results[col].to_list()[i]) for col in results.columns],
-                    style={"backgroundColor": "#f2f2f2"} if i % 2 == 0 else {},
-                )
-                for i in range(half)
-            ]
-            rows_right = [
-                html.Tr(
-                    [html.Td(results[col].to_list()[i]) for col in results.columns],
-                    style={"backgroundColor": "#f2f2f2"} if i % 2 == 0 else {},
-                )
-                for i in range(half, num_rows)
-            ]
-
-            table_left = html.Table(
-                [
-                    html.Thead(html.Tr([html.Th(col) for col in results.columns])),
-                    html.Tbody(rows_left),
-                ],
-                style={
-                    "width": "48%",
-                    "display": "inline-block",
-                    "verticalAlign": "top",
-                },
-            )
-            table_right = html.Table(
-                [
-                    html.Thead(html.Tr([html.Th(col) for col in results.columns])),
-                    html.Tbody(rows_right),
-                ],
-                style={
-                    "width": "48%",
-                    "display": "inline-block",
-                    "verticalAlign": "top",
-                    "marginLeft": "4%",
-                },
-            )
-        return [
-            html.Tbody(
-                [
-                    (
-                        f"Found {len(results)} results"
-                        if len(results) < cfg.limits.search_results
-                        else f"Showing first {cfg.limits.search_results} results found. Please refine search"
-                    )
-                ]
-            ),
-            html.Div(
-                [table_left, table_right],
-                style={"display": "flex", "justifyContent": "space-between"},
-            ),
-        ]
+            return "No results found.", [], [], 0, 0
+        # A new search starts at its first page
+        if ctx.triggered_id != "search-table" or page_current is None:
+            page_current = 0
+        page_size = cfg.limits.search_page_size
+        page = results.slice(page_current * page_size, page_size).with_columns(
+            pl.col(pl.List(pl.String)).list.join(", ")
+        )
+        summary = (
+            f"Found {limit}+ results, showing the first {limit}. Please refine search"
+            if truncated
+            else f"Found {len(results)} results"
+        )
+        return (
+            summary,
+            [{"name": column, "id": column} for column in results.columns],
+            page.to_dicts(),
+            math.ceil(len(results) / page_size),
+            page_current,
+        )
 
-    @app.callback(
+    @instrumented_callback(
         Output("fig_top_codes", "figure"),
         Input("top-n-dropdown", "value"),
         Input("scale-dropdown-top-codes", "value"),
+        State("hidden-file-path", "value"),
+        State("cohort-filter", "data"),
     )
-    def update_top_codes(top_n, scale):
-        top_codes_vis = top_codes.limit(top_n)
-        fig_top_codes = px.bar(
+    def update_top_codes(top_n, scale, file_path, cohort):
+        dataset = get_dataset(file_path, cohort)
+        top_codes_vis = dataset["top_codes"].limit(top_n)
+        fig_top_codes = category_bar_figure(
             top_codes_vis,
-            x="count",
-            y="code",
-            orientation="h",
+            "code",
+            "count",
+            log=scale == "log",
+            horizontal=True,
             title=f"Top {top_n} most frequent codes",
-            color="code",
-            log_x=True if scale == "log" else False,
         )
-        return fig_top_codes
+        approximations = dataset.get("approximations") or {}
+        if "top_codes" in approximations:
+            # Count-min estimates only overestimate, by at most the absolute error
+            bounds = approximations["top_codes"]
+            fig_top_codes.update_traces(
+                error_x=dict(
+                    type="data",
+                    symmetric=False,
+                    array=np.zeros(len(top_codes_vis)),
+                    arrayminus=np.full(len(top_codes_vis), bounds["absolute_error"]),
+                )
+            ).update_layout(
+                title=f"Top {top_n} most frequent codes (approximate: counts "
+                f"overestimate by at most {bounds['absolute_error']:,} with "
+                f"{bounds['confidence']:.0%} confidence)"
+            )
+        return log_payload_size("fig_top_codes", fig_top_codes)
 
-    import plotly.graph_objects as go
+    @instrumented_callback(
+        Output("subject-input", "options"),
+        Input("subject-input", "search_value"),
+        Input("subject-filter", "value"),
+        State("subject-input", "value"),
+        State("hidden-file-path", "value"),
+        State("cohort-filter", "data"),
+    )
+    def update_subject_options(
+        search_value, subject_filter, subject_id, file_path, cohort
+    ):
+        subject_ids = get_dataset(file_path, cohort).subject_ids()
+        limit = cfg.limits.subject_ids
+        if search_value:
+            positions = subject_ids.prefix(search_value, limit)
+        elif subject_filter == "random":
+            positions = subject_ids.random(limit)
+        else:
+            positions = subject_ids.most_events(limit)
+        # The selected subject has to stay an option to remain selected
+        selected = None if subject_id is None else subject_ids.find(subject_id)
+        if selected is not None and selected not in positions:
+            positions = np.append(positions, selected)
+        return subject_ids.options(positions)
 
-    @app.callback(
+    @instrumented_callback(
         Output("fig_subject_codes", "figure"),
         Output("task-dropdown", "options"),
         Output("feedback", "children"),
+        Output("timeline-subject", "data"),
         Input("confirm-button", "n_clicks"),
         State("subject-input", "value"),
         State("hidden-file-path", "value"),
@@ -747,168 +1241,131 @@ def run_app(cfg: DictConfig = None):
     def update_subject_codes_and_task_dropdown(
         n_clicks, subject_id, file_path, selected_task
     ):
-        if file_path:
-            tasks_path = (
-                os.path.join(file_path, "tasks")
-                if os.path.isdir(os.path.join(file_path, "tasks"))
-                else (os.path.join(file_path, "labels"))
-            )
-            if os.path.isdir(tasks_path):
-                detected_tasks = []
-                for root, dirs, files in os.walk(tasks_path):
-                    subfolders = set(dirs)
-                    if {"train", "test", "val"} & subfolders:
-                        rel_path = os.path.relpath(root, tasks_path)
-                        detected_tasks.append(rel_path)
-                task_options = [
-                    {"label": task, "value": task} for task in detected_tasks
-                ]
-            else:
-                task_options = []
-        else:
-            task_options = []
-        # if file_path:
-        #     tasks_path = os.path.join(file_path, "tasks")
-        #     if os.path.isdir(tasks_path):
-        #         detected_tasks = [
-        #             f
-        #             for f in os.listdir(tasks_path)
-        #             if os.path.isfile(os.path.join(tasks_path, f))
-        #             or os.path.isdir(os.path.join(tasks_path, f))
-        #         ]
-        #         task_options = [
-        #             {"label": os.path.splitext(task)[0], "value": task}
-        #             for task in detected_tasks
-        #         ]
-        #     else:
-        #         task_options = []
-        # else:
-        #     task_options = []
+        task_options = (
+            [{"label": task, "value": task} for task in list_tasks(file_path)]
+            if file_path
+            else []
+        )
 
         if n_clicks == 0:
-            return go.Figure(), task_options, ""
+            return go.Figure(), task_options, "", None
 
         if subject_id is None:
-            return go.Figure(), task_options, ""
-
-        subject_data = (
-            pl.scan_parquet(return_data_path(file_path))
-            .filter(pl.col("subject_id") == subject_id)
-            .select(
-                pl.col("time"),
-                pl.col("code"),
-                pl.col("numeric_value"),
-                pl.col("text_value"),
-            )
-            .with_columns(
-                pl.col("code").str.split("/").list.first().alias("coding_dict")
-            )
-            .collect()
+            return go.Figure(), task_options, "", None
+
+        figure = subject_timeline(file_path, int(subject_id), selected_task)
+        if figure is None:
+            return go.Figure(), task_options, "Subject ID not found.", None
+        timeline = {"subject_id": int(subject_id), "task": selected_task}
+        return figure, task_options, "", timeline
+
+    @instrumented_callback(
+        Output("fig_subject_codes", "figure", allow_duplicate=True),
+        Input("fig_subject_codes", "relayoutData"),
+        State("timeline-subject", "data"),
+        State("hidden-file-path", "value"),
+        prevent_initial_call=True,
+    )
+    def update_subject_timeline_range(relayout, timeline, file_path):
+        """Redraws the timeline for the visible range after zooming or panning, in
+        full detail once few enough events are visible."""
+        if not relayout or not timeline:
+            return no_update
+        if relayout.get("xaxis.autorange"):
+            x_range = None
+        elif "xaxis.range[0]" in relayout:
+            x_range = (relayout["xaxis.range[0]"], relayout["xaxis.range[1]"])
+        elif "xaxis.range" in relayout:
+            x_range = tuple(relayout["xaxis.range"])
+        else:
+            # Other layout changes (e.g. autosize or the drag mode) keep the figure
+            return no_update
+        if x_range is not None:
+            x_range = tuple(datetime.fromisoformat(str(value)) for value in x_range)
+        figure = subject_timeline(
+            file_path, timeline["subject_id"], timeline["task"], x_range
         )
+        return no_update if figure is None else figure
 
-        if subject_data.is_empty():
-            return go.Figure(), task_options, "Subject ID not found."
-
-        fig_subject_codes = px.scatter(
-            subject_data,
-            x="time",
-            y="code",
-            color="coding_dict",
-            title=f"Codes over time for subject {subject_id}",
-            labels={"coding_dict": "Code Category"},
-            hover_data={"code": True, "numeric_value": True, "text_value": True},
+    @instrumented_callback(
+        Output("task-summary", "children"),
+        Input("task-dropdown", "value"),
+        State("hidden-file-path", "value"),
+    )
+    def update_task_summary(task, file_path):
+        summary = registry.get(file_path).get("task_summary")
+        if not task or summary is None:
+            return ""
+        rows = summary.filter(pl.col("Task") == task)
+        if rows.is_empty():
+            return ""
+        formatted = {}
+        for column, value in rows.row(0, named=True).items():
+            if value is None:
+                formatted[column] = "-"
+            elif column == "Label prevalence":
+                formatted[column] = f"{value:.1%}"
+            elif isinstance(value, float):
+                formatted[column] = f"{value:,.2f}"
+            elif isinstance(value, int):
+                formatted[column] = f"{value:,}"
+            else:
+                formatted[column] = str(value)
+        return dash_table.DataTable(
+            columns=[{"name": column, "id": column} for column in formatted],
+            data=[formatted],
+            style_table={"width": "100%"},
+            style_cell={"textAlign": "left", "whiteSpace": "normal"},
         )
 
-        if selected_task and tasks_path and os.path.isdir(tasks_path):
-            # task_file_path = os.path.join(file_path, "tasks", selected_task)
-            task_file_path = os.path.join(tasks_path, selected_task)
-            if os.path.isfile(task_file_path) or os.path.isdir(task_file_path):
-                task_data = pl.scan_parquet(task_file_path + "/**/*.parquet")
-                task_label = task_data.filter(
-                    pl.col("subject_id") == subject_id
-                ).collect()
-                if not task_label.is_empty():
-                    for row in task_label.iter_rows(named=True):
-                        prediction_time_timestamp = (
-                            row["prediction_time"].timestamp() * 1000
-                        )
-                        task_name = os.path.splitext(selected_task)[0]
-                        color = "red" if row.get("boolean_value", False) else "green"
-
-                        hover_text = f"Task: {task_name}<br>Prediction Time: {row['prediction_time']}"
-                        if "boolean_value" in row and row["boolean_value"] is not None:
-                            hover_text += f"<br>Boolean Value: {row['boolean_value']}"
-                        if "integer_value" in row and row["integer_value"] is not None:
-                            hover_text += f"<br>Integer Value: {row['integer_value']}"
-                        if "float_value" in row and row["float_value"] is not None:
-                            hover_text += f"<br>Float Value: {row['float_value']}"
-                        if (
-                            "categorical_value" in row
-                            and row["categorical_value"] is not None
-                        ):
-                            hover_text += (
-                                f"<br>Categorical Value: {row['categorical_value']}"
-                            )
-
-                        fig_subject_codes.add_scatter(
-                            x=[prediction_time_timestamp, prediction_time_timestamp],
-                            y=[0, 1],
-                            mode="lines",
-                            line=dict(color=color, dash="dash"),
-                            customdata=pd.Series(data=row),
-                            hovertemplate=hover_text,
-                            name=task_name + f" {row['prediction_time']}",
-                            yaxis="y2",
-                        )
-                        fig_subject_codes.update_layout(
-                            yaxis2=dict(showticklabels=False)
-                        )
-
-        return fig_subject_codes, task_options, ""
-
-    @app.callback(
+    @instrumented_callback(
         Output("fig_code_distribution", "figure"),
         Input("code-dropdown", "value"),
         Input("num-bins-slider", "value"),
         Input("histnorm-dropdown-code", "value"),
+        State("hidden-file-path", "value"),
+        State("cohort-filter", "data"),
     )
-    def update_code_distribution(code, num_bins, histnorm):
+    def update_code_distribution(code, num_bins, histnorm, file_path, cohort):
         if code is None:
             return {}
-        code_data = numerical_code_data.filter(pl.col("code") == code).collect()
-        # Calculate IQR and boundaries
-        q1 = code_data["numeric_value"].quantile(0.25)
-        q3 = code_data["numeric_value"].quantile(0.75)
-        iqr = q3 - q1
-        lower_bound = q1 - 1.5 * iqr
-        upper_bound = q3 + 1.5 * iqr
-
-        # Calculate the number of bins using the Freedman-Diaconis rule
-        # bin_width = 2 * iqr / np.cbrt(len(code_data))
-
-        fig_code_distribution = px.histogram(
-            code_data,
-            x="numeric_value",
-            title=f"Numerical distribution for code {code}",
-            range_x=[lower_bound, upper_bound],
-            nbins=num_bins,
-            histnorm=histnorm,
+        numeric_summary = get_dataset(file_path, cohort)["numeric_summary"]
+        # Re-bin the cached per-code histogram instead of reading the raw values
+        summary = numeric_summary.filter(pl.col("code") == code).row(0, named=True)
+        edges, counts = rebin(summary, num_bins)
+        outside = summary["underflow"] + summary["overflow"]
+
+        fig_code_distribution = go.Figure(
+            histogram_bar(edges, counts, histnorm, name=code)
+        ).update_layout(
+            title=f"Numerical distribution for code {code} (n={summary['count']:,}, "
+            f"median={summary['quantiles'][50]:.4g}, {outside:,} values outside "
+            f"[{summary['hist_lo']:.4g}, {summary['hist_hi']:.4g}])",
+            xaxis_title="numeric_value",
+            yaxis_title=histnorm or "count",
+            bargap=0,
         )
-        return fig_code_distribution
+        return log_payload_size("fig_code_distribution", fig_code_distribution)
 
-    @app.callback(
+    @instrumented_callback(
         Output("fig_coding_dict", "figure"),
         Input("scale-dropdown", "value"),
+        State("hidden-file-path", "value"),
+        State("cohort-filter", "data"),
     )
-    def update_coding_dict(scale):
-        fig_coding_dict = px.bar(
+    def update_coding_dict(scale, file_path, cohort):
+        coding_dict = get_dataset(file_path, cohort)["coding_dict"]
+        fig_coding_dict = category_bar_figure(
             coding_dict.limit(cfg.limits.coding_dict),
-            x="coding_dict",
-            y="count",
+            "coding_dict",
+            "count",
+            log=scale == "log",
             title="Coding Dictionary Overview",
-            color="coding_dict",
-            log_y=True if scale == "log" else False,
         )
-        return fig_coding_dict
+        return log_payload_size("fig_coding_dict", fig_coding_dict)
+
+    return app
 
-    app.run(debug=cfg.debug, port=cfg.port)
+
+def run_app(cfg: DictConfig = None):
+    create_app(cfg).run(debug=cfg.debug, port=cfg.port)
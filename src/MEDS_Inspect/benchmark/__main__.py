@@ -0,0 +1,69 @@
+import argparse
+import logging
+import tempfile
+
+from .run import BENCHMARKS, run_benchmarks
+from .synthetic import SPLIT_FRACTIONS, generate_dataset
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark MEDS INSPECT on a synthetic (or existing) MEDS dataset."
+    )
+    parser.add_argument(
+        "--file_path",
+        type=str,
+        default=None,
+        help="Benchmark this MEDS dataset instead of generating one (note that the "
+        "cache_cold benchmark rebuilds its cache)",
+    )
+    parser.add_argument("--subjects", type=int, default=1000)
+    parser.add_argument("--events-per-subject", type=int, default=100)
+    parser.add_argument("--vocabulary", type=int, default=1000)
+    parser.add_argument(
+        "--numeric-fraction",
+        type=float,
+        default=0.3,
+        help="Fraction of events (and codes) with numeric values",
+    )
+    parser.add_argument("--shards", type=int, default=2, help="Shards per split")
+    parser.add_argument(
+        "--splits",
+        type=str,
+        default=",".join(SPLIT_FRACTIONS),
+        help="Comma separated split directories, empty for a flat data directory",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--benchmarks",
+        type=str,
+        default=",".join(BENCHMARKS),
+        help=f"Comma separated benchmarks out of {', '.join(BENCHMARKS)}",
+    )
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument(
+        "--output", type=str, default="benchmark_results.json", help="JSON output"
+    )
+    args = parser.parse_args()
+
+    names = [name for name in args.benchmarks.split(",") if name]
+    if args.file_path:
+        run_benchmarks(args.file_path, names, args.repeats, output=args.output)
+        return
+    scale = {
+        "subjects": args.subjects,
+        "events_per_subject": args.events_per_subject,
+        "vocabulary": args.vocabulary,
+        "numeric_fraction": args.numeric_fraction,
+        "shards": args.shards,
+        "splits": [split for split in args.splits.split(",") if split],
+        "seed": args.seed,
+    }
+    with tempfile.TemporaryDirectory(prefix="meds_inspect_benchmark_") as file_path:
+        generate_dataset(file_path, **scale)
+        run_benchmarks(file_path, names, args.repeats, scale=scale, output=args.output)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(message)s")
+    main()
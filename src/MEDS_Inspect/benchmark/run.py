@@ -0,0 +1,541 @@
+import importlib.resources as pkg_resources
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import urllib.error
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import polars as pl
+from omegaconf import OmegaConf
+
+from ..cache.cache_results import (
+    CACHE_FORMATS,
+    cache_results,
+    get_cache_dir,
+    invalidate_cache,
+)
+from ..cache.subject_index import load_subject_events
+from ..code_search import (
+    SEARCH_COLUMNS,
+    CodeSearchIndex,
+    load_code_metadata,
+    search_codes,
+)
+from ..figures import category_bar_figure, subject_timeline_figure
+from ..registry import DatasetRegistry
+from ..utils import peak_rss_mb, private_rss_mb, return_data_path
+
+SEARCH_TERMS = ["lab", "mg/dl", "code 1", "c0000", "^lab//5"]
+SUBJECT_LOOKUPS = 20
+IMPORT_SCRIPT = """
+import sys, time
+start = time.perf_counter()
+import MEDS_Inspect.app
+print(time.perf_counter() - start, "pandas" in sys.modules, "plotly.express" in sys.modules)
+"""
+
+
+def timed(function, repeats):
+    """Calls ``function`` ``repeats`` times and returns the seconds of every call."""
+    seconds = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - start)
+    return seconds
+
+
+def traced_peak(function):
+    """The peak bytes allocated through Python's allocators while calling
+    ``function``; polars' own buffers are not traced."""
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def summarize(seconds):
+    return {
+        "seconds": seconds,
+        "median": statistics.median(seconds),
+        "min": min(seconds),
+    }
+
+
+def bench_cache_cold(file_path, repeats, engines=("sequential", "fused")):
+    """Times cold cache builds with every engine in ``engines``, next to the scans
+    and estimated bytes read that the build report gives for the fused and the
+    sequential plans."""
+    results = {}
+    for engine in engines:
+
+        def build():
+            invalidate_cache(file_path)
+            cache_results(file_path, engine=engine)
+
+        results[engine] = summarize(timed(build, repeats))
+    with open(get_cache_dir(file_path) / "build_report.json") as f:
+        build_report = json.load(f)
+    results["scans"] = {
+        key: value
+        for key, value in build_report.items()
+        if key.startswith(("scans_", "bytes_read_"))
+    }
+    if {"sequential", "fused"} <= set(engines):
+        results["fused_speedup"] = (
+            results["sequential"]["median"] / results["fused"]["median"]
+        )
+    return results
+
+
+def bench_cache_streaming(file_path, repeats, memory_limit_mb=1024):
+    def build():
+        invalidate_cache(file_path)
+        cache_results(file_path, engine="streaming", memory_limit_mb=memory_limit_mb)
+
+    return summarize(timed(build, repeats))
+
+
+def bench_cache_warm(file_path, repeats):
+    cache_results(file_path)
+    return summarize(timed(lambda: cache_results(file_path), repeats))
+
+
+def load_footprint(file_path, cache_format):
+    """Loads a built cache in a fresh process, like a starting app worker."""
+    before = private_rss_mb()
+    start = time.perf_counter()
+    loaded = cache_results(file_path, cache_format=cache_format)
+    seconds = time.perf_counter() - start
+    after = private_rss_mb()
+    del loaded
+    return {
+        "first_load_seconds": seconds,
+        "private_mb": None if before is None else round(after - before, 1),
+    }
+
+
+def bench_cache_load(file_path, repeats):
+    """Times loading a built cache per cache format, with the memory a fresh process
+    holds privately afterwards (memory-mapped files are shared via the page cache)."""
+    results = {}
+    context = multiprocessing.get_context("spawn")
+    for cache_format in CACHE_FORMATS:
+        # Builds the cache in this format, or converts it from another one
+        cache_results(file_path, cache_format=cache_format)
+        results[cache_format] = summarize(
+            timed(lambda: cache_results(file_path, cache_format=cache_format), repeats)
+        )
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            results[cache_format].update(
+                pool.submit(load_footprint, file_path, cache_format).result()
+            )
+    return results
+
+
+def bench_search(file_path, repeats):
+    codes_path = f"{file_path}/metadata/codes.parquet"
+    top_codes = cache_results(file_path)["top_codes"]
+    results = {
+        "index": summarize(
+            timed(lambda: CodeSearchIndex.from_parquet(codes_path, top_codes), repeats)
+        )
+    }
+    index = CodeSearchIndex.from_parquet(codes_path, top_codes)
+    for term in SEARCH_TERMS:
+        results[f"index:{term}"] = summarize(
+            timed(lambda: index.search(term, SEARCH_COLUMNS), repeats)
+        )
+        # The regex scan over codes.parquet that the index replaces
+        results[f"scan:{term}"] = summarize(
+            timed(
+                lambda: search_codes(
+                    load_code_metadata(codes_path), term, ["code", "description"]
+                ),
+                repeats,
+            )
+        )
+    return results
+
+
+def sample_subjects(file_path, count, seed=0):
+    subjects = cache_results(file_path)["code_count_subjects"]["Subject ID"]
+    rng = np.random.default_rng(seed)
+    return rng.choice(subjects.to_numpy(), min(count, len(subjects)), replace=False)
+
+
+def bench_subject_lookup(file_path, repeats):
+    cached_results = cache_results(file_path)
+    columns = ["time", "code", "numeric_value", "text_value"]
+    subject_ids = sample_subjects(file_path, SUBJECT_LOOKUPS)
+
+    def lookup_indexed():
+        for subject_id in subject_ids:
+            load_subject_events(
+                file_path, int(subject_id), cached_results["subject_index"], columns
+            )
+
+    def lookup_scan():
+        for subject_id in subject_ids:
+            pl.scan_parquet(return_data_path(file_path)).filter(
+                pl.col("subject_id") == int(subject_id)
+            ).select(columns).collect()
+
+    results = {}
+    for name, lookup in (("index", lookup_indexed), ("scan", lookup_scan)):
+        seconds = [s / len(subject_ids) for s in timed(lookup, repeats)]
+        results[name] = summarize(seconds)
+    return results
+
+
+def load_config(file_path):
+    cfg = OmegaConf.load(pkg_resources.files("MEDS_Inspect") / "configs/general.yaml")
+    cfg.initial_path = str(file_path)
+    return cfg
+
+
+def callback_requests(file_path):
+    """Requests for every figure callback as ``{name: (output, values)}``; values
+    are given per ``component.property`` and missing ones are sent as ``None``."""
+    cached_results = cache_results(file_path)
+    numeric_codes = cached_results["numeric_summary"]["code"]
+    common = {"hidden-file-path.value": str(file_path)}
+    requests = {
+        "general_stats": ("general-stats", {}),
+        "code_count_years": (
+            "fig_code_count_years",
+            {
+                "granularity-dropdown-years.value": "week",
+                "histnorm-dropdown-years.value": "",
+                "breakdown-checklist-years.value": ["coding_dict"],
+            },
+        ),
+        "code_count_subject": (
+            "fig_code_count_subject",
+            {
+                "bins-slider.value": 50,
+                "histnorm-dropdown.value": "",
+                "scale-dropdown.value": "linear",
+            },
+        ),
+        "top_codes": (
+            "fig_top_codes",
+            {"top-n-dropdown.value": 100, "scale-dropdown-top-codes.value": "linear"},
+        ),
+        "code_distribution": (
+            "fig_code_distribution",
+            {
+                "code-dropdown.value": numeric_codes[0] if len(numeric_codes) else None,
+                "num-bins-slider.value": 50,
+                "histnorm-dropdown-code.value": "",
+            },
+        ),
+        "coding_dict": ("fig_coding_dict", {"scale-dropdown.value": "linear"}),
+        "subject_codes": (
+            "fig_subject_codes",
+            {
+                "confirm-button.n_clicks": 1,
+                "subject-input.value": int(sample_subjects(file_path, 1)[0]),
+            },
+        ),
+        "subject_typeahead": (
+            "subject-input",
+            {
+                "subject-input.search_value": str(sample_subjects(file_path, 1)[0])[:2],
+                "subject-filter.value": "most_events",
+            },
+        ),
+        "search": (
+            "search-results",
+            {
+                "search-button.n_clicks": 1,
+                "search-term.n_submit": 0,
+                "search-table.page_current": 0,
+                "search-term.value": "lab",
+                "search-options.value": SEARCH_COLUMNS,
+            },
+        ),
+    }
+    for tab in range(1, 8):
+        requests[f"tab-{tab}"] = ("tabs-content", {"tabs.value": f"tab-{tab}"})
+    return {
+        name: (output, {**common, **values})
+        for name, (output, values) in requests.items()
+    }
+
+
+def dash_request(dependency, values):
+    def ids(items):
+        return [
+            {
+                "id": item["id"],
+                "property": item["property"],
+                "value": values.get(f"{item['id']}.{item['property']}"),
+            }
+            for item in items
+        ]
+
+    output = dependency["output"]
+    if output.startswith(".."):
+        outputs = [
+            dict(zip(("id", "property"), o.split(".")))
+            for o in output.strip(".").split("...")
+        ]
+    else:
+        outputs = dict(zip(("id", "property"), output.rsplit(".", 1)))
+    first = dependency["inputs"][0]
+    return {
+        "output": output,
+        "outputs": outputs,
+        "inputs": ids(dependency["inputs"]),
+        "state": ids(dependency["state"]),
+        "changedPropIds": [f"{first['id']}.{first['property']}"],
+    }
+
+
+def bench_callbacks(file_path, repeats):
+    """Times every figure callback through the Dash server, including serialization."""
+    from ..app import create_app
+
+    client = create_app(load_config(file_path)).server.test_client()
+    dependencies = client.get("/_dash-dependencies").get_json()
+    results = {}
+    for name, (output, values) in callback_requests(file_path).items():
+        dependency = next(
+            d for d in dependencies if d["output"].strip(".").split(".")[0] == output
+        )
+        body = dash_request(dependency, values)
+        responses = []
+
+        def call():
+            response = client.post("/_dash-update-component", json=body)
+            if response.status_code not in (200, 204):
+                raise RuntimeError(f"Callback {name} failed: {response.status_code}")
+            responses.append(response)
+
+        results[name] = summarize(timed(call, repeats))
+        results[name]["payload_bytes"] = len(responses[-1].data)
+        results[name]["alloc_peak_bytes"] = traced_peak(call)
+    return results
+
+
+def express_figures(dataset, events):
+    """The figures of the top codes, coding dictionary and subject timeline callbacks
+    drawn with plotly.express, which converts every table to pandas."""
+    import plotly.express as px
+
+    return [
+        px.bar(
+            dataset["top_codes"].limit(100),
+            x="count",
+            y="code",
+            orientation="h",
+            color="code",
+        ),
+        px.bar(dataset["coding_dict"], x="coding_dict", y="count", color="coding_dict"),
+        px.scatter(
+            events,
+            x="time",
+            y="code",
+            color="coding_dict",
+            hover_data=["numeric_value", "text_value"],
+            render_mode="webgl",
+        ),
+    ]
+
+
+def native_figures(dataset, events):
+    """The same figures drawn from NumPy buffers of the polars tables."""
+    return [
+        category_bar_figure(
+            dataset["top_codes"].limit(100), "code", "count", horizontal=True
+        ),
+        category_bar_figure(dataset["coding_dict"], "coding_dict", "count"),
+        subject_timeline_figure(events, None, webgl_threshold=0),
+    ]
+
+
+def bench_figures(file_path, repeats):
+    """Compares the time and allocations of building and serializing figures from
+    polars tables directly and through plotly.express (if pandas is installed)."""
+    dataset = DatasetRegistry().get(str(file_path))
+    events = dataset.subject_events(int(sample_subjects(file_path, 1)[0]))
+    builders = {"native": native_figures}
+    try:
+        import pandas  # noqa: F401
+
+        builders["express"] = express_figures
+    except ImportError:
+        logging.warning("pandas is not installed, skipping the plotly.express figures")
+    results = {}
+    for name, builder in builders.items():
+
+        def draw():
+            for figure in builder(dataset, events):
+                figure.to_json()
+
+        results[name] = summarize(timed(draw, repeats))
+        results[name]["alloc_peak_bytes"] = traced_peak(draw)
+    return results
+
+
+def subprocess_env():
+    """The environment of this process, with its import path for child interpreters."""
+    return dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+
+
+def bench_import(file_path, repeats):
+    """Times importing the app in fresh interpreters and records whether the deferred
+    imports (pandas, plotly.express) stayed unloaded."""
+    seconds = []
+    for _ in range(repeats):
+        output = subprocess.run(
+            [sys.executable, "-c", IMPORT_SCRIPT],
+            capture_output=True,
+            text=True,
+            check=True,
+            env=subprocess_env(),
+        ).stdout.split()
+        seconds.append(float(output[0]))
+    result = summarize(seconds)
+    result["pandas_imported"] = output[1] == "True"
+    result["plotly_express_imported"] = output[2] == "True"
+    return result
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_for_response(request, deadline):
+    """Repeats ``request`` until the server answers it and returns the response."""
+    while True:
+        try:
+            return urllib.request.urlopen(request, timeout=60).read()
+        except (urllib.error.URLError, ConnectionError):
+            if time.perf_counter() > deadline:
+                raise
+            time.sleep(0.02)
+
+
+def bench_first_response(file_path, repeats, timeout=120):
+    """Starts the app and times its first response (the page) and its first data (the
+    general statistics of the initial dataset, which load in the background)."""
+    cache_results(file_path)
+    first_response, first_data = [], []
+    for _ in range(repeats):
+        port = free_port()
+        base = f"http://127.0.0.1:{port}"
+        with tempfile.TemporaryDirectory() as run_dir:
+            start = time.perf_counter()
+            process = subprocess.Popen(
+                [
+                    sys.executable,
+                    "-m",
+                    "MEDS_Inspect",
+                    f"port={port}",
+                    f"initial_path={file_path}",
+                    f"hydra.run.dir={run_dir}",
+                ],
+                env=subprocess_env(),
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+            try:
+                deadline = start + timeout
+                wait_for_response(f"{base}/", deadline)
+                first_response.append(time.perf_counter() - start)
+                dependencies = json.loads(
+                    wait_for_response(f"{base}/_dash-dependencies", deadline)
+                )
+                dependency = next(
+                    d for d in dependencies if d["output"] == "general-stats.children"
+                )
+                body = dash_request(
+                    dependency, {"hidden-file-path.value": str(file_path)}
+                )
+                wait_for_response(
+                    urllib.request.Request(
+                        f"{base}/_dash-update-component",
+                        data=json.dumps(body).encode(),
+                        headers={"Content-Type": "application/json"},
+                    ),
+                    deadline,
+                )
+                first_data.append(time.perf_counter() - start)
+            finally:
+                process.terminate()
+                process.wait()
+    return {
+        "first_response": summarize(first_response),
+        "first_data": summarize(first_data),
+    }
+
+
+BENCHMARKS = {
+    "cache_cold": bench_cache_cold,
+    "cache_streaming": bench_cache_streaming,
+    "cache_warm": bench_cache_warm,
+    "cache_load": bench_cache_load,
+    "search": bench_search,
+    "subject_lookup": bench_subject_lookup,
+    "callbacks": bench_callbacks,
+    "figures": bench_figures,
+    "import": bench_import,
+    "first_response": bench_first_response,
+}
+
+
+def run_isolated(name, file_path, repeats):
+    """Runs one benchmark; in a fresh process the peak RSS is that of the benchmark."""
+    logging.basicConfig(level=logging.WARNING)
+    result = BENCHMARKS[name](file_path, repeats)
+    return {"results": result, "peak_rss_mb": peak_rss_mb()}
+
+
+def run_benchmarks(file_path, names=None, repeats=3, scale=None, output=None):
+    """Runs the benchmarks ``names`` (all by default) each in its own process and
+    writes the results as JSON to ``output``."""
+    names = list(BENCHMARKS) if names is None else names
+    report = {
+        "created_at": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "polars": pl.__version__,
+        "platform": platform.platform(),
+        "cpu_count": multiprocessing.cpu_count(),
+        "file_path": str(file_path),
+        "scale": scale,
+        "repeats": repeats,
+        "benchmarks": {},
+    }
+    context = multiprocessing.get_context("spawn")
+    for name in names:
+        logging.info(f"Running benchmark {name}")
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            report["benchmarks"][name] = pool.submit(
+                run_isolated, name, str(file_path), repeats
+            ).result()
+        logging.info(
+            f"{name}: peak RSS {report['benchmarks'][name]['peak_rss_mb']:.0f} MB"
+        )
+    if output is not None:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+        logging.info(f"Wrote benchmark results to {output}")
+    return report
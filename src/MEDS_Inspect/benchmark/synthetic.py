@@ -0,0 +1,213 @@
+import json
+import logging
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import polars as pl
+
+# Fractions of subjects per split, in the layout of MEDS_transforms
+SPLIT_FRACTIONS = {"train": 0.8, "tuning": 0.1, "held_out": 0.1}
+CODE_PREFIXES = ["DIAGNOSIS//ICD//10", "PROCEDURE//ICD//10", "MEDICATION"]
+BIRTH_START = np.datetime64("2030-01-01", "us")
+BIRTH_RANGE_DAYS = 70 * 365
+RECORD_START_YEARS = 18
+
+
+def synthetic_vocabulary(vocabulary, numeric_fraction, rng):
+    """Builds ``vocabulary`` codes; numeric ``LAB`` codes make up ``numeric_fraction``
+    of them, the rest is spread over the other ``CODE_PREFIXES``."""
+    num_labs = int(round(vocabulary * numeric_fraction)) if numeric_fraction else 0
+    num_labs = min(max(num_labs, 1 if numeric_fraction else 0), vocabulary)
+    labs = [f"LAB//{50000 + i}//mg/dL" for i in range(num_labs)]
+    others = [
+        f"{CODE_PREFIXES[i % len(CODE_PREFIXES)]}//C{i:06d}"
+        for i in range(vocabulary - num_labs)
+    ]
+    return pl.DataFrame(
+        {
+            "code": labs + others,
+            "numeric": [True] * len(labs) + [False] * len(others),
+            # Means and spreads of the numeric values per lab
+            "mean": rng.uniform(1, 500, vocabulary),
+            "std": rng.uniform(0.1, 50, vocabulary),
+        }
+    )
+
+
+def zipf_probabilities(size, exponent=1.1):
+    """Code frequencies in EHR data are long tailed."""
+    weights = 1 / np.arange(1, size + 1) ** exponent
+    return weights / weights.sum()
+
+
+def synthetic_events(subject_ids, events_per_subject, codes, numeric_fraction, rng):
+    """Generates the events of ``subject_ids``: a static gender code, a birth event and
+    on average ``events_per_subject`` coded events, sorted by subject and time."""
+    num_subjects = len(subject_ids)
+    counts = np.maximum(rng.poisson(events_per_subject, num_subjects), 1)
+    subjects = np.repeat(subject_ids, counts)
+    births = BIRTH_START + rng.integers(0, BIRTH_RANGE_DAYS, num_subjects).astype(
+        "timedelta64[D]"
+    )
+    # Events are spread over years after the start of a subject's record
+    offsets_hours = rng.exponential(24 * 365 * 5, len(subjects))
+    times = np.repeat(
+        births + np.timedelta64(RECORD_START_YEARS * 365, "D"), counts
+    ) + (offsets_hours * 3600 * 1e6).astype("timedelta64[us]")
+
+    numeric_codes = codes.filter(pl.col("numeric"))
+    other_codes = codes.filter(~pl.col("numeric"))
+    is_numeric = rng.random(len(subjects)) < numeric_fraction
+    if len(numeric_codes) == 0:
+        is_numeric[:] = False
+    if len(other_codes) == 0:
+        is_numeric[:] = True
+    code_index = np.empty(len(subjects), dtype=np.int64)
+    if is_numeric.any():
+        code_index[is_numeric] = rng.choice(
+            len(numeric_codes),
+            is_numeric.sum(),
+            p=zipf_probabilities(len(numeric_codes)),
+        )
+    if (~is_numeric).any():
+        code_index[~is_numeric] = len(numeric_codes) + rng.choice(
+            len(other_codes),
+            (~is_numeric).sum(),
+            p=zipf_probabilities(len(other_codes)),
+        )
+    ordered = pl.concat([numeric_codes, other_codes])
+    means = ordered["mean"].to_numpy()[code_index]
+    stds = ordered["std"].to_numpy()[code_index]
+    numeric_values = np.where(is_numeric, rng.normal(means, stds), np.nan).astype(
+        np.float32
+    )
+
+    events = pl.DataFrame(
+        {
+            "subject_id": subjects,
+            "time": times,
+            "code": ordered["code"].gather(code_index),
+            "numeric_value": numeric_values,
+        }
+    ).with_columns(
+        pl.col("numeric_value").fill_nan(None),
+        pl.lit(None, pl.String).alias("text_value"),
+    )
+    static = pl.DataFrame(
+        {
+            "subject_id": subject_ids,
+            "time": np.full(num_subjects, np.datetime64("NaT"), dtype="datetime64[us]"),
+            "code": np.where(rng.random(num_subjects) < 0.5, "GENDER//F", "GENDER//M"),
+        }
+    )
+    birth = pl.DataFrame(
+        {
+            "subject_id": subject_ids,
+            "time": births,
+            "code": ["MEDS_BIRTH"] * num_subjects,
+        }
+    )
+    return pl.concat([static, birth, events], how="diagonal_relaxed").sort(
+        "subject_id", "time", nulls_last=False, maintain_order=True
+    )
+
+
+def generate_dataset(
+    output_dir,
+    subjects=1000,
+    events_per_subject=100,
+    vocabulary=1000,
+    numeric_fraction=0.3,
+    shards=2,
+    splits=tuple(SPLIT_FRACTIONS),
+    row_group_size=100_000,
+    seed=0,
+):
+    """Writes a synthetic MEDS dataset in the layout of ``assets/MIMIC-IV-DEMO-MEDS``.
+
+    Subjects are assigned to ``splits`` (e.g. ``train``, ``tuning`` and ``held_out``)
+    and every split is written as ``shards`` parquet files in ``data/<split>/``. Without
+    splits the shards are written directly to ``data/``. Returns the output directory.
+    """
+    rng = np.random.default_rng(seed)
+    output_dir = Path(output_dir)
+    (output_dir / "metadata").mkdir(parents=True, exist_ok=True)
+    codes = synthetic_vocabulary(vocabulary, numeric_fraction, rng)
+
+    subject_ids = rng.permutation(subjects).astype(np.int64) + 10_000_000
+    fractions = np.array([SPLIT_FRACTIONS.get(split, 0.1) for split in splits] or [1])
+    bounds = np.round(np.cumsum(fractions / fractions.sum()) * subjects).astype(int)
+    split_subjects = dict(zip(splits or [None], np.split(subject_ids, bounds[:-1])))
+
+    shard_subjects = {}
+    for split, ids in split_subjects.items():
+        for shard, shard_ids in enumerate(np.array_split(np.sort(ids), shards)):
+            if len(shard_ids) == 0:
+                continue
+            key = f"{split}/{shard}" if split else str(shard)
+            path = output_dir / "data" / f"{key}.parquet"
+            path.parent.mkdir(parents=True, exist_ok=True)
+            events = synthetic_events(
+                shard_ids, events_per_subject, codes, numeric_fraction, rng
+            )
+            events.write_parquet(path, row_group_size=row_group_size)
+            shard_subjects[key] = shard_ids.tolist()
+
+    with open(output_dir / "metadata" / ".shards.json", "w") as f:
+        json.dump(shard_subjects, f)
+    pl.DataFrame(
+        {
+            "subject_id": np.concatenate(list(split_subjects.values())),
+            "split": np.repeat(
+                [split or "train" for split in split_subjects],
+                [len(ids) for ids in split_subjects.values()],
+            ),
+        }
+    ).write_parquet(output_dir / "metadata" / "subject_splits.parquet")
+    codes.select(
+        "code",
+        pl.format(
+            "Synthetic {} code {}",
+            pl.col("code").str.split("//").list.first(),
+            pl.int_range(pl.len()),
+        ).alias("description"),
+        pl.concat_list(
+            pl.format("SYNTH/{}", pl.col("code").str.replace_all("//", "/"))
+        ).alias("parent_codes"),
+    ).write_parquet(output_dir / "metadata" / "codes.parquet")
+    with open(output_dir / "metadata" / "dataset.json", "w") as f:
+        json.dump(
+            {
+                "dataset_name": "SYNTHETIC",
+                "dataset_version": "0.0.1",
+                "etl_name": "MEDS_Inspect.benchmark",
+                "etl_version": "0.0.1",
+                "meds_version": "0.3.3",
+                "created_at": datetime.now().isoformat(),
+            },
+            f,
+        )
+
+    # A binary task in the layout of the demo tasks, for the task overlays
+    task_subjects = rng.choice(subject_ids, max(1, subjects // 10), replace=False)
+    (output_dir / "tasks").mkdir(exist_ok=True)
+    pl.DataFrame(
+        {
+            "subject_id": task_subjects,
+            "prediction_time": BIRTH_START
+            + rng.integers(20 * 365, BIRTH_RANGE_DAYS, len(task_subjects)).astype(
+                "timedelta64[D]"
+            ),
+            "boolean_value": rng.random(len(task_subjects)) < 0.1,
+        }
+    ).with_columns(
+        pl.lit(None, pl.Int64).alias("integer_value"),
+        pl.lit(None, pl.Float64).alias("float_value"),
+        pl.lit(None, pl.String).alias("categorical_value"),
+    ).write_parquet(output_dir / "tasks" / "synthetic_task.parquet")
+    logging.info(
+        f"Generated {subjects:,} synthetic subjects in {len(shard_subjects)} shards "
+        f"at {output_dir}"
+    )
+    return output_dir
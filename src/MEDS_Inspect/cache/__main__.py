@@ -1,7 +1,10 @@
 import argparse
 import logging
+import sys
 
-from .cache_results import cache_results
+from ..report import write_report
+from .batch import run_batch
+from .cache_results import CACHE_FORMATS, ENGINES, cache_results, invalidate_cache
 
 
 # @hydra.main(version_base=None, config_path="configs", config_name="general")
@@ -9,11 +12,143 @@ def main():
     parser = argparse.ArgumentParser(
         description="Run caching for the MEDS INSPECT app with a specified file path."
     )
-    parser.add_argument("file_path", type=str, help="The path to the MEDS data folder")
+    parser.add_argument(
+        "file_path", type=str, nargs="?", help="The path to the MEDS data folder"
+    )
+    parser.add_argument(
+        "--invalidate",
+        action="store_true",
+        help="Remove the cache of file_path before caching it again",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=ENGINES,
+        default=None,
+        help="How to plan the aggregation queries (sharded with --workers, fused "
+        "otherwise)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Compute per-shard partial aggregates (sharded engine) or sketches "
+        "(--approximate) in this many processes",
+    )
+    parser.add_argument(
+        "--partition",
+        choices=["shard", "split"],
+        default="shard",
+        help="Compute partial aggregates per shard file or per split directory",
+    )
+    parser.add_argument(
+        "--approximate",
+        action="store_true",
+        help="Approximate distinct counts (HyperLogLog) and top codes (count-min "
+        "sketch) with mergeable sketches instead of exact aggregations, with the "
+        "fused or sequential engine (the others compute them exactly from partials). "
+        "The codes per subject, coding dictionaries, time pyramid and numeric "
+        "summaries stay exact",
+    )
+    parser.add_argument(
+        "--no-numeric-rows",
+        action="store_true",
+        help="Only cache per-code numeric summaries (quantiles and histograms), not "
+        "the raw numeric rows used for drill-down",
+    )
+    parser.add_argument(
+        "--format",
+        choices=list(CACHE_FORMATS),
+        default="parquet",
+        help="File format of the cached aggregates: parquet, or uncompressed Arrow "
+        "IPC files that the app memory-maps, so worker processes on one host share "
+        "the page cache and load almost instantly",
+    )
+    parser.add_argument(
+        "--memory-limit-mb",
+        type=int,
+        default=4096,
+        help="Memory ceiling of the streaming engine: larger shards are aggregated "
+        "with polars' streaming engine and partial aggregates are merged in hash "
+        "buckets that fit it",
+    )
+    parser.add_argument(
+        "--report",
+        action="store_true",
+        help="Also write a static profile of the cached aggregates (index.html and "
+        "profile.json) to .meds_inspect_cache/report, viewable without the app",
+    )
+    parser.add_argument(
+        "--batch",
+        type=str,
+        default=None,
+        help="Cache every dataset matching a glob (quote it) or listed in a manifest "
+        "(a JSON list or one path per line) instead of file_path; datasets whose "
+        "shards are unchanged since their cache was built are skipped",
+    )
+    parser.add_argument(
+        "--batch-workers",
+        type=int,
+        default=4,
+        help="Number of datasets cached at the same time in batch mode",
+    )
+    parser.add_argument(
+        "--cpus",
+        type=int,
+        default=None,
+        help="Polars threads shared by the batch workers (all cores by default); a "
+        "build with more --workers than its share claims one per worker",
+    )
+    parser.add_argument(
+        "--memory-budget-mb",
+        type=int,
+        default=16000,
+        help="Estimated memory shared by the batch workers; datasets too large for it "
+        "are cached with the streaming engine",
+    )
+    parser.add_argument(
+        "--summary",
+        type=str,
+        default=None,
+        help="Write the status, build time and error of every dataset in batch mode "
+        "to this CSV file",
+    )
     args = parser.parse_args()
+    if (args.file_path is None) == (args.batch is None):
+        parser.error("pass either file_path or --batch")
+
+    engine = args.engine
+    if engine is None:
+        engine = "sharded" if args.workers and not args.approximate else "fused"
+    if args.workers and engine != "sharded" and not args.approximate:
+        parser.error(f"--workers does not apply to the {engine} engine")
+    cache_options = dict(
+        engine=engine,
+        workers=args.workers or 1,
+        partition=args.partition,
+        approximate=args.approximate,
+        numeric_rows=not args.no_numeric_rows,
+        memory_limit_mb=args.memory_limit_mb,
+        cache_format=args.format,
+    )
+    if args.batch is not None:
+        summary = run_batch(
+            args.batch,
+            batch_workers=args.batch_workers,
+            cpus=args.cpus,
+            memory_budget_mb=args.memory_budget_mb,
+            report=args.report,
+            summary=args.summary,
+            **cache_options,
+        )
+        # Lets nightly scripts notice failed builds
+        sys.exit(1 if (summary["status"] == "failed").any() else 0)
 
-    file_path = args.file_path if args.file_path else None
-    cache_results(file_path)
+    file_path = args.file_path
+    if args.invalidate:
+        invalidate_cache(file_path)
+    cached_results = cache_results(file_path, **cache_options)
+    if args.report and cached_results is not None:
+        write_report(file_path, cached_results)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,310 @@
+import glob
+import re
+from datetime import datetime
+
+import polars as pl
+import pyarrow.parquet as pq
+
+from ..metrics import collect_query
+from .numeric_summary import numeric_sketch_query
+
+# Columns of the MEDS data each cached aggregate needs to read
+QUERY_COLUMNS = {
+    "general_statistics": ["subject_id", "code"],
+    "code_count_years": ["time"],
+    "code_count_subjects": ["subject_id", "code"],
+    "top_codes": ["code"],
+    "coding_dict": ["code"],
+    "time_pyramid": ["time", "code"],
+    "numerical_code_data": ["code", "numeric_value"],
+    "numeric_summary": ["code", "numeric_value"],
+}
+
+# Counts are stored as 64-bit integers: the sharded and streaming engines sum them
+# over shards, where polars' 32-bit row counts would overflow
+COUNT_DTYPE = pl.UInt64
+COUNT_COLUMNS = {
+    "general_statistics": ["Unique subjects", "Unique events", "Total events"],
+    "code_count_years": ["Amount of codes"],
+    "code_count_subjects": ["Code count"],
+    "top_codes": ["count"],
+    "coding_dict": ["count"],
+    "time_pyramid": ["count"],
+}
+GENERAL_STATISTICS_SCHEMA = {
+    column: COUNT_DTYPE for column in COUNT_COLUMNS["general_statistics"]
+}
+
+MONTH = pl.col("time").dt.truncate("1mo").alias("Date")
+# Months are formatted once they are aggregated, formatting every event is costly
+FORMAT_MONTH = pl.col("Date").dt.strftime("%Y-%m").cast(pl.String)
+CODING_DICT = pl.col("code").str.split("/").list.first().alias("coding_dict")
+# Days since the epoch, the finest level of the time pyramid
+DAY = pl.col("time").dt.date().cast(pl.Int32).alias("day")
+# Levels of the time pyramid and the intervals their periods are truncated to
+TIME_LEVELS = {"day": "1d", "week": "1w", "month": "1mo", "quarter": "1q", "year": "1y"}
+
+
+def general_statistics_query(data):
+    return data.select(
+        pl.col("subject_id").drop_nulls().n_unique().alias("Unique subjects"),
+        pl.col("code").drop_nulls().n_unique().alias("Unique events"),
+        pl.len().alias("Total events"),
+    )
+
+
+def code_count_years_query(data):
+    return (
+        data.group_by(MONTH)
+        .agg(pl.col("time").count().alias("Amount of codes"))
+        .with_columns(FORMAT_MONTH)
+    )
+
+
+def code_count_subjects_query(data):
+    return (
+        data.select(pl.col("subject_id"), pl.col("code"))
+        .group_by(pl.col("subject_id").alias("Subject ID"))
+        .agg(pl.count("code").alias("Code count"))
+    )
+
+
+def top_codes_query(data):
+    return (
+        data.group_by("code")
+        .agg(pl.count("code").alias("count"))
+        .sort("count", descending=True)
+    )
+
+
+def coding_dict_query(data):
+    return (
+        data.with_columns(CODING_DICT)
+        .group_by("coding_dict")
+        .agg(pl.count("coding_dict").alias("count"))
+        .sort("count", descending=True)
+    )
+
+
+def time_pyramid_query(data):
+    """Counts the events per day and coding dictionary, see ``complete_time_pyramid``.
+
+    Events without a time are counted in a null day that is dropped once the counts
+    are completed: filtering them out here would be pushed down into a scan of its own
+    instead of sharing the fused scan.
+    """
+    return data.group_by(DAY, CODING_DICT).agg(pl.len().alias("count"))
+
+
+def numerical_code_data_query(data):
+    return data.filter(
+        (pl.col("numeric_value").is_not_null() & pl.col("code").is_not_null())
+        & pl.col("numeric_value").is_not_nan()
+    ).select(pl.col("code"), pl.col("numeric_value"))
+
+
+QUERIES = {
+    "general_statistics": general_statistics_query,
+    "code_count_years": code_count_years_query,
+    "code_count_subjects": code_count_subjects_query,
+    "top_codes": top_codes_query,
+    "coding_dict": coding_dict_query,
+    "time_pyramid": time_pyramid_query,
+    "numerical_code_data": numerical_code_data_query,
+    "numeric_summary": numeric_sketch_query,
+}
+
+
+# Aggregates as large as the data (every numeric row), which are streamed into the
+# cache instead of being collected in memory
+STREAMED = ("numerical_code_data",)
+
+
+def cast_counts(key, result):
+    """Casts the counts of the aggregate ``key`` to ``COUNT_DTYPE``."""
+    return result.with_columns(
+        pl.col(column).cast(COUNT_DTYPE) for column in COUNT_COLUMNS.get(key, ())
+    )
+
+
+def complete_general_statistics(general_statistics, columns, size_in_mb):
+    return general_statistics.with_columns(
+        pl.Series("Columns", [columns]),
+        pl.lit(round(size_in_mb, 2)).alias("Size (MB)"),
+    )
+
+
+def complete_code_count_years(code_count_years):
+    code_count_years = code_count_years.drop_nulls("Date")
+    if code_count_years.is_empty():
+        return code_count_years
+    # Get the start and end dates from the `code_count_years` DataFrame
+    start_date = datetime.strptime(
+        code_count_years.select(pl.col("Date").min()).item(), "%Y-%m"
+    )
+    end_date = datetime.strptime(
+        code_count_years.select(pl.col("Date").max()).item(), "%Y-%m"
+    )
+
+    # Create a complete date range for the desired period
+    date_range = pl.date_range(
+        start=start_date, end=end_date, interval="1mo", closed="both", eager=True
+    )
+    date_range_df = pl.DataFrame(date_range.alias("Date")).with_columns(
+        pl.col("Date").dt.strftime("%Y-%m").cast(pl.String)
+    )
+
+    # Merge with the existing data and fill missing months with zeros
+    return date_range_df.join(code_count_years, on="Date", how="left").fill_null(0)
+
+
+def complete_time_pyramid(time_pyramid):
+    """Rolls the daily counts up to every level of ``TIME_LEVELS``.
+
+    Periods are keyed by their first day, in days since the epoch. Events without a
+    time are left out.
+    """
+    day = pl.col("day").cast(pl.Date)
+    time_pyramid = time_pyramid.drop_nulls("day")
+    levels = [
+        time_pyramid.group_by(
+            day.dt.truncate(every).cast(pl.Int32).alias("period"), "coding_dict"
+        )
+        .agg(pl.col("count").sum().cast(COUNT_DTYPE))
+        .select(pl.lit(level).alias("level"), "period", "coding_dict", "count")
+        for level, every in TIME_LEVELS.items()
+    ]
+    return pl.concat(levels).sort("level", "period", "coding_dict")
+
+
+def collect_sequential(data, keys):
+    """Collects every requested aggregate with its own query (one scan each). The
+    ``STREAMED`` aggregates are returned as lazy queries."""
+    return {
+        key: QUERIES[key](data)
+        if key in STREAMED
+        else collect_query(key, QUERIES[key](data))
+        for key in keys
+    }
+
+
+# Optimizations of the fused plan, common-subplan elimination shares its scan
+FUSE_OPTIMIZATIONS = {"comm_subplan_elim": True, "comm_subexpr_elim": True}
+CACHE_NODE = re.compile(r"CACHE\[id: (\w+)")
+
+
+def fused_plan(queries):
+    """Unions a dict of lazy queries into a single plan.
+
+    Every result is packed into its own struct column and the results are unioned, so
+    common-subplan elimination shares one cached scan between all queries.
+    """
+    return pl.concat(
+        [
+            query.select(pl.struct(pl.all()).alias(key))
+            for key, query in queries.items()
+        ],
+        how="diagonal",
+    )
+
+
+def fuse(queries, name="fused"):
+    """Collects a dict of lazy queries from a single plan (see ``fused_plan``), timed
+    once under the query label ``name``."""
+    if not queries:
+        return {}
+    fused = collect_query(name, fused_plan(queries), **FUSE_OPTIMIZATIONS)
+    return {
+        key: fused.filter(pl.col(key).is_not_null()).select(pl.col(key).struct.unnest())
+        for key in queries
+    }
+
+
+def fused_queries(data, keys):
+    columns = sorted({column for key in keys for column in QUERY_COLUMNS[key]})
+    base = data.select(columns)
+    return {key: QUERIES[key](base) for key in keys}
+
+
+def collect_fused(data, keys, name="fused"):
+    """Collects all requested aggregates with one scan of the projected columns. The
+    ``STREAMED`` aggregates are returned as lazy queries of their own."""
+    fused = fused_queries(data, [key for key in keys if key not in STREAMED])
+    results = fuse(fused, name)
+    results.update({key: QUERIES[key](data) for key in keys if key in STREAMED})
+    return results
+
+
+def count_scans(plan):
+    """Counts the scans an optimized plan (from ``LazyFrame.explain``) performs.
+
+    A cached subplan is printed under every node that reads it, but only scanned
+    once: the scans under the other occurrences of its cache id are not counted.
+    """
+    scans = 0
+    seen = set()
+    skip_below = None
+    for line in plan.splitlines():
+        indent = len(line) - len(line.lstrip())
+        if skip_below is not None:
+            if indent > skip_below:
+                continue
+            skip_below = None
+        cache = CACHE_NODE.search(line)
+        if cache is not None:
+            if cache.group(1) in seen:
+                skip_below = indent
+            seen.add(cache.group(1))
+        elif "SCAN" in line:
+            scans += 1
+    return scans
+
+
+def count_rows(paths):
+    """Sums the number of rows of parquet files, from their footers."""
+    return sum(pq.ParquetFile(path).metadata.num_rows for path in paths)
+
+
+def estimate_bytes_read(data_path, columns):
+    """Sums the compressed size of the given columns over all shards (from footers)."""
+    total = 0
+    for file in glob.glob(str(data_path)):
+        parquet_metadata = pq.ParquetFile(file).metadata
+        names = [
+            parquet_metadata.schema.column(i).path
+            for i in range(parquet_metadata.num_columns)
+        ]
+        indices = [i for i, name in enumerate(names) if name in columns]
+        for rg in range(parquet_metadata.num_row_groups):
+            row_group = parquet_metadata.row_group(rg)
+            total += sum(row_group.column(i).total_compressed_size for i in indices)
+    return total
+
+
+def scan_report(data_path, keys):
+    """Counts the scans of the sequential and the fused engine in their optimized
+    plans, and estimates the bytes they read. The fused engine streams the
+    ``STREAMED`` aggregates with scans of their own."""
+    data = pl.scan_parquet(data_path)
+    sequential_scans = {key: count_scans(QUERIES[key](data).explain()) for key in keys}
+    sequential_bytes = {
+        key: scans * estimate_bytes_read(data_path, QUERY_COLUMNS[key])
+        for key, scans in sequential_scans.items()
+    }
+    collected = [key for key in keys if key not in STREAMED]
+    streamed = [key for key in keys if key in STREAMED]
+    fused_scans = sum(sequential_scans[key] for key in streamed)
+    fused_bytes = sum(sequential_bytes[key] for key in streamed)
+    if collected:
+        scans = count_scans(
+            fused_plan(fused_queries(data, collected)).explain(**FUSE_OPTIMIZATIONS)
+        )
+        columns = {column for key in collected for column in QUERY_COLUMNS[key]}
+        fused_scans += scans
+        fused_bytes += scans * estimate_bytes_read(data_path, columns)
+    return {
+        "scans_sequential": sum(sequential_scans.values()),
+        "scans_fused": fused_scans,
+        "bytes_read_sequential": sum(sequential_bytes.values()),
+        "bytes_read_fused": fused_bytes,
+    }
@@ -0,0 +1,192 @@
+import glob
+import json
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+
+import polars as pl
+
+from ..metrics import METRICS
+from ..report import write_report
+from ..utils import get_folder_size, is_valid_path
+from .cache_results import get_cache_dir, get_cache_files
+from .jobs import build_cache
+from .manifest import build_manifest, diff_manifests, read_manifest
+
+# Estimated peak memory of a build per MB of parquet data, to admit builds under the
+# memory budget; builds estimated above the budget use the streaming engine instead
+MEMORY_PER_DATA_MB = 4
+MIN_BUILD_MB = 256
+
+
+def list_datasets(source):
+    """Dataset roots matching a glob, or listed in a manifest: a JSON list or a text
+    file with one path per line. Relative paths are relative to the manifest."""
+    path = Path(source)
+    if not path.is_file():
+        return sorted(glob.glob(source))
+    if path.suffix == ".json":
+        with open(path) as f:
+            roots = json.load(f)
+    else:
+        lines = [line.strip() for line in path.read_text().splitlines()]
+        roots = [line for line in lines if line and not line.startswith("#")]
+    return list(dict.fromkeys(str(path.parent / root) for root in roots))
+
+
+def is_up_to_date(file_path, cache_format="parquet", numeric_rows=True):
+    """True if every aggregate is cached and the shards match the cache manifest."""
+    cache_dir = get_cache_dir(file_path)
+    manifest = read_manifest(cache_dir)
+    if manifest is None:
+        return False
+    cache_files = get_cache_files(cache_dir, cache_format)
+    if not all(
+        path.exists()
+        for key, path in cache_files.items()
+        if numeric_rows or key != "numerical_code_data"
+    ):
+        return False
+    current = build_manifest(file_path, manifest, manifest["partials"])
+    return not any(diff_manifests(manifest, current))
+
+
+def estimate_memory_mb(file_path):
+    data_mb = get_folder_size(Path(file_path) / "data") / (1024 * 1024)
+    return max(MIN_BUILD_MB, round(data_mb * MEMORY_PER_DATA_MB))
+
+
+def job_cpus(cache_options, cpus, batch_workers):
+    """The cores a build claims: its share of ``cpus``, or one per process if it
+    computes partials or sketches in more ``workers`` than that."""
+    workers = cache_options.get("workers") or 1
+    return min(cpus, max(workers, cpus // batch_workers, 1))
+
+
+def _batch_job(file_path, cache_options, report, threads):
+    """Builds a cache in a worker process, returns the seconds it took and the metrics
+    recorded meanwhile."""
+    logging.basicConfig(level=logging.INFO)
+    # The process pools of the build split the claimed cores between their workers
+    os.environ["POLARS_MAX_THREADS"] = str(threads)
+    start = time.perf_counter()
+    cached_results = build_cache(file_path, **cache_options)
+    if cached_results is None:
+        raise ValueError(f"Invalid path: {file_path}")
+    if report:
+        write_report(file_path, cached_results)
+    return time.perf_counter() - start, METRICS.drain()
+
+
+def run_batch(
+    source,
+    batch_workers=4,
+    cpus=None,
+    memory_budget_mb=16000,
+    report=False,
+    summary=None,
+    **cache_options,
+):
+    """Builds the caches of every dataset in ``source`` (see ``list_datasets``) in
+    ``batch_workers`` processes that share ``cpus`` polars threads and
+    ``memory_budget_mb``.
+
+    Datasets whose shards are unchanged since their cache was built are skipped.
+    Builds are started largest first, as long as their estimated memory and their
+    cores (see ``job_cpus``) fit what is left of the budgets. Returns a table with the status, time and error of every
+    dataset, which is also written as CSV to ``summary``.
+    """
+    cpus = cpus or os.cpu_count()
+    cache_format = cache_options.get("cache_format", "parquet")
+    numeric_rows = cache_options.get("numeric_rows", True)
+    rows = []
+    pending = []
+    for file_path in list_datasets(source):
+        row = {"dataset": file_path, "status": None, "seconds": None, "error": None}
+        rows.append(row)
+        if not is_valid_path(file_path):
+            row.update(status="failed", error="Not a MEDS dataset")
+        elif is_up_to_date(file_path, cache_format, numeric_rows):
+            row["status"] = "skipped"
+        else:
+            pending.append((row, estimate_memory_mb(file_path)))
+    logging.info(
+        f"Caching {len(pending)} of {len(rows)} datasets in {batch_workers} processes "
+        f"with {cpus} threads and {memory_budget_mb} MB"
+    )
+    pending.sort(key=lambda job: job[1], reverse=True)
+
+    # Spawned workers read the thread count when they import polars
+    previous_threads = os.environ.get("POLARS_MAX_THREADS")
+    os.environ["POLARS_MAX_THREADS"] = str(max(1, cpus // batch_workers))
+    context = multiprocessing.get_context("spawn")
+    free_mb = memory_budget_mb
+    free_cpus = cpus
+    running = {}
+    try:
+        with ProcessPoolExecutor(batch_workers, mp_context=context) as pool:
+            while pending or running:
+                for job in list(pending):
+                    row, memory_mb = job
+                    if len(running) >= batch_workers:
+                        break
+                    if min(memory_mb, memory_budget_mb) > free_mb:
+                        continue
+                    options = dict(cache_options)
+                    threads = job_cpus(options, cpus, batch_workers)
+                    if threads > free_cpus:
+                        continue
+                    if memory_mb > memory_budget_mb:
+                        # The streaming partials give exact statistics and top codes
+                        options.update(
+                            engine="streaming",
+                            memory_limit_mb=memory_budget_mb,
+                            approximate=False,
+                        )
+                        memory_mb = memory_budget_mb
+                    pending.remove(job)
+                    free_mb -= memory_mb
+                    free_cpus -= threads
+                    future = pool.submit(
+                        _batch_job, row["dataset"], options, report, threads
+                    )
+                    running[future] = (row, memory_mb, threads)
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    row, memory_mb, threads = running.pop(future)
+                    free_mb += memory_mb
+                    free_cpus += threads
+                    if future.exception() is not None:
+                        row.update(status="failed", error=str(future.exception()))
+                        logging.error(
+                            f"Caching {row['dataset']} failed: {row['error']}"
+                        )
+                    else:
+                        seconds, metrics = future.result()
+                        METRICS.merge(metrics)
+                        row.update(status="built", seconds=round(seconds, 3))
+                        logging.info(f"Cached {row['dataset']} in {row['seconds']}s")
+    finally:
+        if previous_threads is None:
+            os.environ.pop("POLARS_MAX_THREADS")
+        else:
+            os.environ["POLARS_MAX_THREADS"] = previous_threads
+
+    table = pl.DataFrame(
+        rows,
+        schema={
+            "dataset": pl.String,
+            "status": pl.String,
+            "seconds": pl.Float64,
+            "error": pl.String,
+        },
+    )
+    if summary is not None:
+        table.write_csv(summary)
+        logging.info(f"Wrote the batch summary to {summary}")
+    with pl.Config(tbl_rows=-1, fmt_str_lengths=80):
+        logging.info(f"Batch summary:\n{table}")
+    return table
@@ -1,13 +1,49 @@
-import argparse
+import glob
+import json
 import logging
+import os
 import shutil
-from datetime import datetime
+import time
 from pathlib import Path
 
 import polars as pl
 
-from ..utils import get_folder_size, is_valid_path, return_data_path
-from tqdm.auto import tqdm
+from ..metrics import METRICS, cache_stage, count_lookup
+from ..utils import get_folder_size, is_valid_path, return_data_path, track_memory
+from .aggregations import (
+    QUERIES,
+    cast_counts,
+    collect_fused,
+    collect_sequential,
+    complete_code_count_years,
+    complete_general_statistics,
+    complete_time_pyramid,
+    count_rows,
+    scan_report,
+)
+from .manifest import build_manifest, diff_manifests, read_manifest, write_manifest
+from .numeric_summary import summarize_numeric_sketch
+from .partials import (
+    collect_sharded,
+    get_merged_partials_dir,
+    get_partials_dir,
+    refresh_sharded,
+)
+from .progress import ProgressBar
+from .sketches import collect_sketches, get_sketch_dir, load_approximations
+from .streaming import collect_streaming, get_spill_dir
+from .subject_index import build_subject_index, get_subject_index_path
+from .task_index import build_task_index, get_task_index_dir, load_task_summary
+
+ENGINES = ("sequential", "fused", "sharded", "streaming")
+# File suffix per cache format; Arrow IPC files are stored uncompressed and memory-mapped
+CACHE_FORMATS = {"parquet": ".parquet", "ipc": ".arrow"}
+# Aggregates approximated in approximate mode, the others (including the per-subject
+# group-by of code_count_subjects) are always exact
+SKETCHED = ("general_statistics", "top_codes")
+# Engines that merge exact per-shard partials, from which the sketched aggregates
+# follow at no extra cost
+EXACT_PARTIAL_ENGINES = ("sharded", "streaming")
 
 
 def get_cache_dir(file_path):
@@ -36,150 +72,292 @@ def get_metadata(file_path):
     return metadata
 
 
-def cache_results(file_path):
+def get_cache_files(cache_dir, cache_format="parquet"):
+    suffix = CACHE_FORMATS[cache_format]
+    return {key: cache_dir / f"{key}{suffix}" for key in QUERIES}
+
+
+def write_cache_file(result, path):
+    """Writes a cached aggregate to a temporary file that then replaces ``path``, so
+    processes that memory-mapped the previous file keep reading a consistent copy."""
+    temporary = path.with_name(f".{path.name}.tmp")
+    ipc = path.suffix == CACHE_FORMATS["ipc"]
+    if isinstance(result, pl.LazyFrame):
+        if ipc:
+            result.sink_ipc(temporary, compression=None)
+        else:
+            result.sink_parquet(temporary)
+    elif ipc:
+        result.write_ipc(temporary, compression="uncompressed")
+    else:
+        result.write_parquet(temporary)
+    os.replace(temporary, path)
+
+
+def read_cache_file(path, lazy=False):
+    if path.suffix == CACHE_FORMATS["ipc"]:
+        if lazy:
+            return pl.scan_ipc(path, memory_map=True)
+        # Without rechunking the frame references the memory-mapped buffers
+        return pl.read_ipc(path, memory_map=True, rechunk=False)
+    return pl.scan_parquet(path) if lazy else pl.read_parquet(path)
+
+
+def remove_other_formats(cache_dir, cache_format):
+    for other in CACHE_FORMATS:
+        if other != cache_format:
+            for path in get_cache_files(cache_dir, other).values():
+                path.unlink(missing_ok=True)
+
+
+def convert_cache(cache_dir, cache_format, keys):
+    """Rewrites the aggregates ``keys`` of a cache in another format in
+    ``cache_format``. Returns whether such a cache was found."""
+    target = get_cache_files(cache_dir, cache_format)
+    for other in CACHE_FORMATS:
+        source = get_cache_files(cache_dir, other)
+        if other == cache_format or not all(source[key].exists() for key in keys):
+            continue
+        logging.info(f"Converting the {other} cache in {cache_dir} to {cache_format}")
+        for key in keys:
+            # IPC scans cannot be streamed yet, the memory-mapped frames are written
+            lazy = other == "parquet"
+            write_cache_file(read_cache_file(source[key], lazy=lazy), target[key])
+        remove_other_formats(cache_dir, cache_format)
+        return True
+    return False
+
+
+def write_results(results, cache_files, columns, size_in_mb, progress):
+    for key, result in results.items():
+        result = cast_counts(key, result)
+        if key == "general_statistics":
+            result = complete_general_statistics(result, columns, size_in_mb)
+        elif key == "code_count_years":
+            result = complete_code_count_years(result)
+        elif key == "time_pyramid":
+            result = complete_time_pyramid(result)
+        elif key == "numeric_summary":
+            result = summarize_numeric_sketch(result)
+        write_cache_file(result, cache_files[key])
+        progress.update(1)
+    progress.close()
+
+
+def build_auxiliary(file_path, cache_dir):
+    """Builds the lookup structures that are derived from the data but are not
+    aggregates (e.g. the subject index), if they are missing or outdated."""
+    with cache_stage("Building indexes"):
+        if not get_subject_index_path(cache_dir).exists():
+            build_subject_index(file_path, cache_dir)
+        # Label files change independently of the data, so they are checked every time
+        build_task_index(file_path, cache_dir)
+
+
+def remove_auxiliary(cache_dir):
+    get_subject_index_path(cache_dir).unlink(missing_ok=True)
+    shutil.rmtree(get_task_index_dir(cache_dir), ignore_errors=True)
+
+
+def refresh_cache(file_path, cache_files, manifest, current, workers=1):
+    """Brings a cache built from per-shard partials up to date with the shards."""
+    cache_dir = get_cache_dir(file_path)
+    added, changed, removed = diff_manifests(manifest, current)
+    logging.info(
+        f"Refreshing cache on {file_path}: {len(added)} added, {len(changed)} changed "
+        f"and {len(removed)} removed shards"
+    )
+    start = time.perf_counter()
+    with cache_stage("Refreshing partial aggregates"):
+        results = refresh_sharded(
+            file_path, cache_dir, added, changed, removed, workers
+        )
+    progress = ProgressBar(
+        total=len(cache_files), desc=f"Refreshing {Path(file_path).name}", unit="file"
+    )
+    columns = pl.scan_parquet(return_data_path(file_path)).collect_schema().names()
+    size_in_mb = get_folder_size(file_path) / (1024 * 1024)
+    if not cache_files["numerical_code_data"].exists():
+        # The raw numeric rows were not cached, the numeric summary replaces them
+        results.pop("numerical_code_data")
+    write_results(results, cache_files, columns, size_in_mb, progress)
+    # The refreshed statistics and top codes are exact again
+    shutil.rmtree(get_sketch_dir(cache_dir), ignore_errors=True)
+    index_path = get_subject_index_path(cache_dir)
+    if index_path.exists():
+        build_subject_index(
+            file_path,
+            cache_dir,
+            added + changed,
+            previous=pl.read_parquet(index_path),
+        )
+    write_manifest(cache_dir, current)
+    logging.info(f"Refreshed cache in {time.perf_counter() - start:.2f}s")
+
+
+def cache_results(
+    file_path,
+    engine="fused",
+    workers=1,
+    partition="shard",
+    approximate=False,
+    numeric_rows=True,
+    memory_limit_mb=4096,
+    cache_format="parquet",
+):
     logging.info(f"Attempting to load cached results on {file_path}")
     if not is_valid_path(file_path):
         logging.error(f"Invalid path: {file_path}")
         return None
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine {engine}, choose from {list(ENGINES)}")
+    if cache_format not in CACHE_FORMATS:
+        raise ValueError(
+            f"Unknown cache format {cache_format}, choose from {list(CACHE_FORMATS)}"
+        )
+    if approximate and engine in EXACT_PARTIAL_ENGINES:
+        raise ValueError(
+            f"The {engine} engine computes exact statistics and top codes from its "
+            "partials, approximate them with the fused or sequential engine"
+        )
 
     cache_dir = get_cache_dir(file_path)
-    cache_files = {
-        "general_statistics": cache_dir / "general_statistics.parquet",
-        "code_count_years": cache_dir / "code_count_years.parquet",
-        "code_count_subjects": cache_dir / "code_count_subjects.parquet",
-        "top_codes": cache_dir / "top_codes.parquet",
-        "coding_dict": cache_dir / "coding_dict.parquet",
-        "numerical_code_data": cache_dir / "numerical_code_data.parquet",
+    cache_files = get_cache_files(cache_dir, cache_format)
+    # The raw numeric rows are only needed for drill-down, numeric_summary has the rest
+    required = {
+        key: path
+        for key, path in cache_files.items()
+        if numeric_rows or key != "numerical_code_data"
     }
-
-    # Check if all cached files exist
-    cached_results = {}
-    if all(path.exists() for path in cache_files.values()):
-        cached_results = load_generated_cache(cache_dir, cache_files)
-        return cached_results
-
-    logging.info(f"Running cache_results on {file_path}")
+    manifest = read_manifest(cache_dir)
+    if not all(path.exists() for path in required.values()):
+        convert_cache(cache_dir, cache_format, list(required))
+
+    # The manifest written after computing missing aggregates also vouches for the
+    # cached ones, so they are checked against the current shards first
+    cached = [key for key, path in required.items() if path.exists()]
+    up_to_date = bool(cached)
+    if cached and manifest is None and len(cached) < len(required):
+        logging.warning(
+            "Cache has no shard manifest to check the cached aggregates, "
+            "recomputing all aggregates"
+        )
+        up_to_date = False
+        for path in cache_files.values():
+            path.unlink(missing_ok=True)
+    elif cached and manifest is not None:
+        with cache_stage("Fingerprinting shards"):
+            current = build_manifest(file_path, manifest, manifest["partials"])
+        up_to_date = not any(diff_manifests(manifest, current))
+        if up_to_date:
+            if current != manifest:
+                write_manifest(cache_dir, current)
+        elif manifest["partials"] == "shard":
+            refresh_cache(file_path, cache_files, manifest, current, workers)
+        else:
+            logging.warning(
+                "Shards changed since the cache was built and it has no per-shard "
+                "partials to refresh, recomputing all aggregates"
+            )
+            for path in cache_files.values():
+                path.unlink(missing_ok=True)
+
+    missing = [key for key, path in required.items() if not path.exists()]
+    count_lookup("aggregates", up_to_date and not missing)
+    if not missing:
+        if manifest is None:
+            logging.info("Cache has no shard manifest, it is not checked for changes")
+        build_auxiliary(file_path, cache_dir)
+        return load_generated_cache(cache_dir, cache_files)
+
+    logging.info(f"Running cache_results on {file_path} with the {engine} engine")
     folder_size = get_folder_size(file_path)
     size_in_mb = folder_size / (1024 * 1024)
     logging.info(f"(Size: {size_in_mb:.2f} MB)")
 
-    data_path = (
-        return_data_path(file_path)
-        if return_data_path(file_path)
-        else Exception("Data could not be loaded: check your file setup")
-    )
+    data_path = return_data_path(file_path)
+    if data_path is None:
+        raise Exception("Data could not be loaded: check your file setup")
     data = pl.scan_parquet(data_path)
+    columns = data.collect_schema().names()
 
-    logging.info(f"Columns in the file {data.collect_schema().names()}")
+    logging.info(f"Columns in the file {columns}")
     # Create the cache directory if it does not exist
     cache_dir.mkdir(parents=True, exist_ok=True)
-    progress = tqdm(
-        total=len(cache_files), desc=f"Caching {Path(file_path).name}", unit="file"
+    progress = ProgressBar(
+        total=len(required), desc=f"Caching {Path(file_path).name}", unit="file"
     )
+    progress.update(len(required) - len(missing))
 
-    if not cache_files["general_statistics"].exists():
-        logging.info(f"Running cache_results on {file_path}")
-        # Compute the results and save to cache
-        unique_subjects = data.select(pl.col("subject_id")).unique().count().collect()
-        unique_codes = data.select(pl.col("code")).unique().count().collect()
-
-        general_statistics = pl.DataFrame(
-            {
-                "Unique subjects": unique_subjects.item(),
-                "Unique events": unique_codes.item(),
-                "Total events": data.select(pl.len()).collect().item(),
-                "Columns": [data.collect_schema().names()],
-                "Size (MB)": round(size_in_mb, 2),
-            }
-        )
-        general_statistics.write_parquet(cache_files["general_statistics"])
-        progress.update(1)
-
-    if not cache_files["code_count_years"].exists():
-        logging.info(f"Running cache_results on {file_path}")
-        # Compute the results and save to cache
-        code_count_years = (
-            data.with_columns(
-                pl.col("time").dt.strftime("%Y-%m").cast(pl.String).alias("Date")
-            )
-            .group_by("Date")
-            .agg(pl.count("Date").alias("Amount of codes"))
-            .collect()
-        )
-        # Get the start and end dates from the `code_count_years` DataFrame
-        start_date = datetime.strptime(
-            code_count_years.select(pl.col("Date").min()).item(), "%Y-%m"
-        )
-        end_date = datetime.strptime(
-            code_count_years.select(pl.col("Date").max()).item(), "%Y-%m"
-        )
-
-        # Create a complete date range for the desired period
-        date_range = pl.date_range(
-            start=start_date, end=end_date, interval="1mo", closed="both", eager=True
-        )
-        date_range_df = pl.DataFrame(date_range.alias("Date")).with_columns(
-            pl.col("Date").dt.strftime("%Y-%m").cast(pl.String)
-        )
+    # Distinct counts and top codes come from mergeable sketches in approximate mode
+    sketched = [key for key in missing if approximate and key in SKETCHED]
+    exact = [key for key in missing if key not in sketched]
 
-        # Merge with the existing data
-        complete_code_count_years = date_range_df.join(
-            code_count_years, on="Date", how="left"
-        )
-
-        # Fill missing values with zeros
-        complete_code_count_years = complete_code_count_years.fill_null(0)
-
-        complete_code_count_years.write_parquet(cache_files["code_count_years"])
-        progress.update(1)
-
-    if not cache_files["code_count_subjects"].exists():
-        logging.info(f"Running cache_results on {file_path}")
-        # Compute the results and save to cache
-        code_count_subjects = (
-            data.select(pl.col("subject_id"), pl.col("code"))
-            .group_by(pl.col("subject_id").alias("Subject ID"))
-            .agg(pl.count("code").alias("Code count"))
-            .collect()
-        )
-        code_count_subjects.write_parquet(cache_files["code_count_subjects"])
-        progress.update(1)
-
-    if not cache_files["top_codes"].exists():
-        logging.info(f"Running cache_results on {file_path}")
-        # Compute the results and save to cache
-        top_codes = (
-            data.group_by("code")
-            .agg(pl.count("code").alias("count"))
-            .sort("count", descending=True)
-            .collect()
-        )
-        top_codes.write_parquet(cache_files["top_codes"])
-        progress.update(1)
-
-    if not cache_files["coding_dict"].exists():
-        logging.info(f"Running cache_results on {file_path}")
-        # Compute the results and save to cache
-        coding_dict = (
-            data.with_columns(
-                pl.col("code").str.split("/").list.first().alias("coding_dict")
-            )
-            .group_by("coding_dict")
-            .agg(pl.count("coding_dict").alias("count"))
-            .sort("count", descending=True)
-            .collect()
-        )
-        coding_dict.write_parquet(cache_files["coding_dict"])
-        progress.update(1)
+    start = time.perf_counter()
+    with track_memory(f"Computing aggregates ({engine})") as compute_memory:
+        if engine == "sharded":
+            results = collect_sharded(file_path, cache_dir, workers, partition)
+            results = {key: results[key] for key in exact}
+        else:
+            # Partials from an earlier sharded build no longer match the aggregates
+            shutil.rmtree(get_partials_dir(cache_dir), ignore_errors=True)
+            shutil.rmtree(get_merged_partials_dir(cache_dir), ignore_errors=True)
+            if engine == "streaming":
+                results = collect_streaming(file_path, cache_dir, memory_limit_mb)
+                results = {key: results[key] for key in exact}
+            elif engine == "fused":
+                results = collect_fused(data, exact)
+            else:
+                results = collect_sequential(data, exact)
+        if sketched:
+            sketches = collect_sketches(file_path, cache_dir, workers)
+            results.update({key: sketches[key] for key in sketched})
+        elif "general_statistics" in missing:
+            shutil.rmtree(get_sketch_dir(cache_dir), ignore_errors=True)
+    with track_memory("Writing aggregates") as write_memory:
+        write_results(results, cache_files, columns, size_in_mb, progress)
+    # Aggregates cached in another format are outdated now
+    remove_other_formats(cache_dir, cache_format)
+    # The streamed results were read from the spilled partials until written
+    shutil.rmtree(get_spill_dir(cache_dir), ignore_errors=True)
+    remove_auxiliary(cache_dir)
+    build_auxiliary(file_path, cache_dir)
+    elapsed = time.perf_counter() - start
+    write_manifest(
+        cache_dir,
+        build_manifest(file_path, manifest, partition if engine == "sharded" else None),
+    )
 
-    if not cache_files["numerical_code_data"].exists():
-        logging.info(f"Running cache_results on {file_path}")
-        numerical_code_data = data.filter(
-            (pl.col("numeric_value").is_not_null() & pl.col("code").is_not_null())
-            & pl.col("numeric_value").is_not_nan()
-        ).select(pl.col("code"), pl.col("numeric_value"))
-        numerical_code_data.sink_parquet(cache_files["numerical_code_data"])
-        progress.update(1)
+    report = {
+        "engine": engine,
+        "format": cache_format,
+        "approximate": approximate,
+        "seconds": round(elapsed, 3),
+    }
+    if engine == "sharded":
+        report.update({"workers": workers, "partition": partition})
+    if engine == "streaming":
+        report["memory_limit_mb"] = memory_limit_mb
+    report["peak_memory_mb"] = {
+        "compute": round(compute_memory["peak_mb"]),
+        "write": round(write_memory["peak_mb"]),
+    }
+    report.update(scan_report(data_path, missing))
+    # Every row is read once, counted from the parquet footers
+    METRICS.inc(
+        "meds_inspect_rows_scanned_total",
+        count_rows(glob.glob(str(data_path))),
+        reader="cache_build",
+    )
+    with open(cache_dir / "build_report.json", "w") as f:
+        json.dump(report, f, indent=2)
+    logging.info(
+        f"Computed {len(missing)} aggregates in {elapsed:.2f}s. The fused plan "
+        f"scans the data {report['scans_fused']} time(s), an estimated "
+        f"{report['bytes_read_fused'] / (1024 * 1024):.2f} MB, the sequential plans "
+        f"{report['scans_sequential']} times, "
+        f"{report['bytes_read_sequential'] / (1024 * 1024):.2f} MB."
+    )
 
     # Load the results if they were not loaded from cache
 
@@ -188,37 +366,44 @@ def cache_results(file_path):
 
 
 def load_generated_cache(cache_dir, cache_files):
+    with cache_stage("Loading cache"):
+        return read_generated_cache(cache_dir, cache_files)
+
+
+def read_cached_aggregates(file_path):
+    """Loads the cached aggregates of ``file_path`` in any format as they are, without
+    fingerprinting the shards or computing anything; None if they are not cached."""
+    cache_dir = get_cache_dir(file_path)
+    for cache_format in CACHE_FORMATS:
+        cache_files = get_cache_files(cache_dir, cache_format)
+        if all(
+            path.exists()
+            for key, path in cache_files.items()
+            if key != "numerical_code_data"
+        ):
+            count_lookup("aggregates", True)
+            return load_generated_cache(cache_dir, cache_files)
+    count_lookup("aggregates", False)
+    return None
+
+
+def read_generated_cache(cache_dir, cache_files):
     cached_results = {}
     for key, path in cache_files.items():
         if key == "numerical_code_data":
-            cached_results[key] = pl.scan_parquet(path)
+            cached_results[key] = (
+                read_cache_file(path, lazy=True) if path.exists() else None
+            )
         else:
-            cached_results[key] = pl.read_parquet(path)
+            cached_results[key] = read_cache_file(path)
+    index_path = get_subject_index_path(cache_dir)
+    cached_results["subject_index"] = (
+        pl.read_parquet(index_path) if index_path.exists() else None
+    )
+    cached_results["task_summary"] = load_task_summary(cache_dir)
+    # Error bounds of the values that were approximated with sketches, if any
+    cached_results["approximations"] = load_approximations(cache_dir)
     logging.info(
         f"Cached results already available. Loaded cached results at {cache_dir}"
     )
     return cached_results
-
-
-def main():
-    parser = argparse.ArgumentParser(
-        description="Run cache_results with a specified file path."
-    )
-    parser.add_argument(
-        "--file_path", type=str, help="The path to the MEDS data folder"
-    )
-    parser.add_argument(
-        "--invalidate", action="store_true", help="Invalidate the cache"
-    )
-    args = parser.parse_args()
-
-    file_path = args.file_path
-    if args.invalidate:
-        invalidate_cache(file_path)
-    cache_results(file_path)
-
-
-if __name__ == "__main__":
-    logging.format = "%(asctime)s - %(message)s"
-    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(message)s")
-    main()
@@ -0,0 +1,211 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+import polars as pl
+
+from ..metrics import METRICS, collect_query, count_lookup
+from ..tasks import scan_task
+from .aggregations import (
+    QUERIES,
+    collect_fused,
+    complete_code_count_years,
+    complete_general_statistics,
+    complete_time_pyramid,
+    count_rows,
+)
+from .cache_results import (
+    get_cache_dir,
+    get_metadata_dir,
+    read_cache_file,
+    write_cache_file,
+)
+from .manifest import list_shards, read_manifest
+from .numeric_summary import summarize_numeric_sketch
+from .subject_index import get_subject_index_path
+
+# Fields of a cohort filter; the time window is given as ISO dates, both inclusive
+COHORT_FIELDS = ("split", "task", "start", "end")
+# The raw numeric rows are not needed per cohort, their summary is
+COHORT_AGGREGATES = [key for key in QUERIES if key != "numerical_code_data"]
+
+
+def canonical_cohort(cohort):
+    """Drops unset fields and normalizes values, so equal filters are equal dicts.
+    Returns None if nothing is filtered."""
+    canonical = {
+        field: str(cohort[field]) for field in COHORT_FIELDS if cohort.get(field)
+    }
+    for field in ("start", "end"):
+        if field in canonical:
+            canonical[field] = date.fromisoformat(canonical[field][:10]).isoformat()
+    return canonical or None
+
+
+def cohort_hash(file_path, cohort):
+    """Hashes the canonical filter with the shard fingerprints of the manifest, so
+    memoized cohorts are not reused after the data changed."""
+    digest = hashlib.sha256(json.dumps(cohort, sort_keys=True).encode())
+    manifest = read_manifest(get_cache_dir(file_path))
+    if manifest is not None:
+        for key, shard in sorted(manifest["shards"].items()):
+            digest.update(f"{key}:{shard['hash']}".encode())
+    return digest.hexdigest()[:20]
+
+
+def get_cohorts_dir(file_path):
+    return get_cache_dir(file_path) / "cohorts"
+
+
+def list_splits(file_path):
+    """The splits of a dataset, from ``subject_splits.parquet`` or the shard dirs."""
+    splits_path = get_metadata_dir(file_path) / "subject_splits.parquet"
+    if splits_path.exists():
+        splits = pl.read_parquet(splits_path, columns=["split"])["split"]
+        return sorted(splits.drop_nulls().unique().to_list())
+    parents = {Path(key).parent.as_posix() for key in list_shards(file_path)}
+    return sorted(parents - {"."})
+
+
+def cohort_subjects(file_path, cohort):
+    """The subjects of the split and task of ``cohort``, or None if it has neither."""
+    subjects = []
+    splits_path = get_metadata_dir(file_path) / "subject_splits.parquet"
+    # Without subject_splits.parquet, splits are only told apart by their directory
+    if "split" in cohort and splits_path.exists():
+        subjects.append(
+            pl.scan_parquet(splits_path)
+            .filter(pl.col("split") == cohort["split"])
+            .select("subject_id")
+        )
+    if "task" in cohort:
+        subjects.append(scan_task(file_path, cohort["task"]).select("subject_id"))
+    if not subjects:
+        return None
+    joined = subjects[0].unique()
+    for other in subjects[1:]:
+        joined = joined.join(other.unique(), on="subject_id", how="semi")
+    return collect_query("cohort_subjects", joined)["subject_id"].cast(pl.Int64)
+
+
+def cohort_shards(file_path, cohort, subjects):
+    """The shards that can hold events of the cohort.
+
+    Shards in a split directory only hold subjects of that split, and with the subject
+    index only shards that hold a subject of the cohort are scanned.
+    """
+    shards = list_shards(file_path)
+    if "split" in cohort:
+        in_split = {
+            key: path
+            for key, path in shards.items()
+            if Path(key).parent.as_posix() == cohort["split"]
+        }
+        shards = in_split or shards
+    index_path = get_subject_index_path(get_cache_dir(file_path))
+    if subjects is not None and index_path.exists():
+        cohort_files = set(
+            collect_query(
+                "cohort_shards",
+                pl.scan_parquet(index_path)
+                .filter(pl.col("subject_id").is_in(subjects))
+                .select("shard")
+                .unique(),
+            )["shard"]
+        )
+        shards = {
+            key: path
+            for key, path in shards.items()
+            if path.relative_to(file_path).as_posix() in cohort_files
+        }
+    return list(shards.values())
+
+
+def collect_cohort(file_path, cohort):
+    """Computes the cached aggregates over the events of ``cohort`` only, or returns
+    None if it has no events."""
+    subjects = cohort_subjects(file_path, cohort)
+    shards = cohort_shards(file_path, cohort, subjects)
+    logging.info(f"Computing cohort {cohort} from {len(shards)} shard(s)")
+    if not shards:
+        return None
+    data = pl.scan_parquet([str(shard) for shard in shards])
+    columns = data.collect_schema().names()
+    # The filters are pushed down into the parquet scan (e.g. row group statistics)
+    if subjects is not None:
+        data = data.filter(pl.col("subject_id").is_in(subjects))
+    if "start" in cohort:
+        data = data.filter(pl.col("time") >= datetime.fromisoformat(cohort["start"]))
+    if "end" in cohort:
+        end = datetime.fromisoformat(cohort["end"]) + timedelta(days=1)
+        data = data.filter(pl.col("time") < end)
+    results = collect_fused(data, COHORT_AGGREGATES, name="cohort")
+    # The shards are scanned in full, apart from row groups skipped by statistics
+    METRICS.inc(
+        "meds_inspect_rows_scanned_total",
+        count_rows(shards),
+        reader="cohort",
+    )
+    if results["general_statistics"]["Total events"].item() == 0:
+        return None
+    size_in_mb = sum(shard.stat().st_size for shard in shards) / (1024 * 1024)
+    results["general_statistics"] = complete_general_statistics(
+        results["general_statistics"], columns, size_in_mb
+    )
+    results["code_count_years"] = complete_code_count_years(results["code_count_years"])
+    results["time_pyramid"] = complete_time_pyramid(results["time_pyramid"])
+    results["numeric_summary"] = summarize_numeric_sketch(results["numeric_summary"])
+    return results
+
+
+def load_cohort(file_path, cohort, max_cohorts=32):
+    """Returns the aggregates of ``cohort``, memoized on disk per canonical filter hash.
+
+    The least recently used cohorts are removed once more than ``max_cohorts`` are
+    stored. Returns None if the cohort has no events.
+    """
+    cohorts_dir = get_cohorts_dir(file_path)
+    cohort_dir = cohorts_dir / cohort_hash(file_path, cohort)
+    files = {key: cohort_dir / f"{key}.parquet" for key in COHORT_AGGREGATES}
+    hit = all(path.exists() for path in files.values())
+    count_lookup("cohort_files", hit)
+    if hit:
+        # The modification time of the filter file orders the cohorts by last use
+        os.utime(cohort_dir / "cohort.json")
+        return {key: read_cache_file(path) for key, path in files.items()}
+
+    start = time.perf_counter()
+    results = collect_cohort(file_path, cohort)
+    if results is None:
+        return None
+    # Written to a temporary directory first, so readers never see a partial cohort
+    temporary = cohorts_dir / f".{cohort_dir.name}.{os.getpid()}.tmp"
+    shutil.rmtree(temporary, ignore_errors=True)
+    temporary.mkdir(parents=True)
+    for key, result in results.items():
+        write_cache_file(result, temporary / f"{key}.parquet")
+    with open(temporary / "cohort.json", "w") as f:
+        json.dump(cohort, f, indent=2)
+    try:
+        os.rename(temporary, cohort_dir)
+    except OSError:
+        # Another process stored the same cohort in the meantime
+        shutil.rmtree(temporary, ignore_errors=True)
+    logging.info(f"Computed cohort {cohort} in {time.perf_counter() - start:.2f}s")
+    evict_cohorts(cohorts_dir, max_cohorts)
+    return results
+
+
+def evict_cohorts(cohorts_dir, max_cohorts):
+    stored = sorted(
+        (path for path in cohorts_dir.iterdir() if (path / "cohort.json").exists()),
+        key=lambda path: (path / "cohort.json").stat().st_mtime,
+    )
+    for path in stored[: max(0, len(stored) - max_cohorts)]:
+        shutil.rmtree(path, ignore_errors=True)
+        logging.info(f"Evicted cohort {path.name} from {cohorts_dir}")
@@ -0,0 +1,197 @@
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from ..metrics import METRICS
+from ..utils import resolve_path
+from .cache_results import cache_results, get_cache_dir
+from .progress import report_progress
+
+POLL_SECONDS = 0.5
+
+
+def get_lock_path(cache_dir):
+    return Path(cache_dir) / "build.lock"
+
+
+def get_progress_path(cache_dir):
+    return Path(cache_dir) / "build_progress.json"
+
+
+def write_progress(cache_dir, stage, n, total):
+    """Atomically replaces the progress of the running build."""
+    path = get_progress_path(cache_dir)
+    temporary = path.with_suffix(f".{os.getpid()}.tmp")
+    with open(temporary, "w") as f:
+        json.dump({"stage": stage, "n": n, "total": total}, f)
+    os.replace(temporary, path)
+
+
+def read_progress(cache_dir):
+    try:
+        with open(get_progress_path(cache_dir)) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def _lock_is_stale(lock_path):
+    """A lock is stale if the process that holds it no longer runs on this host."""
+    try:
+        with open(lock_path) as f:
+            owner = json.load(f)
+    except FileNotFoundError:
+        return False
+    except json.JSONDecodeError:
+        # Written by a process that died before finishing the lock file
+        return time.time() - lock_path.stat().st_mtime > 60
+    if owner.get("host") != socket.gethostname():
+        return False
+    try:
+        os.kill(owner["pid"], 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        return False
+    return False
+
+
+def acquire_build_lock(cache_dir):
+    """Returns True if this process may build the cache, False if another one does."""
+    lock_path = get_lock_path(cache_dir)
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        if not _lock_is_stale(lock_path):
+            return False
+        logging.warning(f"Removing stale cache build lock {lock_path}")
+        lock_path.unlink(missing_ok=True)
+        return acquire_build_lock(cache_dir)
+    with os.fdopen(fd, "w") as f:
+        json.dump({"pid": os.getpid(), "host": socket.gethostname()}, f)
+    return True
+
+
+def release_build_lock(cache_dir):
+    get_progress_path(cache_dir).unlink(missing_ok=True)
+    get_lock_path(cache_dir).unlink(missing_ok=True)
+
+
+def is_building(cache_dir):
+    lock_path = get_lock_path(cache_dir)
+    return lock_path.exists() and not _lock_is_stale(lock_path)
+
+
+def build_cache(file_path, on_progress=None, **kwargs):
+    """Builds (or loads) the cache of ``file_path`` unless another process already
+    builds it, in which case that build is followed until it is done.
+
+    ``on_progress(stage, n, total)`` is called with the stages of the ``tqdm`` bars,
+    e.g. ``Caching <dataset>``, and the progress is shared through the cache directory.
+    """
+    cache_dir = get_cache_dir(file_path)
+    if acquire_build_lock(cache_dir):
+        try:
+
+            def listener(stage, n, total):
+                write_progress(cache_dir, stage, n, total)
+                if on_progress is not None:
+                    on_progress(stage, n, total)
+
+            with report_progress(listener):
+                return cache_results(file_path, **kwargs)
+        finally:
+            release_build_lock(cache_dir)
+
+    logging.info(f"The cache of {file_path} is already being built, waiting for it")
+    while is_building(cache_dir):
+        progress = read_progress(cache_dir)
+        if progress is not None and on_progress is not None:
+            on_progress(progress["stage"], progress["n"], progress["total"])
+        time.sleep(POLL_SECONDS)
+    return cache_results(file_path, **kwargs)
+
+
+def _watch_parent(parent_pid):
+    while os.getppid() == parent_pid:
+        time.sleep(1)
+    os._exit(1)
+
+
+def _exit_with_parent():
+    """Stops a pool worker once the app is gone, e.g. after it was terminated."""
+    threading.Thread(target=_watch_parent, args=(os.getppid(),), daemon=True).start()
+
+
+def _build_job(file_path, cache_options):
+    """Builds a cache in a worker process and returns the metrics it recorded, which
+    only the app process serves."""
+    logging.basicConfig(level=logging.INFO)
+    build_cache(file_path, **cache_options)
+    return METRICS.drain()
+
+
+def _merge_job_metrics(job):
+    if not job.cancelled() and job.exception() is None:
+        METRICS.merge(job.result())
+
+
+class BuildJobs:
+    """Builds caches in a pool of spawned processes, one job per dataset path.
+
+    Submitting a path that is already being built returns the running job.
+    ``cache_options`` are passed on to ``cache_results``.
+    """
+
+    def __init__(self, workers=1, **cache_options):
+        self.workers = workers
+        self.cache_options = cache_options
+        self._pool = None
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, file_path):
+        file_path = resolve_path(file_path)
+        with self._lock:
+            job = self._jobs.get(file_path)
+            if job is not None and not job.done():
+                logging.info(f"Reusing the running cache build of {file_path}")
+                return job
+            if self._pool is None:
+                # Polars is multithreaded, so worker processes have to be spawned
+                context = multiprocessing.get_context("spawn")
+                self._pool = ProcessPoolExecutor(
+                    self.workers, mp_context=context, initializer=_exit_with_parent
+                )
+            job = self._pool.submit(_build_job, file_path, self.cache_options)
+            job.add_done_callback(_merge_job_metrics)
+            self._jobs[file_path] = job
+            return job
+
+    def status(self, file_path):
+        """The state of the build of ``file_path`` (``running``, ``done``, ``failed``
+        or ``unknown``) with the stage, ``n`` and ``total`` of its progress."""
+        job = self._jobs.get(resolve_path(file_path))
+        if job is None:
+            return {"state": "unknown"}
+        if not job.done():
+            progress = read_progress(get_cache_dir(file_path)) or {}
+            return {"state": "running", **progress}
+        if job.cancelled():
+            return {"state": "failed", "error": "The build was cancelled"}
+        if job.exception() is not None:
+            return {"state": "failed", "error": str(job.exception())}
+        return {"state": "done"}
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
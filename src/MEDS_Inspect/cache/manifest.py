@@ -0,0 +1,116 @@
+import glob
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+
+from ..utils import return_data_path
+
+MANIFEST_VERSION = 1
+FOOTER_TAIL = 8  # 4 byte footer length + b"PAR1"
+
+
+def get_manifest_path(cache_dir):
+    return Path(cache_dir) / "manifest.json"
+
+
+def list_shards(file_path):
+    """Maps shard keys (e.g. ``train/0``) to their parquet file.
+
+    The shards listed in ``metadata/.shards.json`` are combined with the files found on
+    disk, so shards that were added without updating the metadata are not missed.
+    """
+    data_dir = Path(file_path) / "data"
+    shards = {}
+    shards_json = Path(file_path) / "metadata" / ".shards.json"
+    if shards_json.exists():
+        with open(shards_json) as f:
+            for key in json.load(f):
+                path = data_dir / f"{key}.parquet"
+                if path.exists():
+                    shards[key] = path
+    data_path = return_data_path(file_path)
+    if data_path is not None:
+        for file in glob.glob(str(data_path)):
+            key = Path(file).relative_to(data_dir).with_suffix("").as_posix()
+            shards.setdefault(key, Path(file))
+    return dict(sorted(shards.items()))
+
+
+def hash_shard(path):
+    """Hashes the parquet footer, which holds the offsets, sizes and statistics of every
+    column chunk, so any rewrite of the data changes it without reading the whole file.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(0, size - FOOTER_TAIL))
+        tail = f.read(FOOTER_TAIL)
+        footer_length = int.from_bytes(tail[:4], "little") if len(tail) == 8 else 0
+        f.seek(max(0, size - FOOTER_TAIL - footer_length))
+        digest.update(f.read())
+    digest.update(str(size).encode())
+    return digest.hexdigest()
+
+
+def fingerprint_shards(file_path, previous=None):
+    """Fingerprints every shard, reusing hashes if size and mtime are unchanged."""
+    previous_shards = previous["shards"] if previous else {}
+    fingerprints = {}
+    for key, path in list_shards(file_path).items():
+        stat = path.stat()
+        entry = {
+            "path": path.relative_to(file_path).as_posix(),
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+        }
+        old = previous_shards.get(key, {})
+        if (
+            old.get("size") == entry["size"]
+            and old.get("mtime_ns") == entry["mtime_ns"]
+        ):
+            entry["hash"] = old["hash"]
+        else:
+            entry["hash"] = hash_shard(path)
+        fingerprints[key] = entry
+    return fingerprints
+
+
+def build_manifest(file_path, previous=None, partials=None):
+    return {
+        "version": MANIFEST_VERSION,
+        "partials": partials,
+        "shards": fingerprint_shards(file_path, previous),
+    }
+
+
+def read_manifest(cache_dir):
+    path = get_manifest_path(cache_dir)
+    if not path.exists():
+        return None
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest.get("version") != MANIFEST_VERSION:
+        logging.info(f"Ignoring manifest with unsupported version at {path}")
+        return None
+    return manifest
+
+
+def write_manifest(cache_dir, manifest):
+    with open(get_manifest_path(cache_dir), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+
+def diff_manifests(old, new):
+    """Returns the added, changed and removed shard keys between two manifests."""
+    old_shards, new_shards = old["shards"], new["shards"]
+    added = [key for key in new_shards if key not in old_shards]
+    removed = [key for key in old_shards if key not in new_shards]
+    changed = [
+        key
+        for key in new_shards
+        if key in old_shards and new_shards[key]["hash"] != old_shards[key]["hash"]
+    ]
+    return added, changed, removed
@@ -0,0 +1,230 @@
+import math
+
+import numpy as np
+import polars as pl
+
+# Percentiles stored per code (nearest rank) and the resolution of the stored histogram
+QUANTILES = np.linspace(0, 1, 101)
+HISTOGRAM_BINS = 200
+# Numeric values are counted in fixed bins whose width grows with the magnitude of the
+# values (as in DDSketch), so the sketches of shards merge by summing their counts.
+# Values in one bin differ by at most RELATIVE_ACCURACY relative to their magnitude.
+RELATIVE_ACCURACY = 0.005
+LOG_GAMMA = math.log((1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY))
+# Values closer to zero than this share bin 0
+MIN_MAGNITUDE = 1e-9
+BIN_OFFSET = math.floor(math.log(MIN_MAGNITUDE) / LOG_GAMMA)
+SUMMARY_SCHEMA = {
+    "code": pl.String,
+    "count": pl.UInt64,
+    "quantiles": pl.List(pl.Float64),
+    "min": pl.Float64,
+    "max": pl.Float64,
+    "hist_lo": pl.Float64,
+    "hist_hi": pl.Float64,
+    "underflow": pl.UInt64,
+    "histogram": pl.List(pl.UInt64),
+    "overflow": pl.UInt64,
+}
+# Relative tolerance of the rounding errors of the sums of a sketch bin
+SUM_TOLERANCE = 1e-9
+
+
+def value_bin(value):
+    """The sketch bin of a numeric value: signed by the sign of the value, null for
+    missing, NaN and infinite values."""
+    magnitude = value.abs()
+    index = (magnitude.log() / LOG_GAMMA).ceil() - BIN_OFFSET
+    return (
+        pl.when(~value.is_finite())
+        .then(None)
+        .when(magnitude < MIN_MAGNITUDE)
+        .then(0)
+        .otherwise(value.sign() * index)
+        .cast(pl.Int32)
+    )
+
+
+def numeric_sketch_query(data):
+    """Sketches the numeric values of every code: per bin of ``value_bin`` their count,
+    minimum, maximum, sum and sum of squares.
+
+    Rows without a numeric value are counted in a null bin that is dropped when the
+    sketch is merged, instead of being filtered out: a filter would be pushed down into
+    a scan of its own and not share the scan of the fused engine.
+    """
+    value = pl.col("numeric_value").cast(pl.Float64)
+    return data.group_by("code", value_bin(value).alias("bin")).agg(
+        pl.len().alias("count"),
+        value.min().alias("min"),
+        value.max().alias("max"),
+        value.sum().alias("sum"),
+        (value * value).sum().alias("sum_sq"),
+    )
+
+
+def merge_numeric_sketches(sketches):
+    """Merges numeric sketches (lazy or not), e.g. of several shards, lazily."""
+    return (
+        pl.concat(
+            [
+                sketch.lazy().with_columns(pl.col("count").cast(pl.UInt64))
+                for sketch in sketches
+            ]
+        )
+        .drop_nulls(["code", "bin"])
+        .group_by("code", "bin")
+        .agg(
+            pl.col("count").sum(),
+            pl.col("min").min(),
+            pl.col("max").max(),
+            pl.col("sum").sum(),
+            pl.col("sum_sq").sum(),
+        )
+    )
+
+
+class _SketchBins:
+    """The merged sketch bins of one code, ordered by value.
+
+    A bin whose variance is the largest its minimum, maximum and mean allow only holds
+    values equal to its minimum or its maximum, and their counts follow from its mean.
+    The other bins are taken to hold their minimum and maximum once and the other
+    values spread evenly between the two. This is exact for bins of at most two
+    distinct values (e.g. integers below 200) or of evenly spaced values, and off by
+    at most ``RELATIVE_ACCURACY`` otherwise.
+    """
+
+    def __init__(self, bins):
+        self.counts = bins["count"].to_numpy().astype(np.int64)
+        self.lows = bins["min"].to_numpy()
+        self.highs = bins["max"].to_numpy()
+        n, total = self.counts, bins["sum"].to_numpy()
+        width = self.highs - self.lows
+        # n^2 * variance, and its upper bound n^2 * (mean - min) * (max - mean)
+        spread = n * bins["sum_sq"].to_numpy() - total**2
+        bound = (total - n * self.lows) * (n * self.highs - total)
+        scale = (n * np.maximum(np.abs(self.lows), np.abs(self.highs))) ** 2
+        two_point = (width > 0) & (bound - spread <= SUM_TOLERANCE * scale)
+        at_low = np.clip(
+            np.round((n * self.highs - total) / np.where(width > 0, width, 1)),
+            1,
+            n - 1,
+        ).astype(np.int64)
+        self.low_counts = np.select(
+            [width == 0, two_point], [n, at_low], np.minimum(n, 1)
+        )
+        self.high_counts = np.select(
+            [width == 0, two_point], [0, n - at_low], (n > 1).astype(np.int64)
+        )
+        self.inner_counts = n - self.low_counts - self.high_counts
+        self.gaps = width / (self.inner_counts + 1)
+
+    def values_at(self, ranks):
+        """The values at the given (0-based) ranks."""
+        starts = np.concatenate([[0], np.cumsum(self.counts)[:-1]])
+        bins = np.searchsorted(starts, ranks, side="right") - 1
+        offsets = ranks - starts[bins]
+        inner = (
+            self.lows[bins] + (offsets - self.low_counts[bins] + 1) * self.gaps[bins]
+        )
+        return np.select(
+            [
+                offsets < self.low_counts[bins],
+                offsets >= self.counts[bins] - self.high_counts[bins],
+            ],
+            [self.lows[bins], self.highs[bins]],
+            inner,
+        )
+
+    def count_below(self, values, inclusive=False):
+        """The number of values below (or at, if ``inclusive``) each of ``values``."""
+        values = values[:, None]
+        positions = (values - self.lows) / np.where(self.gaps > 0, self.gaps, 1)
+        if inclusive:
+            inner = np.floor(positions + 1e-9)
+            low, high = values >= self.lows, values >= self.highs
+        else:
+            inner = np.ceil(positions - 1e-9) - 1
+            low, high = values > self.lows, values > self.highs
+        inner = np.clip(inner, 0, self.inner_counts) * (self.gaps > 0)
+        return (inner + low * self.low_counts + high * self.high_counts).sum(axis=1)
+
+
+def _summarize_bins(bins):
+    total = int(bins.counts.sum())
+    quantiles = bins.values_at(np.round(QUANTILES * (total - 1)))
+    q1, q3 = quantiles[25], quantiles[75]
+    lo = max(bins.lows[0], q1 - 1.5 * (q3 - q1))
+    hi = min(bins.highs[-1], q3 + 1.5 * (q3 - q1))
+    # Bins hold the values in [edge, next edge), the last one also the values equal to hi
+    edges = np.linspace(lo, hi, HISTOGRAM_BINS + 1) if hi > lo else np.array([lo])
+    below = bins.count_below(edges).astype(np.int64)
+    below_hi = int(bins.count_below(np.array([hi]), inclusive=True)[0])
+    histogram = np.zeros(HISTOGRAM_BINS, dtype=np.int64)
+    if hi > lo:
+        histogram[:-1] = np.diff(below[:-1])
+        histogram[-1] = below_hi - below[-2]
+    else:
+        histogram[0] = below_hi - below[0]
+    return {
+        "count": total,
+        "quantiles": quantiles.tolist(),
+        "min": bins.lows[0],
+        "max": bins.highs[-1],
+        "hist_lo": lo,
+        "hist_hi": hi,
+        "underflow": int(below[0]),
+        "histogram": histogram.tolist(),
+        "overflow": total - below_hi,
+    }
+
+
+def summarize_numeric_sketch(sketch):
+    """Summarizes the numeric values of every code from their sketch (see
+    ``numeric_sketch_query``), without the raw rows.
+
+    Per code this stores the count, min, max, 101 percentiles and a histogram with
+    ``HISTOGRAM_BINS`` equal-width bins between the Tukey fences (clipped to min and
+    max), plus the number of values below and above that range. Any bin count can then
+    be rendered by re-binning the stored histogram.
+    """
+    merged = merge_numeric_sketches([sketch]).sort("code", "min").collect()
+    rows = [
+        {"code": code, **_summarize_bins(_SketchBins(bins))}
+        for (code,), bins in merged.partition_by(
+            "code", as_dict=True, maintain_order=True
+        ).items()
+    ]
+    return pl.DataFrame(rows, schema=SUMMARY_SCHEMA).sort(
+        "count", "code", descending=[True, False]
+    )
+
+
+def rebin(summary_row, num_bins):
+    """Re-bins the stored histogram of one code into ``num_bins`` equal-width bins.
+
+    Values are assumed to be spread uniformly within each stored bin. Returns the bin
+    edges and counts.
+    """
+    lo, hi = summary_row["hist_lo"], summary_row["hist_hi"]
+    if hi <= lo:
+        edges = np.array([lo - 0.5, lo + 0.5])
+    else:
+        edges = np.linspace(lo, hi, num_bins + 1)
+    return edges, rebin_to(summary_row, edges)
+
+
+def rebin_to(summary_row, edges):
+    """Re-bins the stored histogram of one code into the bins between ``edges``, e.g.
+    bins shared by the same code in several datasets."""
+    lo, hi = summary_row["hist_lo"], summary_row["hist_hi"]
+    histogram = np.asarray(summary_row["histogram"], dtype=np.float64)
+    if hi <= lo:
+        # All values in the histogram range are equal to lo
+        fine_edges = np.array([lo, np.nextafter(lo, np.inf)])
+        histogram = np.array([histogram.sum()])
+    else:
+        fine_edges = np.linspace(lo, hi, len(histogram) + 1)
+    cumulative = np.concatenate([[0.0], np.cumsum(histogram)])
+    return np.diff(np.interp(edges, fine_edges, cumulative))
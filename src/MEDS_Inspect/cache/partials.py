@@ -0,0 +1,258 @@
+import logging
+import multiprocessing
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from pathlib import Path
+
+import polars as pl
+
+from .aggregations import (
+    CODING_DICT,
+    COUNT_DTYPE,
+    DAY,
+    FORMAT_MONTH,
+    GENERAL_STATISTICS_SCHEMA,
+    MONTH,
+    QUERY_COLUMNS,
+    fuse,
+    numerical_code_data_query,
+)
+from .manifest import list_shards
+from .numeric_summary import merge_numeric_sketches, numeric_sketch_query
+from .progress import ProgressBar
+
+# Mergeable partial aggregates: group keys and the columns that are summed. The
+# ``rows`` column tracks whether a key is still present after subtracting partials,
+# the rows of all codes are the total number of events.
+PARTIALS = {
+    "code_count_years": (["Date"], ["Amount of codes", "rows"]),
+    "code_count_subjects": (["Subject ID"], ["Code count", "rows"]),
+    "top_codes": (["code"], ["count", "rows"]),
+    "coding_dict": (["coding_dict"], ["count", "rows"]),
+    "time_pyramid": (["day", "coding_dict"], ["count", "rows"]),
+}
+
+
+def get_partials_dir(cache_dir):
+    return Path(cache_dir) / "partials"
+
+
+def get_merged_partials_dir(cache_dir):
+    return Path(cache_dir) / "merged_partials"
+
+
+def list_partitions(file_path, partition="shard"):
+    """Maps partition keys (e.g. ``held_out/0`` or ``held_out``) to parquet files."""
+    if partition == "shard":
+        return {key: [path] for key, path in list_shards(file_path).items()}
+    if partition != "split":
+        raise ValueError(f"Unknown partition {partition}, use 'shard' or 'split'")
+    partitions = {}
+    for key, path in list_shards(file_path).items():
+        split = Path(key).parent.as_posix()
+        partitions.setdefault(split if split != "." else "data", []).append(path)
+    return partitions
+
+
+def partial_queries(base):
+    return {
+        "code_count_years": base.group_by(MONTH)
+        .agg(pl.col("time").count().alias("Amount of codes"), pl.len().alias("rows"))
+        .with_columns(FORMAT_MONTH),
+        "code_count_subjects": base.group_by(
+            pl.col("subject_id").alias("Subject ID")
+        ).agg(pl.count("code").alias("Code count"), pl.len().alias("rows")),
+        "top_codes": base.group_by("code").agg(
+            pl.count("code").alias("count"), pl.len().alias("rows")
+        ),
+        "coding_dict": base.with_columns(CODING_DICT)
+        .group_by("coding_dict")
+        .agg(pl.count("coding_dict").alias("count"), pl.len().alias("rows")),
+        "time_pyramid": base.group_by(DAY, CODING_DICT).agg(
+            pl.len().alias("count"), pl.len().alias("rows")
+        ),
+        "numeric_summary": numeric_sketch_query(base),
+    }
+
+
+def write_partials(partial_dir, partials):
+    partial_dir = Path(partial_dir)
+    partial_dir.mkdir(parents=True, exist_ok=True)
+    for key, partial in partials.items():
+        partial.write_parquet(partial_dir / f"{key}.parquet")
+
+
+def read_partials(partial_dir):
+    return {
+        key: pl.read_parquet(Path(partial_dir) / f"{key}.parquet") for key in PARTIALS
+    }
+
+
+def compute_partials(files, partial_dir):
+    """Computes and stores the partial aggregates of one partition with a single scan.
+
+    The numeric sketch is only written to ``partial_dir``, it is merged from there with
+    the sketches of the other partitions (see ``merge_numeric_partials``).
+    """
+    columns = sorted({c for columns in QUERY_COLUMNS.values() for c in columns})
+    base = pl.scan_parquet([str(file) for file in files]).select(columns)
+    partials = fuse(partial_queries(base), "partials")
+    write_partials(partial_dir, partials)
+    partials.pop("numeric_summary")
+    return partials
+
+
+def merge_partials(partials, subtract=()):
+    """Sums partial aggregates, minus the partials in ``subtract``."""
+    merged = {}
+    for key, (group_keys, columns) in PARTIALS.items():
+        frames = [partial[key] for partial in partials if key in partial]
+        frames += [
+            partial[key].with_columns(-pl.col(columns).cast(pl.Int64))
+            for partial in subtract
+            if key in partial
+        ]
+        if not frames:
+            continue
+        merged[key] = (
+            pl.concat(
+                [frame.with_columns(pl.col(columns).cast(pl.Int64)) for frame in frames]
+            )
+            .group_by(group_keys)
+            .agg(pl.col(columns).sum())
+            .filter(pl.col("rows") > 0)
+            .with_columns(pl.col(columns).cast(COUNT_DTYPE))
+        )
+    return merged
+
+
+def finalize_partials(merged):
+    """Turns merged partial aggregates into the cached aggregates."""
+    total_events = merged["top_codes"]["rows"].sum()
+    merged = {key: partial.drop("rows") for key, partial in merged.items()}
+    subjects = merged["code_count_subjects"]
+    codes = merged["top_codes"]
+    general_statistics = pl.DataFrame(
+        {
+            "Unique subjects": subjects["Subject ID"].drop_nulls().len(),
+            "Unique events": codes["code"].drop_nulls().len(),
+            "Total events": total_events,
+        },
+        schema=GENERAL_STATISTICS_SCHEMA,
+    )
+    return {
+        "general_statistics": general_statistics,
+        "code_count_years": merged["code_count_years"],
+        "code_count_subjects": subjects,
+        "top_codes": codes.sort("count", descending=True),
+        "coding_dict": merged["coding_dict"].sort("count", descending=True),
+        "time_pyramid": merged["time_pyramid"],
+    }
+
+
+@contextmanager
+def limit_polars_threads(workers):
+    """Splits the available cores, or the ``POLARS_MAX_THREADS`` already set (e.g. by a
+    batch build), between the worker processes."""
+    previous = os.environ.get("POLARS_MAX_THREADS")
+    threads = int(previous or 0) or os.cpu_count() or 1
+    os.environ["POLARS_MAX_THREADS"] = str(max(1, threads // workers))
+    try:
+        yield
+    finally:
+        if previous is None:
+            os.environ.pop("POLARS_MAX_THREADS")
+        else:
+            os.environ["POLARS_MAX_THREADS"] = previous
+
+
+def compute_all_partials(partitions, partials_dir, workers=1):
+    """Computes the partials of every partition, in a process pool if workers > 1."""
+    partial_dirs = {key: Path(partials_dir) / key for key in partitions}
+    results = {}
+    progress = ProgressBar(
+        total=len(partitions), desc="Partial aggregates", unit="shard"
+    )
+    if workers <= 1:
+        for key, files in partitions.items():
+            results[key] = compute_partials(files, partial_dirs[key])
+            progress.update(1)
+    else:
+        # Polars is multithreaded, so worker processes have to be spawned, not forked
+        context = multiprocessing.get_context("spawn")
+        with (
+            limit_polars_threads(workers),
+            ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool,
+        ):
+            futures = {
+                pool.submit(compute_partials, files, partial_dirs[key]): key
+                for key, files in partitions.items()
+            }
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+                progress.update(1)
+    progress.close()
+    return results
+
+
+def merge_numeric_partials(partials_dir, keys):
+    """Merges the numeric sketches of the partitions ``keys``. Their minima and maxima
+    cannot be subtracted, so the (small) sketches of all partitions are merged again."""
+    return merge_numeric_sketches(
+        [
+            pl.scan_parquet(Path(partials_dir) / key / "numeric_summary.parquet")
+            for key in sorted(keys)
+        ]
+    )
+
+
+def scan_numeric_rows(partitions):
+    """The raw numeric rows, which are only cached for drill-down, as a lazy query."""
+    files = [str(file) for files in partitions.values() for file in files]
+    return numerical_code_data_query(pl.scan_parquet(files))
+
+
+def collect_sharded(file_path, cache_dir, workers=1, partition="shard"):
+    """Computes all cached aggregates from per-partition partials.
+
+    The partials of every partition and their sum are kept in the cache directory, so
+    the cache can later be refreshed for changed shards only (see ``refresh_sharded``).
+    """
+    partials_dir = get_partials_dir(cache_dir)
+    shutil.rmtree(partials_dir, ignore_errors=True)
+    partitions = list_partitions(file_path, partition)
+    logging.info(
+        f"Computing partial aggregates for {len(partitions)} partitions "
+        f"with {workers} worker(s)"
+    )
+    partials = compute_all_partials(partitions, partials_dir, workers)
+    merged = merge_partials(list(partials.values()))
+    write_partials(get_merged_partials_dir(cache_dir), merged)
+    results = finalize_partials(merged)
+    results["numeric_summary"] = merge_numeric_partials(partials_dir, partitions)
+    results["numerical_code_data"] = scan_numeric_rows(partitions)
+    return results
+
+
+def refresh_sharded(file_path, cache_dir, added, changed, removed, workers=1):
+    """Updates the stored sum of per-shard partials after shards were added, changed or
+    removed, re-aggregating only the added and changed shards."""
+    partials_dir = get_partials_dir(cache_dir)
+    outdated = [read_partials(partials_dir / key) for key in changed + removed]
+    for key in removed:
+        shutil.rmtree(partials_dir / key)
+    shards = list_partitions(file_path, "shard")
+    fresh = compute_all_partials(
+        {key: shards[key] for key in added + changed}, partials_dir, workers
+    )
+    merged = merge_partials(
+        [read_partials(get_merged_partials_dir(cache_dir)), *fresh.values()],
+        subtract=outdated,
+    )
+    write_partials(get_merged_partials_dir(cache_dir), merged)
+    results = finalize_partials(merged)
+    results["numeric_summary"] = merge_numeric_partials(partials_dir, shards)
+    results["numerical_code_data"] = scan_numeric_rows(shards)
+    return results
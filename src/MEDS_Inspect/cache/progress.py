@@ -0,0 +1,39 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from tqdm.auto import tqdm
+
+# Listeners of the current thread (or task), so concurrent builds of several datasets
+# only report their own progress
+_listeners = ContextVar("progress_listeners", default=())
+
+
+@contextmanager
+def report_progress(listener):
+    """Calls ``listener(stage, n, total)`` whenever a cache progress bar advances.
+
+    The stage is the description of the bar, e.g. ``Caching <dataset>`` or
+    ``Partial aggregates``.
+    """
+    token = _listeners.set((*_listeners.get(), listener))
+    try:
+        yield
+    finally:
+        _listeners.reset(token)
+
+
+class ProgressBar(tqdm):
+    """A tqdm progress bar that also reports to the ``report_progress`` listeners."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._report()
+
+    def update(self, n=1):
+        displayed = super().update(n)
+        self._report()
+        return displayed
+
+    def _report(self):
+        for listener in _listeners.get():
+            listener(self.desc, self.n, self.total)
@@ -0,0 +1,352 @@
+import json
+import logging
+import math
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import polars as pl
+
+from .aggregations import COUNT_DTYPE, GENERAL_STATISTICS_SCHEMA, fuse
+from .manifest import list_shards
+from .partials import limit_polars_threads
+from .progress import ProgressBar
+
+# Sketches hash values with polars, whose hash function is only stable within a version
+HASH_VERSION = f"polars-{pl.__version__}"
+HASH_SEED = 0x5EED
+
+
+def get_sketch_dir(cache_dir):
+    return Path(cache_dir) / "sketches"
+
+
+def hash_values(series):
+    return series.hash(seed=HASH_SEED).to_numpy()
+
+
+def bit_length(values):
+    """Vectorized ``int.bit_length`` for uint64 arrays."""
+    values = values.copy()
+    length = np.zeros(values.shape, dtype=np.uint8)
+    for shift in (32, 16, 8, 4, 2, 1):
+        mask = values >= np.uint64(1 << shift)
+        length[mask] += shift
+        values[mask] >>= np.uint64(shift)
+    return length + (values > 0)
+
+
+def _check_compatible(sketch, other, *attributes):
+    for attribute in ("hash_version", *attributes):
+        if getattr(sketch, attribute) != getattr(other, attribute):
+            raise ValueError(
+                f"Cannot merge {type(sketch).__name__}s with different {attribute}: "
+                f"{getattr(sketch, attribute)} and {getattr(other, attribute)}"
+            )
+
+
+class HyperLogLog:
+    """HyperLogLog distinct counter with ``2**precision`` registers."""
+
+    def __init__(self, precision=14, registers=None, hash_version=HASH_VERSION):
+        self.precision = precision
+        self.hash_version = hash_version
+        self.registers = (
+            np.zeros(1 << precision, dtype=np.uint8) if registers is None else registers
+        )
+
+    @property
+    def relative_error(self):
+        return 1.04 / math.sqrt(len(self.registers))
+
+    def add_hashes(self, hashes):
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        suffix_bits = 64 - self.precision
+        index = (hashes >> np.uint64(suffix_bits)).astype(np.int64)
+        suffix = hashes & np.uint64((1 << suffix_bits) - 1)
+        rank = (suffix_bits - bit_length(suffix) + 1).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def merge(self, other):
+        _check_compatible(self, other, "precision")
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def count(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(int)))
+        zeros = np.count_nonzero(self.registers == 0)
+        if estimate <= 2.5 * m and zeros:
+            # Linear counting is more accurate for small cardinalities
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def save(self, path):
+        np.savez(
+            path,
+            registers=self.registers,
+            meta=json.dumps(
+                {"precision": self.precision, "hash_version": self.hash_version}
+            ),
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as stored:
+            meta = json.loads(str(stored["meta"]))
+            return cls(registers=stored["registers"], **meta)
+
+
+class CountMinSketch:
+    """Count-min sketch; estimates exceed true counts by at most ``epsilon * total``
+    with probability ``1 - delta``."""
+
+    def __init__(
+        self, width=2**16, depth=5, table=None, total=0, hash_version=HASH_VERSION
+    ):
+        self.width = width
+        self.depth = depth
+        self.total = total
+        self.hash_version = hash_version
+        self.table = (
+            np.zeros((depth, width), dtype=np.int64) if table is None else table
+        )
+
+    @property
+    def epsilon(self):
+        return math.e / self.width
+
+    @property
+    def delta(self):
+        return math.exp(-self.depth)
+
+    def _indices(self, hashes):
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        low = hashes & np.uint64(0xFFFFFFFF)
+        high = hashes >> np.uint64(32)
+        # Double hashing derives ``depth`` independent indices from one 64-bit hash
+        return [
+            ((low + np.uint64(row) * high) % np.uint64(self.width)).astype(np.int64)
+            for row in range(self.depth)
+        ]
+
+    def add_hashes(self, hashes, counts):
+        counts = np.asarray(counts, dtype=np.int64)
+        for row, index in enumerate(self._indices(hashes)):
+            self.table[row] += np.bincount(
+                index, weights=counts, minlength=self.width
+            ).astype(np.int64)
+        self.total += int(counts.sum())
+
+    def estimate(self, hashes):
+        return np.min(
+            [self.table[row, index] for row, index in enumerate(self._indices(hashes))],
+            axis=0,
+        )
+
+    def merge(self, other):
+        _check_compatible(self, other, "width", "depth")
+        self.table += other.table
+        self.total += other.total
+        return self
+
+    def save(self, path):
+        np.savez(
+            path,
+            table=self.table,
+            meta=json.dumps(
+                {
+                    "width": self.width,
+                    "depth": self.depth,
+                    "total": self.total,
+                    "hash_version": self.hash_version,
+                }
+            ),
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as stored:
+            meta = json.loads(str(stored["meta"]))
+            return cls(table=stored["table"], **meta)
+
+
+class HeavyHitters:
+    """Tracks the ``capacity`` most frequent codes; counts come from a count-min
+    sketch, candidates from the most frequent codes of every chunk."""
+
+    def __init__(self, capacity=1000, sketch=None, candidates=None):
+        self.capacity = capacity
+        self.sketch = CountMinSketch() if sketch is None else sketch
+        self.candidates = (
+            pl.Series("code", [], dtype=pl.String) if candidates is None else candidates
+        )
+
+    def _prune(self, candidates):
+        candidates = candidates.unique()
+        estimates = self.sketch.estimate(hash_values(candidates))
+        order = np.argsort(-estimates, kind="stable")[: self.capacity]
+        self.candidates = candidates.gather(order)
+
+    def add_counts(self, codes, counts):
+        self.sketch.add_hashes(hash_values(codes), counts)
+        top = codes.gather(
+            np.argsort(-counts.to_numpy(), kind="stable")[: self.capacity]
+        )
+        self._prune(pl.concat([self.candidates, top]))
+
+    def merge(self, other):
+        self.sketch.merge(other.sketch)
+        self._prune(pl.concat([self.candidates, other.candidates]))
+        return self
+
+    def top(self):
+        return pl.DataFrame(
+            {
+                "code": self.candidates,
+                "count": self.sketch.estimate(hash_values(self.candidates)),
+            }
+        ).sort("count", descending=True)
+
+    def save(self, directory):
+        self.sketch.save(Path(directory) / "codes.cms.npz")
+        self.candidates.to_frame().write_parquet(
+            Path(directory) / "heavy_hitters.parquet"
+        )
+
+    @classmethod
+    def load(cls, directory, capacity=1000):
+        return cls(
+            capacity=capacity,
+            sketch=CountMinSketch.load(Path(directory) / "codes.cms.npz"),
+            candidates=pl.read_parquet(Path(directory) / "heavy_hitters.parquet")[
+                "code"
+            ],
+        )
+
+
+class DatasetSketches:
+    """Mergeable sketches of the distinct subjects and codes and the frequent codes."""
+
+    def __init__(self, subjects=None, codes=None, heavy_hitters=None, total=0):
+        self.subjects = HyperLogLog() if subjects is None else subjects
+        self.codes = HyperLogLog() if codes is None else codes
+        self.heavy_hitters = HeavyHitters() if heavy_hitters is None else heavy_hitters
+        self.total = total
+
+    def add_shard(self, shard):
+        data = pl.scan_parquet(shard).select("subject_id", "code")
+        shard = fuse(
+            {
+                "subjects": data.select(pl.col("subject_id").drop_nulls().unique()),
+                "codes": data.drop_nulls("code")
+                .group_by("code")
+                .agg(pl.len().alias("count")),
+                "total": data.select(pl.len()),
+            },
+            "sketch",
+        )
+        self.subjects.add_hashes(hash_values(shard["subjects"]["subject_id"]))
+        self.total += shard["total"].item()
+        code_counts = shard["codes"]
+        self.codes.add_hashes(hash_values(code_counts["code"]))
+        self.heavy_hitters.add_counts(code_counts["code"], code_counts["count"])
+
+    def merge(self, other):
+        self.subjects.merge(other.subjects)
+        self.codes.merge(other.codes)
+        self.heavy_hitters.merge(other.heavy_hitters)
+        self.total += other.total
+        return self
+
+    def approximations(self):
+        """Error bounds of the approximate values, as shown in the dashboard."""
+        cms = self.heavy_hitters.sketch
+        return {
+            "Unique subjects": {"relative_error": self.subjects.relative_error},
+            "Unique events": {"relative_error": self.codes.relative_error},
+            "top_codes": {
+                "absolute_error": math.ceil(cms.epsilon * cms.total),
+                "confidence": 1 - cms.delta,
+            },
+        }
+
+    def save(self, directory):
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        self.subjects.save(directory / "subjects.hll.npz")
+        self.codes.save(directory / "codes.hll.npz")
+        self.heavy_hitters.save(directory)
+        with open(directory / "approximations.json", "w") as f:
+            json.dump({"total": self.total, **self.approximations()}, f, indent=2)
+
+    @classmethod
+    def load(cls, directory):
+        directory = Path(directory)
+        with open(directory / "approximations.json") as f:
+            total = json.load(f)["total"]
+        return cls(
+            subjects=HyperLogLog.load(directory / "subjects.hll.npz"),
+            codes=HyperLogLog.load(directory / "codes.hll.npz"),
+            heavy_hitters=HeavyHitters.load(directory),
+            total=total,
+        )
+
+
+def sketch_shard(shard):
+    sketches = DatasetSketches()
+    sketches.add_shard(shard)
+    return sketches
+
+
+def collect_sketches(file_path, cache_dir, workers=1):
+    """Sketches every shard separately, merges the sketches and stores them.
+
+    Memory is bounded by the distinct subjects and codes of a single shard.
+    """
+    sketches = DatasetSketches()
+    shards = list_shards(file_path)
+    progress = ProgressBar(total=len(shards), desc="Sketching shards", unit="shard")
+    if workers <= 1:
+        for shard in shards.values():
+            sketches.merge(sketch_shard(shard))
+            progress.update(1)
+    else:
+        context = multiprocessing.get_context("spawn")
+        with (
+            limit_polars_threads(workers),
+            ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool,
+        ):
+            for shard_sketches in pool.map(sketch_shard, shards.values()):
+                sketches.merge(shard_sketches)
+                progress.update(1)
+    progress.close()
+    sketches.save(get_sketch_dir(cache_dir))
+    logging.info(
+        f"Approximated {len(shards)} shards: "
+        f"~{sketches.subjects.count():,} subjects, ~{sketches.codes.count():,} codes"
+    )
+    general_statistics = pl.DataFrame(
+        {
+            "Unique subjects": sketches.subjects.count(),
+            "Unique events": sketches.codes.count(),
+            "Total events": sketches.total,
+        },
+        schema=GENERAL_STATISTICS_SCHEMA,
+    )
+    top_codes = sketches.heavy_hitters.top().with_columns(
+        pl.col("count").cast(COUNT_DTYPE)
+    )
+    return {"general_statistics": general_statistics, "top_codes": top_codes}
+
+
+def load_approximations(cache_dir):
+    path = get_sketch_dir(cache_dir) / "approximations.json"
+    if not path.exists():
+        return None
+    with open(path) as f:
+        approximations = json.load(f)
+    approximations.pop("total")
+    return approximations
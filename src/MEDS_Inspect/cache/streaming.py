@@ -0,0 +1,204 @@
+import logging
+import math
+import shutil
+from pathlib import Path
+
+import polars as pl
+
+from ..utils import track_memory
+from .aggregations import (
+    COUNT_DTYPE,
+    GENERAL_STATISTICS_SCHEMA,
+    QUERY_COLUMNS,
+    count_rows,
+)
+from .numeric_summary import merge_numeric_sketches
+from .partials import (
+    PARTIALS,
+    compute_partials,
+    list_partitions,
+    partial_queries,
+    scan_numeric_rows,
+)
+from .progress import ProgressBar
+
+# In-memory size of parquet data relative to its size on disk, to plan with the limit
+EXPANSION = 5
+BUCKET_SEED = 0xB0C
+# Partials are split into at most this many hash buckets at once, the buckets that
+# still do not fit the memory limit are split again
+SPILL_FANOUT = 16
+
+
+def get_spill_dir(cache_dir):
+    return Path(cache_dir) / "spill"
+
+
+def file_size_mb(paths):
+    return sum(Path(path).stat().st_size for path in paths) / (1024 * 1024)
+
+
+def num_buckets(paths, memory_limit_mb, expansion=EXPANSION):
+    """Number of hash buckets so that one bucket of ``paths`` fits the memory limit."""
+    return max(1, math.ceil(file_size_mb(paths) * expansion / memory_limit_mb))
+
+
+def in_bucket(keys, bucket, buckets, seed=BUCKET_SEED):
+    if buckets == 1:
+        return pl.lit(True)
+    return pl.struct(keys).hash(seed) % buckets == bucket
+
+
+def sink_partials(files, partial_dir, memory_limit_mb):
+    """Writes the partial aggregates of one partition to ``partial_dir``.
+
+    Partitions that fit the memory limit are aggregated in one fused in-memory scan,
+    larger ones with polars' streaming engine, one query at a time.
+    """
+    if file_size_mb(files) * EXPANSION <= memory_limit_mb:
+        compute_partials(files, partial_dir)
+        return
+    partial_dir.mkdir(parents=True, exist_ok=True)
+    columns = sorted({c for columns in QUERY_COLUMNS.values() for c in columns})
+    base = pl.scan_parquet([str(file) for file in files]).select(columns)
+    for key, query in partial_queries(base).items():
+        query.sink_parquet(partial_dir / f"{key}.parquet")
+
+
+def sum_partials(key):
+    """Merges the partials of ``key`` (see ``PARTIALS``) by summing their counts."""
+    group_keys, columns = PARTIALS[key]
+    return lambda partials: (
+        partials.group_by(group_keys)
+        .agg(pl.col(columns).cast(pl.Int64).sum())
+        .with_columns(pl.col(columns).cast(COUNT_DTYPE))
+    )
+
+
+def merge_spilled(
+    merge, keys, paths, spill_dir, name, memory_limit_mb, level=0, parent_rows=None
+):
+    """Merges the partials in ``paths`` with ``merge`` one hash bucket of their group
+    ``keys`` at a time, so only one bucket of distinct keys is held in memory.
+
+    Partials that do not fit the memory limit are split into at most ``SPILL_FANOUT``
+    buckets that are spilled to disk, and every bucket is merged the same way: those
+    that still do not fit are split again, with another hash seed, until they fit or
+    hashing no longer splits them. Returns the merged file of every bucket.
+    """
+    rows = count_rows(paths)
+    buckets = min(num_buckets(paths, memory_limit_mb), SPILL_FANOUT, rows)
+    if buckets <= 1 or rows == parent_rows:
+        merged_path = spill_dir / f"{name}.merged.parquet"
+        merge(pl.scan_parquet(paths)).sink_parquet(merged_path)
+        return [str(merged_path)]
+    partials = pl.scan_parquet(paths)
+    merged = []
+    for bucket in range(buckets):
+        bucket_name = f"{name}-{bucket}"
+        bucket_path = spill_dir / f"{bucket_name}.parquet"
+        partials.filter(
+            in_bucket(keys, bucket, buckets, BUCKET_SEED + level)
+        ).sink_parquet(bucket_path)
+        merged += merge_spilled(
+            merge,
+            keys,
+            [bucket_path],
+            spill_dir,
+            bucket_name,
+            memory_limit_mb,
+            level + 1,
+            rows,
+        )
+    return merged
+
+
+def merge_bucketed(merge, keys, partial_files, merged_path, spill_dir, memory_limit_mb):
+    """Merges partials per hash bucket of their group ``keys`` (see ``merge_spilled``)
+    into ``merged_path``."""
+    name = Path(merged_path).stem
+    bucket_paths = merge_spilled(
+        merge, keys, partial_files, spill_dir, name, memory_limit_mb
+    )
+    pl.scan_parquet(bucket_paths).sink_parquet(merged_path)
+    if len(bucket_paths) > 1:
+        logging.info(f"Merged {name} in {len(bucket_paths)} buckets")
+
+
+def collect_streaming(file_path, cache_dir, memory_limit_mb=4096):
+    """Computes all cached aggregates while keeping memory below ``memory_limit_mb``.
+
+    Partial aggregates are computed per shard and spilled to disk, then merged per
+    hash bucket of their group keys. The per-subject counts and numeric rows are
+    returned as scans of the spilled files, so they are streamed into the cache.
+    Remove the spill directory (``get_spill_dir``) once the results are written.
+    """
+    spill_dir = get_spill_dir(cache_dir)
+    shutil.rmtree(spill_dir, ignore_errors=True)
+    partitions = list_partitions(file_path, "shard")
+    partials_dir = spill_dir / "partials"
+    merged_dir = spill_dir / "merged"
+    merged_dir.mkdir(parents=True)
+
+    with track_memory("Streaming partial aggregates"):
+        progress = ProgressBar(
+            total=len(partitions), desc="Partial aggregates", unit="shard"
+        )
+        for key, files in partitions.items():
+            sink_partials(files, partials_dir / key, memory_limit_mb)
+            progress.update(1)
+        progress.close()
+
+    def partial_files(key):
+        return [
+            str(partials_dir / partition / f"{key}.parquet") for partition in partitions
+        ]
+
+    with track_memory("Merging partial aggregates"):
+        for key, (group_keys, _) in PARTIALS.items():
+            merge_bucketed(
+                sum_partials(key),
+                group_keys,
+                partial_files(key),
+                merged_dir / f"{key}.parquet",
+                spill_dir,
+                memory_limit_mb,
+            )
+        merge_bucketed(
+            lambda sketch: merge_numeric_sketches([sketch]),
+            ["code", "bin"],
+            partial_files("numeric_summary"),
+            merged_dir / "numeric_summary.parquet",
+            spill_dir,
+            memory_limit_mb,
+        )
+
+    subjects = pl.scan_parquet(merged_dir / "code_count_subjects.parquet").drop("rows")
+    codes = pl.read_parquet(merged_dir / "top_codes.parquet")
+    general_statistics = pl.DataFrame(
+        {
+            "Unique subjects": subjects.select(pl.col("Subject ID").drop_nulls().len())
+            .collect()
+            .item(),
+            "Unique events": codes["code"].drop_nulls().len(),
+            # The rows of all codes, including missing codes, are all events
+            "Total events": codes["rows"].sum(),
+        },
+        schema=GENERAL_STATISTICS_SCHEMA,
+    )
+    return {
+        "general_statistics": general_statistics,
+        "code_count_years": pl.read_parquet(
+            merged_dir / "code_count_years.parquet"
+        ).drop("rows"),
+        "code_count_subjects": subjects,
+        "top_codes": codes.drop("rows").sort("count", descending=True),
+        "coding_dict": pl.read_parquet(merged_dir / "coding_dict.parquet")
+        .drop("rows")
+        .sort("count", descending=True),
+        "time_pyramid": pl.read_parquet(merged_dir / "time_pyramid.parquet").drop(
+            "rows"
+        ),
+        "numerical_code_data": scan_numeric_rows(partitions),
+        "numeric_summary": pl.scan_parquet(merged_dir / "numeric_summary.parquet"),
+    }
@@ -0,0 +1,123 @@
+import logging
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+import polars as pl
+import pyarrow.parquet as pq
+
+from ..metrics import METRICS
+from .manifest import list_shards
+
+INDEX_SCHEMA = {
+    "subject_id": pl.Int64,
+    "shard": pl.String,
+    "row_group": pl.Int32,
+    "row_start": pl.Int64,
+    "row_end": pl.Int64,
+}
+
+
+def get_subject_index_path(cache_dir):
+    return Path(cache_dir) / "subject_index.parquet"
+
+
+def index_shard(file_path, shard):
+    """Maps every subject in a shard to its row groups and row range within them.
+
+    Only the ``subject_id`` column is read. Rows of a subject do not need to be
+    contiguous: the range spans all of them and lookups filter within it.
+    """
+    parquet_file = pq.ParquetFile(shard)
+    row_group_sizes = [
+        parquet_file.metadata.row_group(i).num_rows
+        for i in range(parquet_file.num_row_groups)
+    ]
+    row_group_starts = np.cumsum([0] + row_group_sizes)
+    subject_ids = pl.from_arrow(
+        parquet_file.read(columns=["subject_id"])["subject_id"]
+    ).cast(pl.Int64)
+    rows = np.arange(len(subject_ids))
+    row_groups = np.searchsorted(row_group_starts, rows, side="right") - 1
+    return (
+        pl.DataFrame(
+            {
+                "subject_id": subject_ids,
+                "row_group": row_groups.astype(np.int32),
+                "row": rows - row_group_starts[row_groups],
+            }
+        )
+        .drop_nulls("subject_id")
+        .group_by("subject_id", "row_group")
+        .agg(
+            pl.col("row").min().alias("row_start"),
+            (pl.col("row").max() + 1).alias("row_end"),
+        )
+        .select(
+            pl.col("subject_id"),
+            pl.lit(Path(shard).relative_to(file_path).as_posix()).alias("shard"),
+            pl.col("row_group"),
+            pl.col("row_start"),
+            pl.col("row_end"),
+        )
+        .cast(INDEX_SCHEMA)
+    )
+
+
+def build_subject_index(file_path, cache_dir, shard_keys=None, previous=None):
+    """Indexes the given shards (all by default) and combines them with the entries
+    of ``previous`` for the other shards. The index is sorted by ``subject_id``."""
+    shards = list_shards(file_path)
+    shard_keys = list(shards) if shard_keys is None else shard_keys
+    frames = [index_shard(file_path, shards[key]) for key in shard_keys]
+    if previous is not None:
+        current = {shards[key].relative_to(file_path).as_posix() for key in shards}
+        reindexed = {
+            shards[key].relative_to(file_path).as_posix() for key in shard_keys
+        }
+        frames.append(
+            previous.filter(
+                pl.col("shard").is_in(current) & ~pl.col("shard").is_in(reindexed)
+            )
+        )
+    index = pl.concat(frames) if frames else pl.DataFrame(schema=INDEX_SCHEMA)
+    index = index.sort("subject_id", "shard", "row_group")
+    index.write_parquet(get_subject_index_path(cache_dir))
+    logging.info(f"Indexed {index['subject_id'].n_unique()} subjects")
+    return index
+
+
+@lru_cache(maxsize=256)
+def _open_shard(path, mtime_ns):
+    return pq.ParquetFile(path)
+
+
+def load_subject_events(file_path, subject_id, subject_index, columns):
+    """Reads the events of one subject from only the row groups that contain them."""
+    start, end = np.searchsorted(
+        subject_index["subject_id"].to_numpy(), [subject_id, subject_id + 1]
+    )
+    tables = []
+    for shard, row_group, row_start, row_end in (
+        subject_index.slice(start, end - start)
+        .select("shard", "row_group", "row_start", "row_end")
+        .iter_rows()
+    ):
+        path = Path(file_path) / shard
+        parquet_file = _open_shard(str(path), path.stat().st_mtime_ns)
+        table = parquet_file.read_row_group(
+            row_group, columns=list(dict.fromkeys(["subject_id", *columns]))
+        )
+        tables.append(pl.from_arrow(table.slice(row_start, row_end - row_start)))
+    if not tables:
+        return None
+    METRICS.inc(
+        "meds_inspect_rows_scanned_total",
+        sum(len(table) for table in tables),
+        reader="subject_events",
+    )
+    return (
+        pl.concat(tables, how="vertical_relaxed")
+        .filter(pl.col("subject_id") == subject_id)
+        .select(columns)
+    )
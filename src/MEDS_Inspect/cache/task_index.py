@@ -0,0 +1,122 @@
+import json
+import logging
+import shutil
+from pathlib import Path
+
+import polars as pl
+
+from ..metrics import collect_query
+from ..tasks import get_tasks_dir, list_tasks, scan_task
+
+# Label columns of the MEDS label schema, besides subject_id and prediction_time
+LABEL_VALUES = ["boolean_value", "integer_value", "float_value", "categorical_value"]
+# Small row groups let lookups of one subject skip most of a large label file
+LABEL_ROW_GROUP_SIZE = 16384
+
+
+def get_task_index_dir(cache_dir):
+    return Path(cache_dir) / "tasks"
+
+
+def get_task_summary_path(cache_dir):
+    return get_task_index_dir(cache_dir) / "summary.parquet"
+
+
+def fingerprint_tasks(file_path):
+    """The path, size and modification time of every label file."""
+    tasks_dir = get_tasks_dir(file_path)
+    if tasks_dir is None:
+        return []
+    return [
+        [path.relative_to(tasks_dir).as_posix(), stat.st_size, stat.st_mtime_ns]
+        for path in sorted(tasks_dir.rglob("*.parquet"))
+        for stat in [path.stat()]
+    ]
+
+
+def task_file_name(task):
+    return task.replace("/", "--") + ".parquet"
+
+
+def summarize_labels(task, labels):
+    """Label prevalence and the number of prediction times per subject of a task."""
+    per_subject = labels.group_by("subject_id").len()["len"]
+    prevalence = (
+        labels["boolean_value"].mean() if "boolean_value" in labels.columns else None
+    )
+    return {
+        "Task": task,
+        "Labels": len(labels),
+        "Subjects": len(per_subject),
+        "Label prevalence": prevalence,
+        "Prediction times per subject (mean)": per_subject.mean(),
+        "Prediction times per subject (median)": per_subject.median(),
+        "Prediction times per subject (max)": per_subject.max(),
+        "First prediction time": labels["prediction_time"].min(),
+        "Last prediction time": labels["prediction_time"].max(),
+    }
+
+
+def read_sorted_labels(file_path, task):
+    labels = scan_task(file_path, task)
+    values = [c for c in LABEL_VALUES if c in labels.collect_schema().names()]
+    return (
+        labels.select(pl.col("subject_id").cast(pl.Int64), "prediction_time", *values)
+        .sort("subject_id", "prediction_time")
+        .collect()
+    )
+
+
+def build_task_index(file_path, cache_dir):
+    """Sorts the labels of every task by subject and prediction time and summarizes
+    them, unless the label files are unchanged since the last build."""
+    index_dir = get_task_index_dir(cache_dir)
+    fingerprint = fingerprint_tasks(file_path)
+    index_json = index_dir / "index.json"
+    if index_json.exists():
+        with open(index_json) as f:
+            if json.load(f)["fingerprint"] == fingerprint:
+                return
+    shutil.rmtree(index_dir, ignore_errors=True)
+    if not fingerprint:
+        return
+    index_dir.mkdir(parents=True)
+    files = {}
+    summaries = []
+    for task in list_tasks(file_path):
+        # A malformed label file leaves its task out, the dataset still loads
+        try:
+            labels = read_sorted_labels(file_path, task)
+        except (pl.exceptions.PolarsError, OSError) as e:
+            logging.warning(f"Skipping the labels of task {task}: {e}")
+            continue
+        files[task] = task_file_name(task)
+        labels.write_parquet(
+            index_dir / files[task], row_group_size=LABEL_ROW_GROUP_SIZE
+        )
+        summaries.append(summarize_labels(task, labels))
+    if summaries:
+        pl.DataFrame(summaries).write_parquet(get_task_summary_path(cache_dir))
+    # Written last, so an interrupted build is redone
+    with open(index_json, "w") as f:
+        json.dump({"fingerprint": fingerprint, "tasks": files}, f, indent=2)
+    logging.info(f"Indexed the labels of {len(files)} task(s)")
+
+
+def load_task_summary(cache_dir):
+    path = get_task_summary_path(cache_dir)
+    return pl.read_parquet(path) if path.exists() else None
+
+
+def load_task_labels(cache_dir, task, subject_id):
+    """Reads the labels of one subject for ``task``, or None if it is not indexed.
+
+    The filter on the sorted ``subject_id`` is pushed into the scan, so only the row
+    groups whose statistics include the subject are read.
+    """
+    path = get_task_index_dir(cache_dir) / task_file_name(task)
+    if not path.exists():
+        return None
+    return collect_query(
+        "task_labels", pl.scan_parquet(path).filter(pl.col("subject_id") == subject_id)
+    )
@@ -1,15 +1,33 @@
+import logging
+import re
+import time
+from bisect import bisect_left
 from functools import reduce
 from operator import or_
 
+import numpy as np
 import polars as pl
 
+SEARCH_COLUMNS = ["code", "description", "parent_codes"]
+# Relevance of the ways a code can match, higher is better
+RELEVANCE = {
+    "exact_code": 5,
+    "code_prefix": 4,
+    "parent_code_prefix": 3,
+    "code": 2,
+    "parent_code": 2,
+    "description": 1,
+}
+# Dots are common in codes (e.g. ICD9CM/707.23) so they are matched literally
+REGEX_CHARACTERS = set(r"^$*+?{}[]\|()")
+
 
 def load_code_metadata(file_path):
     metadata = pl.scan_parquet(file_path)
     return metadata
 
 
-def search_codes(metadata, search_term, search_options):
+def search_codes(metadata, search_term, search_options, limit=1000):
     if isinstance(search_term, list):
         search_term = " ".join(search_term)
     else:
@@ -29,7 +47,193 @@ def search_codes(metadata, search_term, search_options):
         metadata.lazy()
         .filter(combined_filter)
         .select(["code", "description", "parent_codes"])
-        .limit(1000)
+        .limit(limit)
         .collect()
     )
     return result
+
+
+class TrigramIndex:
+    """Maps every trigram of the lowercased values to the (sorted) rows containing it.
+
+    The postings of all trigrams are stored in one flat array, ``offsets`` holds the
+    start and end of each trigram's postings in it.
+    """
+
+    def __init__(self, values):
+        self.values = values.str.to_lowercase()
+        trigrams = (
+            pl.DataFrame(
+                {
+                    "text": self.values,
+                    "row": np.arange(len(values), dtype=np.uint32),
+                }
+            )
+            .drop_nulls("text")
+            .with_columns(
+                pl.int_ranges(
+                    0,
+                    (pl.col("text").str.len_chars().cast(pl.Int64) - 2).clip(
+                        lower_bound=0
+                    ),
+                ).alias("offset")
+            )
+            .explode("offset")
+            .drop_nulls("offset")
+            .select(
+                pl.col("text").str.slice(pl.col("offset"), 3).alias("trigram"), "row"
+            )
+            .unique()
+            .sort("trigram", "row")
+        )
+        self.rows = trigrams["row"].to_numpy()
+        keys = trigrams.group_by("trigram", maintain_order=True).len()
+        lengths = keys["len"].to_numpy()
+        ends = np.cumsum(lengths)
+        self.offsets = dict(
+            zip(
+                keys["trigram"].to_list(), zip((ends - lengths).tolist(), ends.tolist())
+            )
+        )
+
+    def postings(self, trigram):
+        start, end = self.offsets.get(trigram, (0, 0))
+        return self.rows[start:end]
+
+    def search(self, term):
+        """Returns the rows whose value contains ``term`` (lowercase)."""
+        if len(term) < 3:
+            # Too short for trigrams, an in-memory scan is fast enough
+            return np.flatnonzero(
+                self.values.str.contains(term, literal=True).to_numpy()
+            )
+        postings = sorted(
+            (self.postings(term[i : i + 3]) for i in range(len(term) - 2)), key=len
+        )
+        candidates = reduce(np.intersect1d, postings)
+        if len(candidates) == 0:
+            return candidates
+        # Trigrams can occur without the whole term, so verify the candidates
+        matches = self.values.gather(candidates).str.contains(term, literal=True)
+        return candidates[matches.to_numpy()]
+
+
+class SortedKeys:
+    """Lowercased keys sorted for prefix and exact lookups by binary search."""
+
+    def __init__(self, keys, rows):
+        order = keys.str.to_lowercase().arg_sort(nulls_last=True)
+        lowered = keys.str.to_lowercase().gather(order)
+        self.count = len(lowered) - lowered.null_count()
+        self.keys = lowered.head(self.count).to_list()
+        self.rows = np.asarray(rows)[order.to_numpy()][: self.count]
+
+    def prefix(self, term):
+        start = bisect_left(self.keys, term)
+        end = bisect_left(self.keys, term + "\U0010ffff", lo=start)
+        return self.rows[start:end]
+
+    def exact(self, term):
+        start = bisect_left(self.keys, term)
+        end = bisect_left(self.keys, term + "\x00", lo=start)
+        return self.rows[start:end]
+
+
+class CodeSearchIndex:
+    """In-memory index over ``metadata/codes.parquet`` for substring and prefix search.
+
+    Codes, descriptions and parent codes are indexed by trigram, codes and parent codes
+    also by sorted keys (for prefix and exact lookups). Results are ranked by how they match (see
+    ``RELEVANCE``) and then by how often the code occurs in the data.
+    """
+
+    def __init__(self, code_metadata, frequencies=None):
+        start = time.perf_counter()
+        self.metadata = code_metadata.select(SEARCH_COLUMNS)
+        counts = np.zeros(len(self.metadata), dtype=np.int64)
+        if frequencies is not None:
+            counts = (
+                self.metadata.select("code")
+                .join(
+                    frequencies.select("code", pl.col("count").cast(pl.Int64)),
+                    on="code",
+                    how="left",
+                )["count"]
+                .fill_null(0)
+                .to_numpy()
+            )
+        self.frequencies = counts
+        self.trigrams = {
+            "code": TrigramIndex(self.metadata["code"]),
+            "description": TrigramIndex(self.metadata["description"]),
+        }
+        self.codes = SortedKeys(self.metadata["code"], np.arange(len(self.metadata)))
+        parents = (
+            self.metadata.select(
+                pl.col("parent_codes"),
+                pl.int_range(pl.len(), dtype=pl.UInt32).alias("row"),
+            )
+            .explode("parent_codes")
+            .drop_nulls("parent_codes")
+        )
+        self.parent_rows = parents["row"].to_numpy()
+        self.parent_codes = SortedKeys(parents["parent_codes"], self.parent_rows)
+        self.trigrams["parent_codes"] = TrigramIndex(parents["parent_codes"])
+        logging.info(
+            f"Indexed {len(self.metadata):,} codes for search in "
+            f"{time.perf_counter() - start:.2f}s"
+        )
+
+    @classmethod
+    def from_parquet(cls, file_path, frequencies=None):
+        return cls(
+            load_code_metadata(file_path).select(SEARCH_COLUMNS).collect(), frequencies
+        )
+
+    def estimated_size(self):
+        return (
+            self.metadata.estimated_size()
+            + sum(index.rows.nbytes for index in self.trigrams.values())
+            + self.frequencies.nbytes
+        )
+
+    def search(self, search_term, search_options, limit=1000):
+        if isinstance(search_term, list):
+            search_term = " ".join(search_term)
+        term = str(search_term).strip().lower()
+        if not term or not search_options:
+            return self.metadata.clear()
+        if REGEX_CHARACTERS & set(term) and _is_regex(term):
+            # Patterns cannot be answered from the index, scan the codes in memory
+            return search_codes(self.metadata, term, search_options, limit)
+
+        relevance = np.zeros(len(self.metadata), dtype=np.int8)
+
+        def rank(rows, kind):
+            np.maximum.at(relevance, rows, RELEVANCE[kind])
+
+        if "description" in search_options:
+            rank(self.trigrams["description"].search(term), "description")
+        if "code" in search_options:
+            rank(self.trigrams["code"].search(term), "code")
+            rank(self.codes.prefix(term), "code_prefix")
+            rank(self.codes.exact(term), "exact_code")
+        if "parent_codes" in search_options:
+            rank(self.parent_codes.prefix(term), "parent_code_prefix")
+            # Parent codes are indexed per list element, map them back to their code
+            rank(
+                self.parent_rows[self.trigrams["parent_codes"].search(term)],
+                "parent_code",
+            )
+
+        matches = np.flatnonzero(relevance)
+        order = np.lexsort((-self.frequencies[matches], -relevance[matches]))
+        return self.metadata[matches[order][:limit]]
+
+
+def _is_regex(term):
+    try:
+        re.compile(term)
+    except re.error:
+        return False
+    return True
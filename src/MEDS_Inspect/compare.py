@@ -0,0 +1,150 @@
+from pathlib import Path
+
+import numpy as np
+import polars as pl
+
+from .cache.numeric_summary import rebin_to
+
+SPREAD = "Share spread"
+
+
+def dataset_labels(file_paths):
+    """Short labels of the compared datasets: their folder names, or their paths if
+    folder names repeat."""
+    names = [Path(file_path).name for file_path in file_paths]
+    if len(set(names)) < len(names):
+        return [str(file_path) for file_path in file_paths]
+    return names
+
+
+def share(name):
+    return f"{name} share"
+
+
+def align_counts(tables, key, value="count"):
+    """Aligns the ``key``/``value`` tables of several datasets on ``key``, with one
+    column of values per dataset (0 where a dataset lacks a key)."""
+    stacked = pl.concat(
+        [
+            table.select(pl.col(key), pl.col(value).cast(pl.Int64)).with_columns(
+                pl.lit(name).alias("dataset")
+            )
+            for name, table in tables.items()
+        ]
+    )
+    return (
+        stacked.pivot(on="dataset", index=key, values=value, aggregate_function="sum")
+        .fill_null(0)
+        .select(key, *tables)
+    )
+
+
+def with_shares(aligned, names):
+    """Adds the share of every key in the total of each dataset, the spread of these
+    shares and, for two datasets, their difference."""
+    shares = [share(name) for name in names]
+    aligned = aligned.with_columns(
+        (pl.col(name) / pl.col(name).sum()).fill_nan(0).alias(share(name))
+        for name in names
+    ).with_columns(
+        (pl.max_horizontal(shares) - pl.min_horizontal(shares)).alias(SPREAD)
+    )
+    if len(names) == 2:
+        aligned = aligned.with_columns(
+            (pl.col(shares[1]) - pl.col(shares[0])).alias(
+                f"{names[1]} - {names[0]} share"
+            )
+        )
+    return aligned
+
+
+def compare_counts(tables, key, top_n=20):
+    """Compares the counts per ``key`` (e.g. code or coding dictionary) of several
+    datasets: the ``top_n`` keys of every dataset (with ties), ordered by their share
+    spread."""
+    names = list(tables)
+    compared = with_shares(align_counts(tables, key), names)
+    in_top = pl.any_horizontal(
+        (pl.col(name) > 0) & (pl.col(name).rank("min", descending=True) <= top_n)
+        for name in names
+    )
+    return compared.filter(in_top).sort(SPREAD, key, descending=[True, False])
+
+
+def compare_time(time_pyramids, level="month"):
+    """The share of the codes of every dataset per period of ``level``, aligned on the
+    periods of all datasets."""
+    tables = {
+        name: time_pyramid.filter(pl.col("level") == level)
+        .group_by("period")
+        .agg(pl.col("count").sum())
+        for name, time_pyramid in time_pyramids.items()
+    }
+    return (
+        with_shares(align_counts(tables, "period"), list(tables))
+        .with_columns(pl.col("period").cast(pl.Date))
+        .sort("period")
+    )
+
+
+def compare_statistics(statistics):
+    """The general statistics of every dataset, one row per dataset."""
+    return pl.concat(
+        [
+            table.drop("Columns", strict=False).with_columns(
+                pl.lit(name).alias("Dataset")
+            )
+            for name, table in statistics.items()
+        ],
+        how="diagonal_relaxed",
+    ).select("Dataset", pl.exclude("Dataset"))
+
+
+def common_numeric_codes(numeric_summaries):
+    """Numeric codes summarized in every dataset, most frequent first."""
+    stacked = pl.concat(
+        [summary.select("code", "count") for summary in numeric_summaries.values()]
+    )
+    return (
+        stacked.group_by("code")
+        .agg(pl.len().alias("datasets"), pl.col("count").sum())
+        .filter(pl.col("datasets") == len(numeric_summaries))
+        .sort("count", "code", descending=[True, False])["code"]
+        .to_list()
+    )
+
+
+def compare_numeric(numeric_summaries, code, bins=50):
+    """Compares the numeric values of ``code`` in every dataset that summarizes it.
+
+    Returns a table of percentiles per dataset, and the bin edges shared by the
+    datasets with the re-binned histogram counts of each.
+    """
+    rows = {
+        name: summary.row(0, named=True)
+        for name, summary in (
+            (name, summary.filter(pl.col("code") == code))
+            for name, summary in numeric_summaries.items()
+        )
+        if not summary.is_empty()
+    }
+    if not rows:
+        return None, None, {}
+    lo = min(row["hist_lo"] for row in rows.values())
+    hi = max(row["hist_hi"] for row in rows.values())
+    edges = np.linspace(lo, hi, bins + 1) if hi > lo else np.array([lo - 0.5, lo + 0.5])
+    table = pl.DataFrame(
+        [
+            {
+                "Dataset": name,
+                "count": row["count"],
+                "min": row["min"],
+                "p25": row["quantiles"][25],
+                "median": row["quantiles"][50],
+                "p75": row["quantiles"][75],
+                "max": row["max"],
+            }
+            for name, row in rows.items()
+        ]
+    )
+    return table, edges, {name: rebin_to(row, edges) for name, row in rows.items()}
@@ -0,0 +1,327 @@
+import logging
+
+import numpy as np
+import plotly.graph_objects as go
+import polars as pl
+from plotly.colors import qualitative
+
+from .cache.aggregations import TIME_LEVELS
+
+# Colors of plotly's default template, cycled over categories like plotly.express
+COLORS = qualitative.Plotly
+
+
+def normalize_histogram(counts, widths, histnorm):
+    """Applies a plotly ``histnorm`` to already binned counts."""
+    counts = np.asarray(counts, dtype=np.float64)
+    total = counts.sum()
+    if histnorm in ("probability", "percent", "probability density") and total == 0:
+        return np.zeros_like(counts)
+    if histnorm == "probability":
+        return counts / total
+    if histnorm == "percent":
+        return 100 * counts / total
+    if histnorm == "density":
+        return counts / widths
+    if histnorm == "probability density":
+        return counts / (total * widths)
+    return counts
+
+
+def histogram_bar(edges, counts, histnorm="", **kwargs):
+    """Draws binned counts as bars spanning their bins, like a plotly histogram."""
+    edges = np.asarray(edges, dtype=np.float64)
+    widths = np.diff(edges)
+    return go.Bar(
+        x=edges[:-1] + widths / 2,
+        y=normalize_histogram(counts, widths, histnorm),
+        width=widths,
+        **kwargs,
+    )
+
+
+def log_payload_size(name, figure):
+    """Logs the size of the JSON that is sent to the browser for a figure."""
+    # Serializing the figure is only worth it if the size is logged
+    if logging.getLogger().isEnabledFor(logging.INFO):
+        logging.info(f"{name} payload: {len(figure.to_json()) / 1024:.1f} KiB")
+    return figure
+
+
+def code_count_time_figure(
+    time_pyramid, level="month", histnorm="", breakdown=False, max_groups=10
+):
+    """Draws the code counts per period of a ``level`` of the time pyramid, stacked
+    per coding dictionary (the ``max_groups`` largest ones) if ``breakdown``."""
+    counts = time_pyramid.filter(pl.col("level") == level)
+    if counts.is_empty():
+        return go.Figure()
+    if breakdown:
+        top = (
+            counts.group_by("coding_dict")
+            .agg(pl.col("count").sum())
+            .sort("count", "coding_dict", descending=[True, False])
+            .head(max_groups)["coding_dict"]
+        )
+        group = (
+            pl.when(pl.col("coding_dict").is_in(top))
+            .then(pl.col("coding_dict"))
+            .otherwise(pl.lit("Other"))
+        )
+        groups = [*top, "Other"]
+    else:
+        group = pl.lit("Amount of codes")
+        groups = ["Amount of codes"]
+    table = (
+        counts.with_columns(group.alias("group"))
+        .group_by("period", "group")
+        .agg(pl.col("count").sum())
+        .pivot(on="group", index="period", values="count")
+        .sort("period")
+        .fill_null(0)
+    )
+    groups = [name for name in groups if name in table.columns]
+    # Periods span from their first day to the first day of the next period
+    starts = table["period"].cast(pl.Date)
+    start_ms = starts.dt.epoch("ms").to_numpy()
+    widths = (
+        starts.dt.offset_by(TIME_LEVELS[level]).dt.epoch("ms").to_numpy() - start_ms
+    )
+    values = normalize_histogram(
+        table.select(groups).to_numpy(), widths[:, None], histnorm
+    )
+    x = (start_ms + widths / 2).astype("datetime64[ms]")
+    return go.Figure(
+        [
+            go.Bar(x=x, y=values[:, i], width=widths, name=name)
+            for i, name in enumerate(groups)
+        ]
+    ).update_layout(
+        xaxis_title="Date",
+        yaxis_title=f"{histnorm} of Amount of codes" if histnorm else "Amount of codes",
+        barmode="stack",
+        bargap=0,
+        showlegend=breakdown,
+    )
+
+
+def code_count_subject_figure(code_count_subjects, bins, histnorm="", scale="linear"):
+    """Counts the subjects per bin of their total code count."""
+    code_counts = code_count_subjects["Code count"].to_numpy()
+    counts, edges = np.histogram(code_counts, bins=bins)
+    return go.Figure(
+        histogram_bar(edges, counts, histnorm, name="Subjects")
+    ).update_layout(
+        xaxis_title="Code count",
+        yaxis_title="Segment of Subjects",
+        yaxis_type="log" if scale == "log" else "linear",
+        bargap=0,
+    )
+
+
+# Hover labels of the label values of a task (MEDS label schema)
+LABEL_VALUE_NAMES = {
+    "boolean_value": "Boolean Value",
+    "integer_value": "Integer Value",
+    "float_value": "Float Value",
+    "categorical_value": "Categorical Value",
+}
+
+
+def task_label_trace(labels, task):
+    """Draws the prediction times of a subject as dashed vertical lines in one trace.
+
+    Every label is a line from the bottom to the top of the secondary y-axis,
+    separated by gaps, with a marker at the top that is red for positive labels.
+    """
+    values = [
+        pl.when(pl.col(column).is_not_null())
+        .then(pl.lit(f"<br>{name}: ") + pl.col(column).cast(pl.String))
+        .otherwise(pl.lit(""))
+        for column, name in LABEL_VALUE_NAMES.items()
+        if column in labels.columns
+    ]
+    positive = (
+        pl.col("boolean_value").fill_null(False)
+        if "boolean_value" in labels.columns
+        else pl.lit(False)
+    )
+    labels = labels.select(
+        "prediction_time",
+        pl.concat_str(
+            pl.lit(f"Task: {task}<br>Prediction Time: "),
+            pl.col("prediction_time").cast(pl.String),
+            *values,
+        ).alias("text"),
+        pl.when(positive).then(pl.lit("red")).otherwise(pl.lit("green")).alias("color"),
+    )
+    # Three points per label: bottom, top and a gap that breaks the line
+    x = np.full((len(labels), 3), None, dtype=object)
+    x[:, 0] = x[:, 1] = np.array(labels["prediction_time"].to_list(), dtype=object)
+    y = np.tile([0, 1, None], len(labels))
+    return go.Scatter(
+        x=x.ravel(),
+        y=y,
+        mode="lines+markers",
+        line=dict(color="gray", dash="dash"),
+        marker=dict(
+            color=np.repeat(labels["color"].to_numpy(), 3),
+            size=np.tile([0, 10, 0], len(labels)),
+        ),
+        hovertext=np.repeat(labels["text"].to_numpy(), 3),
+        hoverinfo="text",
+        name=task,
+        yaxis="y2",
+    )
+
+
+def bucket_events(events, buckets):
+    """Counts the events per time bucket and coding dictionary, with ``buckets``
+    equally wide buckets between the first and last event."""
+    times = events.drop_nulls("time")["time"].dt.epoch("us")
+    first, last = times.min(), times.max()
+    width = max(1, -(-(last - first + 1) // buckets))
+    bucket = (pl.col("time").dt.epoch("us") - first) // width
+    return (
+        events.drop_nulls("time")
+        .group_by(bucket.alias("bucket"), "coding_dict")
+        .agg(pl.len().alias("count"), pl.col("code").n_unique().alias("codes"))
+        .with_columns(
+            (pl.col("bucket") * width + first + width // 2)
+            .cast(pl.Datetime("us"))
+            .alias("time")
+        )
+        .sort("time", "coding_dict")
+    )
+
+
+def subject_timeline_figure(
+    events,
+    subject_id,
+    x_range=None,
+    webgl_threshold=2000,
+    max_points=20000,
+    buckets=400,
+):
+    """Draws the events of a subject (within ``x_range``, if given) over time.
+
+    Up to ``max_points`` visible events are drawn one by one, with WebGL above
+    ``webgl_threshold`` points. More are counted per time bucket and coding dictionary
+    instead, so zoomed out views of long stays stay light; zooming in on a range with
+    fewer events draws them in full detail.
+    """
+    if x_range is not None:
+        events = events.filter(pl.col("time").is_between(*x_range))
+    detail = len(events) <= max_points
+    if detail:
+        scatter = go.Scattergl if len(events) > webgl_threshold else go.Scatter
+        title = f"Codes over time for subject {subject_id}"
+        traces = [
+            scatter(
+                x=group["time"].to_numpy(),
+                y=group["code"].to_numpy(),
+                customdata=np.column_stack(
+                    [
+                        group["numeric_value"].to_numpy(),
+                        group["text_value"].to_numpy(),
+                    ]
+                ),
+                mode="markers",
+                name=str(group["coding_dict"][0]),
+                hovertemplate=(
+                    "time=%{x}<br>code=%{y}<br>numeric_value=%{customdata[0]}"
+                    "<br>text_value=%{customdata[1]}"
+                ),
+            )
+            for group in events.partition_by("coding_dict", maintain_order=True)
+        ]
+    else:
+        counts = bucket_events(events, buckets)
+        title = (
+            f"Codes over time for subject {subject_id} ({len(events):,} events "
+            f"per time bucket, zoom in for single events)"
+        )
+        # Marker areas are proportional to the counts, the largest is 20px wide
+        sizeref = 2 * counts["count"].max() / 20**2
+        traces = [
+            go.Scattergl(
+                x=group["time"].to_numpy(),
+                y=group["coding_dict"].to_numpy(),
+                customdata=group["codes"].to_numpy(),
+                mode="markers",
+                marker=dict(
+                    size=group["count"].to_numpy(), sizemode="area", sizeref=sizeref
+                ),
+                name=str(group["coding_dict"][0]),
+                hovertemplate="time=%{x}<br>Events=%{marker.size}<br>codes=%{customdata}",
+            )
+            for group in counts.partition_by("coding_dict", maintain_order=True)
+        ]
+    figure = go.Figure(traces).update_layout(
+        title=title,
+        xaxis_title="time",
+        yaxis_title="code" if detail else "Code Category",
+        legend_title="Code Category",
+    )
+    if x_range is not None:
+        figure.update_xaxes(range=list(x_range))
+    return figure
+
+
+def category_bar_figure(table, category, value, log=False, horizontal=False, **layout):
+    """Draws one bar per ``category`` in a single trace, colored per category like
+    ``px.bar(color=category)`` but without converting the table to pandas."""
+    categories = table[category].to_numpy()
+    values = table[value].to_numpy()
+    colors = [COLORS[i % len(COLORS)] for i in range(len(table))]
+    bar = (
+        go.Bar(x=values, y=categories, orientation="h", marker_color=colors)
+        if horizontal
+        else go.Bar(x=categories, y=values, marker_color=colors)
+    )
+    value_axis, category_axis = ("xaxis", "yaxis") if horizontal else ("yaxis", "xaxis")
+    return go.Figure(bar).update_layout(
+        {
+            f"{value_axis}_title": value,
+            f"{value_axis}_type": "log" if log else "linear",
+            f"{category_axis}_title": category,
+        },
+        **layout,
+    )
+
+
+def share_bar_figure(compared, key, shares, **layout):
+    """Draws the share of every ``key`` per dataset as grouped bars; ``shares`` maps
+    the dataset labels to their share columns."""
+    keys = compared[key].to_numpy()
+    return go.Figure(
+        [
+            go.Bar(x=compared[column].to_numpy(), y=keys, orientation="h", name=name)
+            for name, column in shares.items()
+        ]
+    ).update_layout(
+        barmode="group",
+        xaxis_title="Share of codes",
+        xaxis_tickformat=".1%",
+        yaxis_title=key,
+        yaxis_autorange="reversed",
+        **layout,
+    )
+
+
+def share_time_figure(compared, shares, **layout):
+    """Draws the share of the codes of every dataset per period as lines."""
+    periods = compared["period"].to_numpy()
+    return go.Figure(
+        [
+            go.Scatter(
+                x=periods, y=compared[column].to_numpy(), mode="lines", name=name
+            )
+            for name, column in shares.items()
+        ]
+    ).update_layout(
+        xaxis_title="Date",
+        yaxis_title="Share of codes",
+        yaxis_tickformat=".1%",
+        **layout,
+    )
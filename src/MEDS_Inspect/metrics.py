@@ -0,0 +1,216 @@
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds (in seconds) of the buckets of every timing histogram
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+DESCRIPTIONS = {
+    "meds_inspect_callback_seconds": ("histogram", "Time spent in a Dash callback."),
+    "meds_inspect_callback_errors_total": (
+        "counter",
+        "Dash callbacks that raised an exception.",
+    ),
+    "meds_inspect_response_bytes_total": (
+        "counter",
+        "Bytes of callback responses sent to the client.",
+    ),
+    "meds_inspect_query_seconds": (
+        "histogram",
+        "Time spent collecting a polars query.",
+    ),
+    "meds_inspect_rows_scanned_total": (
+        "counter",
+        "Rows read from the data files, per reader.",
+    ),
+    "meds_inspect_cache_stage_seconds": (
+        "histogram",
+        "Time spent in a stage of building or loading a cache.",
+    ),
+    "meds_inspect_cache_requests_total": (
+        "counter",
+        "Lookups of an in-memory or on-disk cache, by result (hit or miss).",
+    ),
+    "meds_inspect_datasets_loaded": ("gauge", "Datasets held by the registry."),
+    "meds_inspect_datasets_bytes": (
+        "gauge",
+        "Estimated memory held by the loaded datasets.",
+    ),
+}
+
+# Structured events are only written once a handler is added, see enable_json_log
+json_logger = logging.getLogger("MEDS_Inspect.metrics")
+json_logger.propagate = False
+
+
+def label_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(key, extra=()):
+    labels = [*key, *extra]
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in labels) + "}"
+
+
+class Metrics:
+    """Counters, gauges and timing histograms, rendered in the Prometheus text format.
+
+    Metrics are identified by their name and labels, e.g.
+    ``inc("meds_inspect_cache_requests_total", cache="cohorts", result="hit")``.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}
+        self._histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, label_key(labels))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self._values[(name, label_key(labels))] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, label_key(labels))
+        with self._lock:
+            counts = self._histograms.setdefault(key, [0] * (len(BUCKETS) + 2))
+            for i, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def value(self, name, **labels):
+        """The value of a counter or gauge, or the count of a histogram."""
+        key = (name, label_key(labels))
+        with self._lock:
+            if key in self._histograms:
+                return self._histograms[key][-1]
+            return self._values.get(key, 0)
+
+    def drain(self):
+        """Returns the recorded metrics and clears them, e.g. to send the metrics of a
+        worker process back to the process that serves them (see ``merge``)."""
+        with self._lock:
+            drained = {"values": self._values, "histograms": self._histograms}
+            self._values, self._histograms = {}, {}
+        return drained
+
+    def merge(self, drained):
+        """Adds the counters and histograms of ``drain`` to these metrics, gauges are
+        replaced."""
+        with self._lock:
+            for key, value in drained["values"].items():
+                if DESCRIPTIONS.get(key[0], ("untyped",))[0] == "gauge":
+                    self._values[key] = value
+                else:
+                    self._values[key] = self._values.get(key, 0) + value
+            for key, counts in drained["histograms"].items():
+                merged = self._histograms.setdefault(key, [0] * (len(BUCKETS) + 2))
+                for i, count in enumerate(counts):
+                    merged[i] += count
+
+    @contextmanager
+    def timed(self, name, **labels):
+        """Observes the seconds spent in the block, also if it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def render(self):
+        with self._lock:
+            values = dict(self._values)
+            histograms = {key: list(counts) for key, counts in self._histograms.items()}
+        names = sorted({name for name, _ in [*values, *histograms]})
+        lines = []
+        for name in names:
+            kind, description = DESCRIPTIONS.get(name, ("untyped", ""))
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            for (metric, labels), value in sorted(values.items()):
+                if metric == name:
+                    lines.append(f"{name}{format_labels(labels)} {value}")
+            for (metric, labels), counts in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                # Bucket counts are cumulative, every bucket counts values <= bound
+                for bound, count in zip(BUCKETS, counts):
+                    lines.append(
+                        f"{name}_bucket{format_labels(labels, [('le', str(bound))])} "
+                        f"{count}"
+                    )
+                lines.append(
+                    f"{name}_bucket{format_labels(labels, [('le', '+Inf')])} "
+                    f"{counts[-1]}"
+                )
+                lines.append(f"{name}_sum{format_labels(labels)} {counts[-2]}")
+                lines.append(f"{name}_count{format_labels(labels)} {counts[-1]}")
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics()
+
+
+def enable_json_log(path):
+    """Writes every structured event as one JSON object per line to ``path``."""
+    handler = logging.FileHandler(path)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    json_logger.addHandler(handler)
+    json_logger.setLevel(logging.INFO)
+
+
+def json_log_enabled():
+    return bool(json_logger.handlers)
+
+
+def log_event(event, **fields):
+    if json_log_enabled():
+        json_logger.info(
+            json.dumps({"time": time.time(), "event": event, **fields}, default=str)
+        )
+
+
+def count_lookup(cache, hit):
+    METRICS.inc(
+        "meds_inspect_cache_requests_total",
+        cache=cache,
+        result="hit" if hit else "miss",
+    )
+
+
+@contextmanager
+def cache_stage(stage):
+    """Times a stage of building or loading a cache."""
+    start = time.perf_counter()
+    with METRICS.timed("meds_inspect_cache_stage_seconds", stage=stage):
+        yield
+    log_event("cache_stage", stage=stage, seconds=time.perf_counter() - start)
+
+
+def collect_query(name, query, **kwargs):
+    """Collects a polars query, timing it and logging its optimized plan."""
+    start = time.perf_counter()
+    with METRICS.timed("meds_inspect_query_seconds", query=name):
+        result = query.collect(**kwargs)
+    if json_log_enabled():
+        log_event(
+            "query",
+            query=name,
+            seconds=time.perf_counter() - start,
+            rows=len(result),
+            plan=query.explain(),
+        )
+    return result
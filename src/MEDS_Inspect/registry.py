@@ -0,0 +1,315 @@
+import json
+import logging
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import polars as pl
+
+from .cache.cache_results import get_cache_dir, get_metadata, read_cached_aggregates
+from .cache.cohorts import load_cohort
+from .cache.jobs import build_cache
+from .cache.manifest import read_manifest
+from .cache.subject_index import load_subject_events
+from .code_search import CodeSearchIndex
+from .metrics import METRICS, collect_query, count_lookup
+from .subject_search import SubjectIds
+from .utils import resolve_path, return_data_path
+
+# Searches that are kept per dataset, so paging through their results does not search
+RECENT_SEARCHES = 16
+# Cohorts that are kept loaded per dataset, more are memoized on disk
+RECENT_COHORTS = 4
+# Subjects whose events are kept, so zooming in on their timeline does not read them
+RECENT_SUBJECTS = 4
+SUBJECT_COLUMNS = ["time", "code", "numeric_value", "text_value"]
+
+
+class Dataset:
+    """The cached results and metadata of one MEDS dataset.
+
+    ``fingerprint`` identifies the shards the results were computed from (see
+    ``cache_fingerprint``). ``on_resize(dataset)`` is called when structures built on
+    first use, such as the search index or cohorts, change the size of the dataset.
+    """
+
+    def __init__(self, file_path, results, metadata, fingerprint=None):
+        self.file_path = file_path
+        self.results = results
+        self.metadata = metadata
+        self.fingerprint = fingerprint
+        self.on_resize = None
+        self._size = estimate_size(results) + metadata.estimated_size()
+        self._search_index = None
+        self._search_lock = threading.Lock()
+        self._searches = OrderedDict()
+        self._subject_ids = None
+        self._cohorts = OrderedDict()
+        self._cohort_lock = threading.Lock()
+        self._subjects = OrderedDict()
+
+    def __getitem__(self, key):
+        return self.results[key]
+
+    def get(self, key, default=None):
+        return self.results.get(key, default)
+
+    @property
+    def size(self):
+        """The estimated memory held by the dataset and its loaded cohorts."""
+        return self._size + sum(
+            cohort.size for cohort in list(self._cohorts.values()) if cohort is not None
+        )
+
+    def _resized(self, cohort=None):
+        if self.on_resize is not None:
+            self.on_resize(self)
+
+    def search_index(self):
+        """The code search index, built on first use."""
+        with self._search_lock:
+            if self._search_index is not None:
+                return self._search_index
+            self._search_index = CodeSearchIndex.from_parquet(
+                Path(self.file_path) / "metadata" / "codes.parquet",
+                frequencies=self.results.get("top_codes"),
+            )
+            self._size += self._search_index.estimated_size()
+        self._resized()
+        return self._search_index
+
+    def subject_ids(self):
+        """The sorted subject IDs for typeahead lookups, built on first use."""
+        with self._search_lock:
+            if self._subject_ids is not None:
+                return self._subject_ids
+            self._subject_ids = SubjectIds(self.results["code_count_subjects"])
+            self._size += self._subject_ids.estimated_size()
+        self._resized()
+        return self._subject_ids
+
+    def search(self, term, options, limit):
+        """Searches the codes, remembering the results of the most recent searches."""
+        key = (term, tuple(sorted(options)), limit)
+        with self._search_lock:
+            count_lookup("searches", key in self._searches)
+            if key in self._searches:
+                self._searches.move_to_end(key)
+                return self._searches[key]
+        results = self.search_index().search(term, options, limit=limit)
+        with self._search_lock:
+            self._searches[key] = results
+            while len(self._searches) > RECENT_SEARCHES:
+                self._searches.popitem(last=False)
+        return results
+
+    def subject_events(self, subject_id):
+        """The events of a subject with their coding dictionary, or None if the
+        subject has no events. The most recently read subjects are kept."""
+        with self._search_lock:
+            count_lookup("subject_events", subject_id in self._subjects)
+            if subject_id in self._subjects:
+                self._subjects.move_to_end(subject_id)
+                return self._subjects[subject_id]
+        subject_index = self.results.get("subject_index")
+        if subject_index is not None:
+            # Only read the row groups that contain the subject
+            events = load_subject_events(
+                self.file_path, subject_id, subject_index, SUBJECT_COLUMNS
+            )
+        else:
+            events = collect_query(
+                "subject_events",
+                pl.scan_parquet(return_data_path(self.file_path))
+                .filter(pl.col("subject_id") == subject_id)
+                .select(SUBJECT_COLUMNS),
+            )
+        if events is None or events.is_empty():
+            return None
+        events = events.with_columns(
+            pl.col("code").str.split("/").list.first().alias("coding_dict")
+        )
+        with self._search_lock:
+            self._subjects[subject_id] = events
+            while len(self._subjects) > RECENT_SUBJECTS:
+                self._subjects.popitem(last=False)
+        return events
+
+    def cohort(self, cohort, max_cohorts=32):
+        """The dataset restricted to ``cohort``, a filter made by ``canonical_cohort``.
+
+        Returns the dataset itself if nothing is filtered and None if no events match.
+        The aggregates of the most recent cohorts are kept with the dataset and count
+        towards its size.
+        """
+        if not cohort:
+            return self
+        key = json.dumps(cohort, sort_keys=True)
+        # Concurrent requests for a cohort wait for a single computation
+        with self._cohort_lock:
+            count_lookup("cohorts", key in self._cohorts)
+            if key in self._cohorts:
+                self._cohorts.move_to_end(key)
+                return self._cohorts[key]
+            results = load_cohort(self.file_path, cohort, max_cohorts)
+            dataset = None
+            if results is not None:
+                dataset = Dataset(self.file_path, results, self.metadata)
+                dataset.on_resize = self._resized
+            self._cohorts[key] = dataset
+            while len(self._cohorts) > RECENT_COHORTS:
+                self._cohorts.popitem(last=False)
+        self._resized()
+        return dataset
+
+
+def estimate_size(results):
+    """Estimates the memory held by the loaded (not lazily scanned) cached results."""
+    return sum(
+        value.estimated_size()
+        for value in results.values()
+        if isinstance(value, pl.DataFrame)
+    )
+
+
+def cache_fingerprint(file_path):
+    """The shard hashes of the manifest of the cache of ``file_path``, None if the
+    cache has no manifest."""
+    manifest = read_manifest(get_cache_dir(file_path))
+    if manifest is None:
+        return None
+    return {key: shard["hash"] for key, shard in manifest["shards"].items()}
+
+
+class DatasetRegistry:
+    """Keeps the most recently used datasets loaded, keyed by their resolved path.
+
+    Datasets are evicted in least recently used order once more than ``max_datasets``
+    are loaded or their combined size exceeds ``memory_budget_mb``. The most recently
+    used dataset is always kept, even if it exceeds the budget on its own.
+    """
+
+    def __init__(self, max_datasets=4, memory_budget_mb=2048, loader=None):
+        self.max_datasets = max_datasets
+        self.memory_budget = memory_budget_mb * 1024 * 1024
+        self.loader = load_dataset if loader is None else loader
+        self._datasets = OrderedDict()
+        self._lock = threading.Lock()
+        self._loading = {}
+
+    def __contains__(self, file_path):
+        return resolve_path(file_path) in self._datasets
+
+    def __len__(self):
+        return len(self._datasets)
+
+    @property
+    def size(self):
+        return sum(dataset.size for dataset in self._datasets.values())
+
+    def get(self, file_path):
+        """Returns the dataset at ``file_path``, loading (and caching) it if needed."""
+        key = resolve_path(file_path)
+        with self._lock:
+            count_lookup("datasets", key in self._datasets)
+            if key in self._datasets:
+                self._datasets.move_to_end(key)
+                self._update_gauges()
+                return self._datasets[key]
+            # Concurrent requests for the same dataset wait for a single load
+            load_lock = self._loading.setdefault(key, threading.Lock())
+        with load_lock:
+            try:
+                with self._lock:
+                    if key in self._datasets:
+                        self._datasets.move_to_end(key)
+                        return self._datasets[key]
+                dataset = self.loader(key)
+                dataset.on_resize = self._resized
+                with self._lock:
+                    self._datasets[key] = dataset
+                    self._evict()
+                    self._update_gauges()
+            finally:
+                # Also after a failed load, so the dataset is no longer shown as loading
+                with self._lock:
+                    self._loading.pop(key, None)
+        return dataset
+
+    def is_loading(self, file_path):
+        return resolve_path(file_path) in self._loading
+
+    def preload(self, file_path):
+        """Loads the dataset at ``file_path`` in a background thread."""
+        key = resolve_path(file_path)
+        with self._lock:
+            # Registered before the thread starts, so it is loading from now on
+            self._loading.setdefault(key, threading.Lock())
+
+        def load():
+            try:
+                self.get(key)
+            except Exception:
+                logging.exception(f"Loading {key} failed")
+
+        thread = threading.Thread(target=load, daemon=True)
+        thread.start()
+        return thread
+
+    def evict(self, file_path):
+        with self._lock:
+            self._datasets.pop(resolve_path(file_path), None)
+            self._update_gauges()
+
+    def evict_outdated(self, file_path):
+        """Evicts the dataset at ``file_path`` if its cache was computed from other
+        shards since it was loaded. Returns whether it was evicted."""
+        key = resolve_path(file_path)
+        with self._lock:
+            dataset = self._datasets.get(key)
+            if dataset is None or dataset.fingerprint == cache_fingerprint(key):
+                return False
+            del self._datasets[key]
+            self._update_gauges()
+        logging.info(f"Evicted {key} from the dataset registry, its shards changed")
+        return True
+
+    def _resized(self, dataset):
+        # The datasets grow as they are used, so the budget is checked again
+        with self._lock:
+            self._evict()
+            self._update_gauges()
+
+    def _update_gauges(self):
+        METRICS.set("meds_inspect_datasets_loaded", len(self._datasets))
+        METRICS.set("meds_inspect_datasets_bytes", self.size)
+
+    def _evict(self):
+        while len(self._datasets) > 1 and (
+            len(self._datasets) > self.max_datasets or self.size > self.memory_budget
+        ):
+            key, dataset = self._datasets.popitem(last=False)
+            logging.info(
+                f"Evicted {key} ({dataset.size / (1024 * 1024):.1f} MB) from the "
+                f"dataset registry"
+            )
+
+
+def load_dataset(file_path, **cache_options):
+    logging.info(f"loading cached results at: {file_path}")
+    results = build_cache(file_path, **cache_options)
+    return Dataset(
+        file_path, results, get_metadata(file_path), cache_fingerprint(file_path)
+    )
+
+
+def load_cached_dataset(file_path):
+    """Loads a dataset from its cache only, so it never scans the data."""
+    results = read_cached_aggregates(file_path)
+    if results is None:
+        raise FileNotFoundError(
+            f"{file_path} is not cached, run MEDS_Inspect_cache {file_path} first"
+        )
+    return Dataset(
+        file_path, results, get_metadata(file_path), cache_fingerprint(file_path)
+    )
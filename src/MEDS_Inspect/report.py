@@ -0,0 +1,220 @@
+import html
+import json
+import logging
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import plotly.graph_objects as go
+import polars as pl
+from plotly.offline import get_plotlyjs
+
+from .cache.cache_results import get_cache_dir, get_metadata
+from .cache.numeric_summary import rebin
+from .figures import category_bar_figure, code_count_time_figure, histogram_bar
+from .utils import format_statistic
+
+# Only aggregates are exported, these bound the size of the report of large datasets
+TOP_CODES = 100
+NUMERIC_CODES = 50
+NUMERIC_BINS = 50
+SUBJECT_BINS = 50
+TIME_LEVELS = ("year", "quarter", "month")
+# The readable summary of the 101 stored percentiles
+PERCENTILES = {"p1": 1, "p25": 25, "median": 50, "p75": 75, "p99": 99}
+
+
+def get_report_dir(file_path):
+    return get_cache_dir(file_path) / "report"
+
+
+def subject_histogram(code_count_subjects, bins=SUBJECT_BINS):
+    """Bins the code count per subject, so the report holds no subject ids."""
+    counts, edges = np.histogram(code_count_subjects["Code count"].to_numpy(), bins)
+    return {"edges": edges.tolist(), "counts": counts.tolist()}
+
+
+def numeric_profiles(numeric_summary, limit=NUMERIC_CODES, bins=NUMERIC_BINS):
+    """The percentiles and re-binned histogram of the ``limit`` most frequent
+    numeric codes."""
+    top = numeric_summary.sort("count", "code", descending=[True, False]).head(limit)
+    profiles = []
+    for row in top.iter_rows(named=True):
+        edges, counts = rebin(row, bins)
+        profiles.append(
+            {
+                "code": row["code"],
+                "count": row["count"],
+                "min": row["min"],
+                "max": row["max"],
+                **{name: row["quantiles"][q] for name, q in PERCENTILES.items()},
+                "underflow": row["underflow"],
+                "overflow": row["overflow"],
+                "edges": edges.tolist(),
+                "counts": counts.tolist(),
+            }
+        )
+    return profiles
+
+
+def build_profile(file_path, cached_results):
+    """Collects the cached aggregates of a dataset into one JSON-serializable dict."""
+    cache_dir = get_cache_dir(file_path)
+    build_report = cache_dir / "build_report.json"
+    metadata = get_metadata(file_path)
+    time_pyramid = cached_results["time_pyramid"].filter(
+        pl.col("level").is_in(TIME_LEVELS)
+    )
+    task_summary = cached_results.get("task_summary")
+    return {
+        "file_path": str(file_path),
+        "generated_at": datetime.now().isoformat(),
+        "metadata": metadata.to_dicts() if metadata is not None else [],
+        "build": json.loads(build_report.read_text()) if build_report.exists() else {},
+        "general_statistics": cached_results["general_statistics"].to_dicts(),
+        "approximations": cached_results.get("approximations") or {},
+        "top_codes": cached_results["top_codes"].head(TOP_CODES).to_dicts(),
+        "coding_dict": cached_results["coding_dict"].to_dicts(),
+        "time_pyramid": time_pyramid.with_columns(
+            pl.col("period").cast(pl.Date)
+        ).to_dicts(),
+        "code_count_subjects": subject_histogram(cached_results["code_count_subjects"]),
+        "numeric_codes": numeric_profiles(cached_results["numeric_summary"]),
+        "tasks": task_summary.to_dicts() if task_summary is not None else [],
+    }
+
+
+def html_table(rows, approximations=None):
+    if not rows:
+        return "<p>None</p>"
+    approximations = approximations or {}
+    header = "".join(f"<th>{html.escape(column)}</th>" for column in rows[0])
+    body = "".join(
+        "<tr>"
+        + "".join(
+            f"<td>{html.escape(format_statistic(value, approximations.get(column)))}</td>"
+            for column, value in row.items()
+        )
+        + "</tr>"
+        for row in rows
+    )
+    return f"<table><tr>{header}</tr>{body}</table>"
+
+
+def numeric_figure(profiles):
+    """Histograms of the numeric codes in one figure, with a dropdown that shows one
+    code at a time."""
+    figure = go.Figure(
+        [
+            histogram_bar(p["edges"], p["counts"], name=p["code"], visible=i == 0)
+            for i, p in enumerate(profiles)
+        ]
+    )
+    buttons = [
+        dict(
+            label=p["code"],
+            method="update",
+            args=[
+                {"visible": [j == i for j in range(len(profiles))]},
+                {"title": f"Numerical distribution for code {p['code']}"},
+            ],
+        )
+        for i, p in enumerate(profiles)
+    ]
+    return figure.update_layout(
+        title=f"Numerical distribution for code {profiles[0]['code']}",
+        updatemenus=[dict(buttons=buttons, x=1, xanchor="right", y=1.15)],
+        xaxis_title="numeric_value",
+        yaxis_title="count",
+        bargap=0,
+    )
+
+
+def report_figures(profile, cached_results):
+    """The figures of the report, drawn from the same binned data as the app."""
+    time_pyramid = cached_results["time_pyramid"]
+    subjects = profile["code_count_subjects"]
+    figures = {
+        "Codes over time": code_count_time_figure(
+            time_pyramid, "month", breakdown=True
+        ),
+        "Code count per subject": go.Figure(
+            histogram_bar(subjects["edges"], subjects["counts"], name="Subjects")
+        ).update_layout(xaxis_title="Code count", yaxis_title="Subjects", bargap=0),
+        f"Top {TOP_CODES} codes": category_bar_figure(
+            cached_results["top_codes"].head(TOP_CODES),
+            "code",
+            "count",
+            log=True,
+            horizontal=True,
+            height=max(400, 20 * TOP_CODES),
+        ),
+        "Coding dictionaries": category_bar_figure(
+            cached_results["coding_dict"], "coding_dict", "count", log=True
+        ),
+    }
+    if profile["numeric_codes"]:
+        figures["Numeric values"] = numeric_figure(profile["numeric_codes"])
+    return figures
+
+
+def render_html(profile, figures):
+    title = f"MEDS-Inspect profile of {Path(profile['file_path']).name}"
+    numeric = [
+        {k: v for k, v in p.items() if k not in ("edges", "counts")}
+        for p in profile["numeric_codes"]
+    ]
+    sections = [
+        ("Dataset", html_table(profile["metadata"])),
+        (
+            "General statistics",
+            html_table(profile["general_statistics"], profile["approximations"]),
+        ),
+        ("Tasks", html_table(profile["tasks"])),
+        *(
+            (name, figure.to_html(full_html=False, include_plotlyjs=False))
+            for name, figure in figures.items()
+        ),
+        (f"Top {len(numeric)} numeric codes", html_table(numeric)),
+    ]
+    body = "\n".join(
+        f"<h2>{html.escape(name)}</h2>\n{content}" for name, content in sections
+    )
+    return f"""<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{html.escape(title)}</title>
+<script src="plotly.min.js"></script>
+<style>
+body {{font-family: sans-serif; margin: 2em;}}
+table {{border-collapse: collapse; margin-bottom: 1em;}}
+td, th {{border: 1px solid #ccc; padding: 4px 8px; text-align: left;}}
+</style>
+</head>
+<body>
+<h1>{html.escape(title)}</h1>
+<p>Generated {profile["generated_at"]} from the cached aggregates in
+{html.escape(profile["file_path"])}, see profile.json for the data.</p>
+{body}
+</body>
+</html>
+"""
+
+
+def write_report(file_path, cached_results):
+    """Writes a static profile of the cached aggregates of a dataset: ``profile.json``
+    with the binned data and ``index.html`` with its tables and figures, next to
+    plotly.js so the report opens without a server or network access."""
+    report_dir = get_report_dir(file_path)
+    report_dir.mkdir(parents=True, exist_ok=True)
+    profile = build_profile(file_path, cached_results)
+    with open(report_dir / "profile.json", "w") as f:
+        json.dump(profile, f, indent=2, default=str)
+    figures = report_figures(profile, cached_results)
+    (report_dir / "index.html").write_text(
+        render_html(profile, figures), encoding="utf-8"
+    )
+    (report_dir / "plotly.min.js").write_text(get_plotlyjs(), encoding="utf-8")
+    logging.info(f"Wrote the dataset profile to {report_dir}")
+    return report_dir
@@ -0,0 +1,73 @@
+import numpy as np
+
+# Quick filters of the subject dropdown
+SUBJECT_FILTERS = {"most_events": "Most events", "random": "Random subjects"}
+
+
+class SubjectIds:
+    """Subject IDs and their event counts, sorted by ID for typeahead lookups."""
+
+    def __init__(self, code_count_subjects):
+        subjects = code_count_subjects.drop_nulls("Subject ID").sort("Subject ID")
+        self.ids = subjects["Subject ID"].to_numpy()
+        self.counts = subjects["Code count"].to_numpy().astype(np.int64)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def estimated_size(self):
+        return self.ids.nbytes + self.counts.nbytes
+
+    def prefix(self, term, limit=50):
+        """Positions of the IDs whose decimal digits start with ``term``, shortest
+        IDs first.
+
+        The IDs with ``k`` more digits than ``term`` lie in the range
+        ``[term * 10**k, (term + 1) * 10**k)``, found by binary search.
+        """
+        term = term.strip()
+        if not term.isdigit() or len(self) == 0:
+            return np.array([], dtype=np.int64)
+        if term.startswith("0"):
+            # Only the ID 0 itself starts with a zero
+            position = self.find(0) if term == "0" else None
+            return np.array([] if position is None else [position], dtype=np.int64)
+        value = int(term)
+        largest = int(self.ids[-1])
+        matches = []
+        found = 0
+        scale = 1
+        while found < limit and value * scale <= largest:
+            start, end = np.searchsorted(
+                self.ids, [value * scale, (value + 1) * scale], side="left"
+            )
+            matches.append(np.arange(start, min(end, start + limit - found)))
+            found += len(matches[-1])
+            scale *= 10
+        return np.concatenate(matches) if matches else np.array([], dtype=np.int64)
+
+    def most_events(self, limit=50):
+        if len(self) <= limit:
+            return np.argsort(-self.counts, kind="stable")
+        top = np.argpartition(-self.counts, limit - 1)[:limit]
+        return top[np.argsort(-self.counts[top], kind="stable")]
+
+    def random(self, limit=50, seed=None):
+        rng = np.random.default_rng(seed)
+        return np.sort(rng.choice(len(self), min(limit, len(self)), replace=False))
+
+    def find(self, subject_id):
+        """Position of ``subject_id``, or None if it is not a known subject."""
+        position = np.searchsorted(self.ids, subject_id)
+        if position < len(self) and self.ids[position] == subject_id:
+            return position
+        return None
+
+    def options(self, positions):
+        """Dropdown options for the subjects at ``positions``."""
+        return [
+            {"label": f"{subject_id} ({count} events)", "value": int(subject_id)}
+            for subject_id, count in zip(
+                self.ids[positions].tolist(), self.counts[positions].tolist()
+            )
+        ]
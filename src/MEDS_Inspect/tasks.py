@@ -0,0 +1,43 @@
+from pathlib import Path
+
+import polars as pl
+
+
+def get_tasks_dir(file_path):
+    """The task label directory of a dataset (``tasks`` or ``labels``), or None."""
+    for name in ("tasks", "labels"):
+        tasks_dir = Path(file_path) / name
+        if tasks_dir.is_dir():
+            return tasks_dir
+    return None
+
+
+def list_tasks(file_path):
+    """Names of the tasks of a dataset: parquet files directly in the task directory
+    (without suffix) and directories that hold parquet files (relative paths)."""
+    tasks_dir = get_tasks_dir(file_path)
+    if tasks_dir is None:
+        return []
+    tasks = set()
+    for path in tasks_dir.rglob("*.parquet"):
+        if path.parent == tasks_dir:
+            tasks.add(path.stem)
+            continue
+        # Split directories (e.g. task/train/0.parquet) belong to their task
+        task_dir = path.parent.relative_to(tasks_dir)
+        if task_dir.name in ("train", "tuning", "held_out", "test", "val"):
+            task_dir = task_dir.parent
+        if task_dir != Path("."):
+            tasks.add(task_dir.as_posix())
+    return sorted(tasks)
+
+
+def scan_task(file_path, task):
+    """Scans the labels of ``task``, a name returned by ``list_tasks``."""
+    tasks_dir = get_tasks_dir(file_path)
+    if tasks_dir is None:
+        raise FileNotFoundError(f"No tasks directory in {file_path}")
+    task_file = tasks_dir / f"{task}.parquet"
+    if task_file.is_file():
+        return pl.scan_parquet(task_file)
+    return pl.scan_parquet(tasks_dir / task / "**" / "*.parquet")
@@ -1,7 +1,13 @@
 import logging
 import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
 from pathlib import Path
 
+from .metrics import METRICS, log_event
+
 
 def get_folder_size(path):
     total_size = 0
@@ -12,6 +18,11 @@ def get_folder_size(path):
     return total_size
 
 
+def resolve_path(file_path):
+    """The key of a dataset path, so every spelling of a path refers to one dataset."""
+    return str(Path(file_path).expanduser().resolve())
+
+
 def is_valid_path(path):
     if path is None or path == "":
         return False
@@ -30,6 +41,16 @@ def is_valid_path(path):
     return len(data_files) > 0 and len(metadata_files) > 0
 
 
+def format_statistic(value, bounds=None):
+    """Formats a general statistic, labeling values approximated with sketches with
+    their error."""
+    is_number = isinstance(value, (int, float)) and not isinstance(value, bool)
+    text = f"{value:,}" if is_number else str(value)
+    if bounds is not None:
+        text = f"≈ {text} (± {bounds['relative_error']:.1%} std. error)"
+    return text
+
+
 def return_data_path(file_path):
     # Check if data is one or two levels deep
     data_path_1 = Path(file_path) / "data/*/*.parquet"
@@ -50,3 +71,66 @@ def get_detected_tasks(file_path):
         f for f in os.listdir(tasks_path) if os.path.isfile(os.path.join(tasks_path, f))
     ]
     return detected_tasks
+
+
+def peak_rss_mb():
+    """Peak resident set size of the current process in MB (Unix only)."""
+    import resource
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def current_rss_mb():
+    """Resident set size of the current process in MB, the peak where unavailable."""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        return peak_rss_mb()
+
+
+def private_rss_mb():
+    """Resident memory that is not shared with other processes (e.g. memory-mapped
+    files in the page cache) in MB, or None where unavailable (Linux only)."""
+    try:
+        with open("/proc/self/statm") as f:
+            _, resident, shared = (int(pages) for pages in f.read().split()[:3])
+        return (resident - shared) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+@contextmanager
+def track_memory(stage, interval=0.05):
+    """Samples the resident memory while running ``stage`` and logs its peak.
+
+    Yields a dict that holds the ``peak_mb`` and ``seconds`` of the stage afterwards.
+    Both are also recorded as metrics of the stage.
+    """
+    stats = {"peak_mb": current_rss_mb()}
+    stop = threading.Event()
+
+    def sample():
+        while not stop.wait(interval):
+            stats["peak_mb"] = max(stats["peak_mb"], current_rss_mb())
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    start = time.perf_counter()
+    try:
+        yield stats
+    finally:
+        stop.set()
+        sampler.join()
+        stats["peak_mb"] = max(stats["peak_mb"], current_rss_mb())
+        stats["seconds"] = time.perf_counter() - start
+        logging.info(
+            f"{stage}: peak memory {stats['peak_mb']:.0f} MB ({stats['seconds']:.2f}s)"
+        )
+        METRICS.observe(
+            "meds_inspect_cache_stage_seconds", stats["seconds"], stage=stage
+        )
+        log_event("cache_stage", stage=stage, **stats)
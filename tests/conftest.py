@@ -0,0 +1,13 @@
+import shutil
+from pathlib import Path
+
+import pytest
+
+DEMO_PATH = Path(__file__).parents[1] / "src/MEDS_Inspect/assets/MIMIC-IV-DEMO-MEDS"
+
+
+@pytest.fixture
+def demo_dataset(tmp_path):
+    dataset_path = tmp_path / "MIMIC-IV-DEMO-MEDS"
+    shutil.copytree(DEMO_PATH, dataset_path, ignore=shutil.ignore_patterns(".meds_*"))
+    return dataset_path
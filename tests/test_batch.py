@@ -0,0 +1,42 @@
+import json
+
+import polars as pl
+
+from MEDS_Inspect.benchmark.synthetic import generate_dataset
+from MEDS_Inspect.cache.batch import job_cpus, list_datasets, run_batch
+from MEDS_Inspect.cache.cache_results import get_cache_dir
+
+
+def test_batch_skips_unchanged_datasets(tmp_path):
+    roots = [
+        generate_dataset(tmp_path / name, subjects=30, events_per_subject=20)
+        for name in ("site_a", "site_b")
+    ]
+    manifest = tmp_path / "datasets.txt"
+    manifest.write_text(
+        "# nightly\n"
+        + "\n".join(str(root.relative_to(tmp_path)) for root in roots)
+        + "\nmissing\n"
+    )
+    assert list_datasets(str(manifest)) == [*map(str, roots), str(tmp_path / "missing")]
+
+    summary = tmp_path / "summary.csv"
+    # Too little memory for either build, so both are streamed one after the other
+    first = run_batch(
+        str(manifest), batch_workers=2, memory_budget_mb=1, summary=summary
+    )
+    assert first["status"].to_list() == ["built", "built", "failed"]
+    assert first["seconds"][:2].is_not_null().all()
+    assert pl.read_csv(summary).equals(first)
+    with open(get_cache_dir(roots[0]) / "build_report.json") as f:
+        assert json.load(f)["engine"] == "streaming"
+
+    second = run_batch(str(tmp_path / "site_*"), batch_workers=2)
+    assert second["status"].to_list() == ["skipped", "skipped"]
+
+
+def test_sharded_builds_claim_a_core_per_worker():
+    assert job_cpus({}, cpus=16, batch_workers=4) == 4
+    assert job_cpus({"workers": 8}, cpus=16, batch_workers=4) == 8
+    assert job_cpus({"workers": 32}, cpus=16, batch_workers=4) == 16
+    assert job_cpus({"workers": None}, cpus=2, batch_workers=4) == 1
@@ -0,0 +1,72 @@
+import json
+
+import polars as pl
+
+from MEDS_Inspect.benchmark.run import BENCHMARKS
+from MEDS_Inspect.benchmark.synthetic import generate_dataset
+from MEDS_Inspect.cache.cache_results import cache_results
+from MEDS_Inspect.utils import is_valid_path
+
+
+def test_generate_dataset_layout(tmp_path):
+    file_path = generate_dataset(
+        tmp_path, subjects=100, events_per_subject=20, vocabulary=50, shards=3
+    )
+    assert is_valid_path(file_path)
+    with open(file_path / "metadata" / ".shards.json") as f:
+        shards = json.load(f)
+    assert len(shards) == 9
+    assert all((file_path / "data" / f"{key}.parquet").exists() for key in shards)
+    data = pl.read_parquet(file_path / "data" / "*" / "*.parquet")
+    assert data["subject_id"].n_unique() == 100
+    assert data["code"].n_unique() <= 50 + 3
+    splits = pl.read_parquet(file_path / "metadata" / "subject_splits.parquet")
+    assert splits["split"].value_counts().sort("split")["count"].to_list() == [
+        10,
+        80,
+        10,
+    ]
+
+
+def test_generate_flat_dataset(tmp_path):
+    file_path = generate_dataset(
+        tmp_path, subjects=50, events_per_subject=10, numeric_fraction=0, splits=()
+    )
+    assert sorted(p.name for p in (file_path / "data").iterdir()) == [
+        "0.parquet",
+        "1.parquet",
+    ]
+    cached_results = cache_results(file_path)
+    assert cached_results["numeric_summary"].is_empty()
+    assert cached_results["general_statistics"]["Unique subjects"].item() == 50
+
+
+def test_cold_cache_benchmark_times_both_engines(tmp_path):
+    file_path = generate_dataset(tmp_path, subjects=50, events_per_subject=20)
+    results = BENCHMARKS["cache_cold"](str(file_path), repeats=1)
+    assert results["sequential"]["median"] > 0 and results["fused"]["median"] > 0
+    assert results["fused_speedup"] > 0
+    # The fused plan and the streamed numeric rows
+    assert results["scans"]["scans_fused"] == 2
+    assert results["scans"]["scans_sequential"] > 1
+
+
+def test_callback_benchmark(tmp_path):
+    file_path = generate_dataset(tmp_path, subjects=50, events_per_subject=20)
+    results = BENCHMARKS["callbacks"](file_path, repeats=1)
+    assert {"code_count_years", "subject_codes", "search", "tab-7"} <= set(results)
+    assert all(result["payload_bytes"] > 0 for result in results.values())
+    assert all(result["alloc_peak_bytes"] > 0 for result in results.values())
+
+
+def test_figure_benchmark(tmp_path):
+    file_path = generate_dataset(tmp_path, subjects=20, events_per_subject=50)
+    results = BENCHMARKS["figures"](file_path, repeats=1)
+    assert results["native"]["alloc_peak_bytes"] > 0
+
+
+def test_import_benchmark_defers_pandas(tmp_path):
+    results = BENCHMARKS["import"](tmp_path, repeats=1)
+    assert results["median"] > 0
+    assert not results["pandas_imported"]
+    assert not results["plotly_express_imported"]
@@ -0,0 +1,223 @@
+import json
+import re
+
+import polars as pl
+import pytest
+
+from MEDS_Inspect.cache.aggregations import (
+    FUSE_OPTIMIZATIONS,
+    QUERIES,
+    STREAMED,
+    count_scans,
+    fused_plan,
+    fused_queries,
+)
+from MEDS_Inspect.cache.cache_results import (
+    ENGINES,
+    cache_results,
+    get_cache_dir,
+    invalidate_cache,
+)
+from MEDS_Inspect.cache.partials import merge_partials
+from MEDS_Inspect.cache.streaming import SPILL_FANOUT
+from MEDS_Inspect.metrics import METRICS
+
+
+def collect_all(results):
+    return {
+        key: value.collect() if isinstance(value, pl.LazyFrame) else value
+        for key, value in results.items()
+        if isinstance(value, (pl.DataFrame, pl.LazyFrame))
+    }
+
+
+def assert_same_results(expected, actual):
+    assert expected.keys() == actual.keys()
+    for key in expected:
+        sort_by = [
+            c for c, t in expected[key].schema.items() if t.base_type() != pl.List
+        ]
+        assert expected[key].sort(sort_by).equals(actual[key].sort(sort_by)), key
+
+
+@pytest.mark.parametrize("engine", [e for e in ENGINES if e != "sequential"])
+def test_engines_match_sequential(demo_dataset, engine):
+    expected = collect_all(cache_results(str(demo_dataset), engine="sequential"))
+    invalidate_cache(str(demo_dataset))
+    actual = collect_all(cache_results(str(demo_dataset), engine=engine))
+    assert_same_results(expected, actual)
+    assert (get_cache_dir(demo_dataset) / "build_report.json").exists()
+
+
+def test_fused_plan_scans_each_file_once(demo_dataset):
+    data = pl.scan_parquet(demo_dataset / "data/*/*.parquet")
+    queries = fused_queries(data, [key for key in QUERIES if key not in STREAMED])
+    plan = fused_plan(queries).explain(**FUSE_OPTIMIZATIONS)
+    assert count_scans(plan) == 1
+    # A filter is pushed down into a scan of its own
+    queries["filtered"] = data.filter(pl.col("time").is_not_null()).select("code")
+    assert count_scans(fused_plan(queries).explain(**FUSE_OPTIMIZATIONS)) == 2
+
+    # The numeric rows are streamed into the cache with a scan of their own
+    fused_before = METRICS.value("meds_inspect_query_seconds", query="fused")
+    results = cache_results(str(demo_dataset), engine="fused")
+    fused_after = METRICS.value("meds_inspect_query_seconds", query="fused")
+    assert fused_after == fused_before + 1
+    assert isinstance(results["numerical_code_data"], pl.LazyFrame)
+    report = json.loads((get_cache_dir(demo_dataset) / "build_report.json").read_text())
+    assert report["scans_fused"] == 1 + len(STREAMED)
+    assert report["scans_sequential"] == len(QUERIES)
+
+
+@pytest.mark.parametrize("partition", ["shard", "split"])
+def test_sharded_engine_in_process_pool(demo_dataset, partition):
+    expected = collect_all(cache_results(str(demo_dataset), engine="fused"))
+    invalidate_cache(str(demo_dataset))
+    actual = collect_all(
+        cache_results(
+            str(demo_dataset), engine="sharded", workers=2, partition=partition
+        )
+    )
+    assert_same_results(expected, actual)
+
+
+def test_incremental_refresh_matches_rebuild(demo_dataset):
+    cache_results(str(demo_dataset), engine="sharded")
+    data_dir = demo_dataset / "data"
+    held_out = pl.read_parquet(data_dir / "held_out/0.parquet")
+    tuning = pl.read_parquet(data_dir / "tuning/0.parquet")
+    # One changed, one added and one removed shard
+    tuning.head(len(tuning) // 2).write_parquet(data_dir / "tuning/0.parquet")
+    held_out.tail(100).write_parquet(data_dir / "held_out/1.parquet")
+    (data_dir / "held_out/0.parquet").unlink()
+
+    refreshed = collect_all(cache_results(str(demo_dataset)))
+    invalidate_cache(str(demo_dataset))
+    rebuilt = collect_all(cache_results(str(demo_dataset), engine="fused"))
+    for results in (refreshed, rebuilt):
+        # The folder size also counts the cache directory
+        results["general_statistics"] = results["general_statistics"].drop("Size (MB)")
+    assert_same_results(rebuilt, refreshed)
+    total_events = rebuilt["general_statistics"]["Total events"].item()
+    assert total_events == len(tuning) // 2 + 100
+
+
+def test_approximate_statistics_within_error_bounds(demo_dataset):
+    exact = collect_all(cache_results(str(demo_dataset)))
+    invalidate_cache(str(demo_dataset))
+    approximate = cache_results(str(demo_dataset), approximate=True)
+    bounds = approximate["approximations"]
+
+    for column in ("Unique subjects", "Unique events"):
+        expected = exact["general_statistics"][column].item()
+        actual = approximate["general_statistics"][column].item()
+        assert abs(actual - expected) <= 3 * bounds[column]["relative_error"] * expected
+    top_codes = approximate["top_codes"].head(10)
+    expected = exact["top_codes"].join(top_codes, on="code", suffix="_approximate")
+    assert len(expected) == 10
+    errors = expected["count_approximate"].cast(pl.Int64) - expected["count"]
+    assert errors.min() >= 0
+    assert errors.max() <= bounds["top_codes"]["absolute_error"]
+
+
+@pytest.mark.parametrize("engine", ["sharded", "streaming"])
+def test_approximate_rejected_with_exact_partials(demo_dataset, engine):
+    with pytest.raises(ValueError, match="exact statistics"):
+        cache_results(str(demo_dataset), engine=engine, approximate=True)
+    assert not get_cache_dir(demo_dataset).exists()
+
+
+def test_streaming_engine_spills_under_small_memory_limit(demo_dataset, caplog):
+    expected = collect_all(cache_results(str(demo_dataset), engine="sequential"))
+    invalidate_cache(str(demo_dataset))
+    # A small limit streams every shard and merges the partials in hash buckets, the
+    # buckets of the numeric sketches are split again
+    memory_limit_mb = 0.05
+    with caplog.at_level("INFO"):
+        actual = collect_all(
+            cache_results(
+                str(demo_dataset), engine="streaming", memory_limit_mb=memory_limit_mb
+            )
+        )
+    assert_same_results(expected, actual)
+    buckets = {
+        key: int(count)
+        for key, count in re.findall(r"Merged (\S+) in (\d+) buckets", caplog.text)
+    }
+    assert buckets["top_codes"] > 1
+    assert buckets["numeric_summary"] > SPILL_FANOUT
+    assert "Computing aggregates (streaming): peak memory" in caplog.text
+    cache_dir = get_cache_dir(demo_dataset)
+    report = json.loads((cache_dir / "build_report.json").read_text())
+    assert report["memory_limit_mb"] == memory_limit_mb
+    assert report["peak_memory_mb"]["compute"] > 0
+    assert not (cache_dir / "spill").exists()
+
+
+def test_time_pyramid_levels_sum_to_monthly_counts(demo_dataset):
+    results = cache_results(str(demo_dataset))
+    pyramid = results["time_pyramid"]
+    monthly = (
+        pyramid.filter(pl.col("level") == "month")
+        .group_by("period")
+        .agg(pl.col("count").sum())
+        .select(
+            pl.col("period").cast(pl.Date).dt.strftime("%Y-%m").alias("Date"), "count"
+        )
+    )
+    expected = results["code_count_years"].filter(pl.col("Amount of codes") > 0)
+    joined = expected.join(monthly, on="Date", how="full")
+    assert (joined["Amount of codes"] == joined["count"]).all()
+    totals = pyramid.group_by("level").agg(pl.col("count").sum())["count"]
+    assert totals.n_unique() == 1
+    weeks = pyramid.filter(pl.col("level") == "week")["period"].cast(pl.Date)
+    assert (weeks.dt.weekday() == 1).all()
+
+
+def test_ipc_cache_matches_parquet_and_converts(demo_dataset):
+    expected = collect_all(cache_results(str(demo_dataset)))
+    # The parquet cache is converted instead of recomputed
+    actual = collect_all(cache_results(str(demo_dataset), cache_format="ipc"))
+    assert_same_results(expected, actual)
+    cache_dir = get_cache_dir(demo_dataset)
+    assert not list(cache_dir.glob(".*.tmp"))
+    assert (cache_dir / "top_codes.arrow").exists()
+    assert not (cache_dir / "top_codes.parquet").exists()
+
+    invalidate_cache(str(demo_dataset))
+    actual = collect_all(cache_results(str(demo_dataset), cache_format="ipc"))
+    assert_same_results(expected, actual)
+    with open(cache_dir / "build_report.json") as f:
+        assert json.load(f)["format"] == "ipc"
+
+
+def test_merged_counts_do_not_overflow():
+    count = 3_000_000_000
+    partial = {
+        "top_codes": pl.DataFrame(
+            {"code": ["LAB//1"], "count": [count], "rows": [count]},
+            schema_overrides={"count": pl.UInt32, "rows": pl.UInt32},
+        ),
+    }
+    merged = merge_partials([partial, partial])
+    assert merged["top_codes"]["count"].item() == 2 * count
+    assert merged["top_codes"]["rows"].item() == 2 * count
+
+
+@pytest.mark.parametrize("engine", ["fused", "sharded"])
+def test_missing_aggregate_and_changed_shard(demo_dataset, engine):
+    cache_results(str(demo_dataset), engine=engine, numeric_rows=False)
+    data_dir = demo_dataset / "data"
+    tuning = pl.read_parquet(data_dir / "tuning/0.parquet")
+    tuning.write_parquet(data_dir / "tuning/1.parquet")
+    # The raw numeric rows are missing and a shard was added
+    results = collect_all(cache_results(str(demo_dataset), engine=engine))
+    invalidate_cache(str(demo_dataset))
+    rebuilt = collect_all(cache_results(str(demo_dataset), engine="fused"))
+    for result in (results, rebuilt):
+        result["general_statistics"] = result["general_statistics"].drop("Size (MB)")
+    assert_same_results(rebuilt, results)
+    total_events = pl.scan_parquet(data_dir / "*/*.parquet").select(pl.len())
+    assert results["general_statistics"]["Total events"].item() == (
+        total_events.collect().item()
+    )
@@ -0,0 +1,59 @@
+import polars as pl
+
+from MEDS_Inspect.code_search import SEARCH_COLUMNS, CodeSearchIndex
+
+CODES = pl.DataFrame(
+    {
+        "code": ["LAB//50931//mg/dL", "LAB//5093", "DIAGNOSIS//ICD//9//70723", "GL"],
+        "description": ["Glucose", "Glucose, whole blood", "Pressure ulcer", None],
+        "parent_codes": [["LOINC/2345-7"], None, ["ICD9CM/707.23"], []],
+    }
+)
+FREQUENCIES = pl.DataFrame(
+    {"code": ["LAB//5093", "LAB//50931//mg/dL"], "count": [5, 50]}
+)
+
+
+def search(term, options=SEARCH_COLUMNS):
+    index = CodeSearchIndex(CODES, FREQUENCIES)
+    return index.search(term, options)["code"].to_list()
+
+
+def test_substring_matches_equal_scan():
+    for term in ["glu", "lab//", "ucose, w", "//9//", "gl", "g"]:
+        expected = CODES.filter(
+            pl.col("code").str.to_lowercase().str.contains(term, literal=True)
+            | pl.col("description").str.to_lowercase().str.contains(term, literal=True)
+        )["code"]
+        assert sorted(search(term, ["code", "description"])) == sorted(expected)
+
+
+def test_ranking_by_relevance_then_frequency():
+    # Exact code first, then code prefixes by frequency, then description matches
+    assert search("LAB//5093") == ["LAB//5093", "LAB//50931//mg/dL"]
+    assert search("glucose") == ["LAB//50931//mg/dL", "LAB//5093"]
+    assert search("gl") == ["GL", "LAB//50931//mg/dL", "LAB//5093"]
+
+
+def test_parent_codes():
+    assert search("icd9cm/707", ["parent_codes"]) == ["DIAGNOSIS//ICD//9//70723"]
+    assert search("707.23", ["parent_codes"]) == ["DIAGNOSIS//ICD//9//70723"]
+    assert search("707.23", ["code"]) == []
+
+
+def test_regex_fallback():
+    assert search("^lab.*mg", ["code"]) == ["LAB//50931//mg/dL"]
+
+
+def test_regex_search_uses_the_limit():
+    codes = pl.DataFrame(
+        {
+            "code": [f"LAB//{i}" for i in range(1500)],
+            "description": ["Lab"] * 1500,
+            "parent_codes": [[]] * 1500,
+        },
+        schema_overrides={"parent_codes": pl.List(pl.String)},
+    )
+    index = CodeSearchIndex(codes)
+    assert len(index.search("lab//1.*", ["code"], limit=2000)) == 611
+    assert len(index.search("lab//1.*", ["code"], limit=10)) == 10
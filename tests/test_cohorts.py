@@ -0,0 +1,60 @@
+import polars as pl
+
+from MEDS_Inspect.cache.cache_results import cache_results
+from MEDS_Inspect.cache.cohorts import (
+    canonical_cohort,
+    cohort_hash,
+    get_cohorts_dir,
+    load_cohort,
+)
+from MEDS_Inspect.tasks import list_tasks, scan_task
+
+
+def test_canonical_cohort_ignores_unset_fields(demo_dataset):
+    assert canonical_cohort({"split": None, "task": "", "start": None}) is None
+    a = canonical_cohort({"split": "held_out", "start": "2150-01-01T00:00:00"})
+    b = canonical_cohort({"start": "2150-01-01", "split": "held_out", "end": None})
+    assert a == b == {"split": "held_out", "start": "2150-01-01"}
+    assert cohort_hash(demo_dataset, a) == cohort_hash(demo_dataset, b)
+    assert cohort_hash(demo_dataset, a) != cohort_hash(demo_dataset, {"split": "train"})
+
+
+def test_cohort_matches_filtered_events(demo_dataset):
+    cache_results(str(demo_dataset))
+    data = pl.read_parquet(demo_dataset / "data" / "**" / "*.parquet")
+    task = list_tasks(demo_dataset)[0]
+    task_subjects = scan_task(demo_dataset, task).select("subject_id").collect()
+    splits = pl.read_parquet(demo_dataset / "metadata" / "subject_splits.parquet")
+    split_subjects = splits.filter(pl.col("split") == "held_out")["subject_id"]
+    expected = {
+        "split": data.filter(pl.col("subject_id").is_in(split_subjects)),
+        "task": data.filter(pl.col("subject_id").is_in(task_subjects["subject_id"])),
+        "start": data.filter(pl.col("time") >= pl.datetime(2150, 1, 1)),
+    }
+    cohorts = {
+        "split": {"split": "held_out"},
+        "task": {"task": task},
+        "start": {"start": "2150-01-01"},
+    }
+    for key, cohort in cohorts.items():
+        statistics = load_cohort(demo_dataset, cohort)["general_statistics"]
+        assert statistics["Total events"].item() == len(expected[key]), key
+        assert (
+            statistics["Unique subjects"].item()
+            == expected[key]["subject_id"].n_unique()
+        ), key
+
+
+def test_cohorts_are_memoized_and_evicted(demo_dataset):
+    cache_results(str(demo_dataset))
+    first = load_cohort(demo_dataset, {"split": "held_out"}, max_cohorts=2)
+    cohort_dir = get_cohorts_dir(demo_dataset) / cohort_hash(
+        demo_dataset, {"split": "held_out"}
+    )
+    assert (cohort_dir / "cohort.json").exists()
+    again = load_cohort(demo_dataset, {"split": "held_out"}, max_cohorts=2)
+    assert first["top_codes"].equals(again["top_codes"])
+    for start in ["2100-01-01", "2110-01-01"]:
+        load_cohort(demo_dataset, {"start": start}, max_cohorts=2)
+    assert not cohort_dir.exists()
+    assert len(list(get_cohorts_dir(demo_dataset).iterdir())) == 2
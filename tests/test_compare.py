@@ -0,0 +1,66 @@
+import numpy as np
+import polars as pl
+import pytest
+
+from MEDS_Inspect.benchmark.synthetic import generate_dataset
+from MEDS_Inspect.cache.cache_results import cache_results
+from MEDS_Inspect.compare import (
+    align_counts,
+    common_numeric_codes,
+    compare_counts,
+    compare_numeric,
+    compare_time,
+    dataset_labels,
+    share,
+)
+from MEDS_Inspect.metrics import METRICS
+from MEDS_Inspect.registry import load_cached_dataset
+
+
+def test_counts_are_aligned_on_their_keys():
+    tables = {
+        "a": pl.DataFrame({"code": ["x", "y"], "count": [3, 1]}),
+        "b": pl.DataFrame({"code": ["y", "z"], "count": [2, 2]}),
+    }
+    aligned = align_counts(tables, "code").sort("code")
+    assert aligned.rows() == [("x", 3, 0), ("y", 1, 2), ("z", 0, 2)]
+
+    compared = compare_counts(tables, "code", top_n=1)
+    assert compared["code"].to_list() == ["x", "z", "y"]
+    assert compared.filter(pl.col("code") == "x")["b - a share"].item() == -0.75
+    assert dataset_labels(["/data/a/v1", "/data/b/v1"]) == ["/data/a/v1", "/data/b/v1"]
+
+
+def test_datasets_are_compared_from_their_cache(demo_dataset, tmp_path):
+    synthetic = generate_dataset(tmp_path / "synthetic", subjects=50)
+    for file_path in (demo_dataset, synthetic):
+        cache_results(str(file_path))
+    scanned = METRICS.value("meds_inspect_rows_scanned_total", reader="cache_build")
+    datasets = {
+        "demo": load_cached_dataset(str(demo_dataset)),
+        "synthetic": load_cached_dataset(str(synthetic)),
+    }
+    assert (
+        METRICS.value("meds_inspect_rows_scanned_total", reader="cache_build")
+        == scanned
+    )
+    with pytest.raises(FileNotFoundError):
+        load_cached_dataset(str(tmp_path / "missing"))
+
+    over_time = compare_time(
+        {name: dataset["time_pyramid"] for name, dataset in datasets.items()}, "year"
+    )
+    assert over_time["period"].is_sorted()
+    for name, dataset in datasets.items():
+        assert over_time[share(name)].sum() == pytest.approx(1)
+        years = dataset["time_pyramid"].filter(pl.col("level") == "year")
+        assert over_time[name].sum() == years["count"].sum()
+
+    summaries = {"demo": datasets["demo"]["numeric_summary"]} | {
+        "copy": datasets["demo"]["numeric_summary"]
+    }
+    code = common_numeric_codes(summaries)[0]
+    table, edges, counts = compare_numeric(summaries, code)
+    assert table["Dataset"].to_list() == ["demo", "copy"]
+    assert len(edges) == 51
+    np.testing.assert_allclose(counts["demo"], counts["copy"])
@@ -0,0 +1,103 @@
+from datetime import datetime
+
+import numpy as np
+import plotly.graph_objects as go
+import polars as pl
+import pytest
+
+from MEDS_Inspect.figures import (
+    bucket_events,
+    category_bar_figure,
+    histogram_bar,
+    normalize_histogram,
+    subject_timeline_figure,
+)
+
+
+def subject_events(n):
+    rng = np.random.default_rng(0)
+    codes = rng.choice(["LAB//1", "LAB//2", "MED//1", "DIAGNOSIS//1"], n)
+    return pl.DataFrame(
+        {
+            "time": pl.datetime_range(
+                datetime(2020, 1, 1), datetime(2020, 12, 31), "1s", eager=True
+            )[:n],
+            "code": codes,
+            "numeric_value": rng.random(n),
+            "text_value": pl.Series([None] * n, dtype=pl.String),
+        }
+    ).with_columns(pl.col("code").str.split("/").list.first().alias("coding_dict"))
+
+
+def test_bucketed_counts_cover_all_events():
+    events = subject_events(10_000)
+    counts = bucket_events(events, 50)
+    assert counts["count"].sum() == len(events)
+    assert counts["time"].min() >= events["time"].min()
+    assert counts["time"].max() <= events["time"].max()
+    assert (
+        counts.group_by("coding_dict").agg(pl.col("time").n_unique())["time"].max()
+        <= 50
+    )
+
+
+def test_timeline_level_of_detail():
+    events = subject_events(30_000)
+    small = subject_timeline_figure(events.head(100), 1)
+    assert {trace.type for trace in small.data} == {"scatter"}
+
+    overview = subject_timeline_figure(events, 1, max_points=20_000, buckets=100)
+    assert {trace.type for trace in overview.data} == {"scattergl"}
+    assert sum(len(trace.x) for trace in overview.data) <= 100 * 3
+
+    start, end = events["time"][0], events["time"][5_000]
+    detail = subject_timeline_figure(events, 1, x_range=(start, end))
+    assert {trace.type for trace in detail.data} == {"scattergl"}
+    assert sum(len(trace.x) for trace in detail.data) == 5_001
+    assert list(detail.layout.xaxis.range) == [start, end]
+
+
+def test_category_bars_are_one_trace():
+    counts = pl.DataFrame(
+        {"code": [f"LAB//{i}" for i in range(12)], "count": range(12)}
+    )
+    figure = category_bar_figure(counts, "code", "count", log=True, horizontal=True)
+    (bar,) = figure.data
+    assert list(bar.y) == counts["code"].to_list()
+    assert list(bar.x) == counts["count"].to_list()
+    assert len(set(bar.marker.color)) == 10
+    assert figure.layout.xaxis.type == "log"
+    assert figure.layout.yaxis.title.text == "code"
+
+
+@pytest.mark.parametrize(
+    "histnorm, expected",
+    [
+        ("", [1, 3, 0, 4]),
+        ("probability", [0.125, 0.375, 0, 0.5]),
+        ("percent", [12.5, 37.5, 0, 50]),
+        ("density", [2, 3, 0, 8]),
+        ("probability density", [0.25, 0.375, 0, 1]),
+    ],
+)
+def test_normalize_histogram(histnorm, expected):
+    counts = [1, 3, 0, 4]
+    widths = np.array([0.5, 1, 1, 0.5])
+    np.testing.assert_allclose(normalize_histogram(counts, widths, histnorm), expected)
+    np.testing.assert_array_equal(
+        normalize_histogram([0, 0, 0, 0], widths, histnorm), [0, 0, 0, 0]
+    )
+
+
+def test_histogram_bar_matches_plotly_histogram():
+    values = np.random.default_rng(0).normal(size=1_000)
+    start, end, size = -4.0, 4.0, 0.5
+    histogram = go.Histogram(x=values, xbins=dict(start=start, end=end, size=size))
+    edges = np.arange(histogram.xbins.start, histogram.xbins.end + size, size)
+    counts, _ = np.histogram(values, edges)
+    bar = histogram_bar(edges, counts, histnorm="probability density")
+    # Bars span the bins of the histogram, so they look the same as its columns
+    np.testing.assert_allclose(bar.x, np.arange(start, end, size) + size / 2)
+    np.testing.assert_allclose(bar.width, size)
+    np.testing.assert_allclose(np.sum(np.asarray(bar.y) * bar.width), 1)
+    assert sum(histogram_bar(edges, counts).y) == len(values)
@@ -0,0 +1,100 @@
+import io
+import json
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from MEDS_Inspect.cache.cache_results import get_cache_dir
+from MEDS_Inspect.cache.jobs import (
+    BuildJobs,
+    acquire_build_lock,
+    build_cache,
+    get_lock_path,
+    release_build_lock,
+    write_progress,
+)
+from MEDS_Inspect.cache.progress import ProgressBar, report_progress
+from MEDS_Inspect.metrics import METRICS
+
+
+def test_build_reports_tqdm_stages(demo_dataset):
+    progress = []
+    build_cache(demo_dataset, lambda *update: progress.append(update))
+    stages = {stage for stage, _, _ in progress}
+    assert f"Caching {demo_dataset.name}" in stages
+    assert progress[-1][1] == progress[-1][2]
+    assert not get_lock_path(get_cache_dir(demo_dataset)).exists()
+
+
+def test_build_follows_running_build(demo_dataset):
+    cache_dir = get_cache_dir(demo_dataset)
+    assert acquire_build_lock(cache_dir)
+    assert not acquire_build_lock(cache_dir)
+    write_progress(cache_dir, "Partial aggregates", 1, 2)
+    progress = []
+    follower = threading.Thread(
+        target=build_cache, args=(demo_dataset, lambda *u: progress.append(u))
+    )
+    follower.start()
+    time.sleep(1)
+    assert follower.is_alive()
+    release_build_lock(cache_dir)
+    follower.join()
+    assert progress[0] == ("Partial aggregates", 1, 2)
+
+
+def test_concurrent_builds_report_their_own_progress():
+    progress = {}
+    barrier = threading.Barrier(2)
+
+    def build(stage):
+        with report_progress(
+            lambda *update: progress.setdefault(stage, []).append(update)
+        ):
+            bar = ProgressBar(total=2, desc=stage, file=io.StringIO())
+            barrier.wait()
+            bar.update(1)
+            barrier.wait()
+            bar.update(1)
+
+    threads = [threading.Thread(target=build, args=(s,)) for s in ("a", "b")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for stage in ("a", "b"):
+        assert progress[stage] == [(stage, 0, 2), (stage, 1, 2), (stage, 2, 2)]
+
+
+def test_stale_lock_is_taken_over(tmp_path):
+    lock_path = get_lock_path(tmp_path)
+    dead = subprocess.run(
+        [sys.executable, "-c", "import os; print(os.getpid())"], capture_output=True
+    )
+    owner = {"pid": int(dead.stdout), "host": socket.gethostname()}
+    lock_path.write_text(json.dumps(owner))
+    assert acquire_build_lock(tmp_path)
+
+
+def test_jobs_reuse_running_build(demo_dataset):
+    rows_scanned = METRICS.value(
+        "meds_inspect_rows_scanned_total", reader="cache_build"
+    )
+    jobs = BuildJobs()
+    try:
+        job = jobs.submit(demo_dataset)
+        assert jobs.submit(f"{demo_dataset}/") is job
+        job.result(timeout=300)
+        assert jobs.status(f"{demo_dataset}/.")["state"] == "done"
+        assert jobs.status(demo_dataset / "other")["state"] == "unknown"
+    finally:
+        jobs.shutdown()
+    # The metrics of the worker process are merged once the job is done
+    for _ in range(50):
+        scanned = METRICS.value("meds_inspect_rows_scanned_total", reader="cache_build")
+        if scanned > rows_scanned:
+            break
+        time.sleep(0.1)
+    assert scanned > rows_scanned
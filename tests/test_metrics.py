@@ -0,0 +1,71 @@
+import json
+
+import polars as pl
+
+from MEDS_Inspect.metrics import (
+    METRICS,
+    Metrics,
+    collect_query,
+    enable_json_log,
+    json_logger,
+)
+
+
+def test_metrics_render_prometheus_text():
+    metrics = Metrics()
+    metrics.inc("meds_inspect_cache_requests_total", cache="cohorts", result="hit")
+    metrics.inc("meds_inspect_cache_requests_total", 2, cache="cohorts", result="hit")
+    metrics.observe("meds_inspect_callback_seconds", 0.02, callback='say "hi"')
+    metrics.observe("meds_inspect_callback_seconds", 3, callback='say "hi"')
+    text = metrics.render()
+    assert "# TYPE meds_inspect_cache_requests_total counter" in text
+    assert 'meds_inspect_cache_requests_total{cache="cohorts",result="hit"} 3' in text
+    labels = 'callback="say \\"hi\\""'
+    assert f'meds_inspect_callback_seconds_bucket{{{labels},le="0.01"}} 0' in text
+    assert f'meds_inspect_callback_seconds_bucket{{{labels},le="0.025"}} 1' in text
+    assert f'meds_inspect_callback_seconds_bucket{{{labels},le="+Inf"}} 2' in text
+    assert f"meds_inspect_callback_seconds_count{{{labels}}} 2" in text
+
+
+def test_drained_metrics_merge():
+    worker, app = Metrics(), Metrics()
+    worker.inc("meds_inspect_rows_scanned_total", 10, reader="cache_build")
+    worker.observe("meds_inspect_cache_stage_seconds", 0.02, stage="Loading cache")
+    worker.set("meds_inspect_datasets_loaded", 1)
+    app.inc("meds_inspect_rows_scanned_total", 5, reader="cache_build")
+    app.set("meds_inspect_datasets_loaded", 3)
+    app.merge(worker.drain())
+    assert app.value("meds_inspect_rows_scanned_total", reader="cache_build") == 15
+    assert app.value("meds_inspect_cache_stage_seconds", stage="Loading cache") == 1
+    assert app.value("meds_inspect_datasets_loaded") == 1
+    assert worker.render() == "\n"
+
+
+def test_queries_are_timed_and_logged(tmp_path):
+    log_path = tmp_path / "metrics.jsonl"
+    enable_json_log(log_path)
+    try:
+        query = pl.LazyFrame({"a": [1, 2, 3]}).filter(pl.col("a") > 1)
+        assert len(collect_query("test_query", query)) == 2
+    finally:
+        for handler in list(json_logger.handlers):
+            json_logger.removeHandler(handler)
+            handler.close()
+    event = json.loads(log_path.read_text().splitlines()[-1])
+    assert event["event"] == "query" and event["rows"] == 2
+    assert "FILTER" in event["plan"]
+    assert METRICS.value("meds_inspect_query_seconds", query="test_query") == 1
+
+
+def test_metrics_route():
+    from dash import html
+
+    from MEDS_Inspect.app import app, server
+
+    # Dash checks for a layout before the first request
+    if app.layout is None:
+        app.layout = html.Div()
+    METRICS.inc("meds_inspect_rows_scanned_total", 5, reader="test")
+    response = server.test_client().get("/metrics")
+    assert response.status_code == 200
+    assert 'meds_inspect_rows_scanned_total{reader="test"}' in response.text
@@ -0,0 +1,72 @@
+import numpy as np
+import polars as pl
+
+from MEDS_Inspect.cache.numeric_summary import (
+    HISTOGRAM_BINS,
+    RELATIVE_ACCURACY,
+    merge_numeric_sketches,
+    numeric_sketch_query,
+    rebin,
+    summarize_numeric_sketch,
+)
+
+
+def summarize(numeric_data):
+    return summarize_numeric_sketch(numeric_sketch_query(numeric_data).collect())
+
+
+def test_numeric_summary_and_rebin():
+    values = np.concatenate([np.arange(1000, dtype=np.float64), [1e6]])
+    numeric_data = pl.LazyFrame({"code": "LAB//A", "numeric_value": values})
+    summary = summarize(numeric_data).row(0, named=True)
+
+    assert summary["count"] == 1001
+    assert (summary["min"], summary["max"]) == (0, 1e6)
+    assert summary["quantiles"][50] == 500
+    assert len(summary["histogram"]) == HISTOGRAM_BINS
+    # The outlier lies above the Tukey fence and is not part of the histogram
+    assert (summary["underflow"], summary["overflow"]) == (0, 1)
+
+    assert (summary["hist_lo"], summary["hist_hi"]) == (0, 1500)
+
+    edges, counts = rebin(summary, 10)
+    assert np.allclose(edges, np.linspace(0, 1500, 11))
+    assert np.isclose(counts.sum(), 1000)
+    assert np.allclose(counts[:6], 150, atol=1)
+
+
+def test_numeric_sketches_merge():
+    rng = np.random.default_rng(0)
+    values = np.concatenate([rng.lognormal(0, 2, 10_000), -rng.random(100), [0, 0]])
+    numeric_data = pl.LazyFrame({"code": "LAB//A", "numeric_value": values})
+    # Values without a numeric value or code are not summarized
+    missing = pl.LazyFrame(
+        {"code": ["LAB//A", "LAB//A", None], "numeric_value": [None, np.nan, 1.0]}
+    )
+    summary = summarize(pl.concat([numeric_data, missing]))
+    shards = [numeric_data.slice(i, 1_000) for i in range(0, len(values), 1_000)]
+    merged = summarize_numeric_sketch(
+        merge_numeric_sketches([numeric_sketch_query(shard) for shard in shards])
+    )
+    assert merged.equals(summary)
+
+    row = summary.row(0, named=True)
+    assert row["count"] == len(values)
+    assert (row["min"], row["max"]) == (values.min(), values.max())
+    ranks = np.round(np.linspace(0, 1, 101) * (len(values) - 1)).astype(int)
+    np.testing.assert_allclose(
+        row["quantiles"], np.sort(values)[ranks], rtol=RELATIVE_ACCURACY
+    )
+    assert row["underflow"] + sum(row["histogram"]) + row["overflow"] == len(values)
+
+
+def test_numeric_summary_of_repeated_integers_is_exact():
+    values = np.random.default_rng(0).integers(0, 150, 10_000).astype(np.float64)
+    row = summarize(pl.LazyFrame({"code": "A", "numeric_value": values})).row(
+        0, named=True
+    )
+    edges = np.linspace(row["hist_lo"], row["hist_hi"], HISTOGRAM_BINS + 1)
+    expected, _ = np.histogram(values, edges)
+    assert row["histogram"] == expected.tolist()
+    ranks = np.round(np.linspace(0, 1, 101) * (len(values) - 1)).astype(int)
+    assert row["quantiles"] == np.sort(values)[ranks].tolist()
@@ -0,0 +1,137 @@
+import threading
+import time
+
+import polars as pl
+import pytest
+
+from MEDS_Inspect.cache.cache_results import get_cache_dir
+from MEDS_Inspect.cache.manifest import read_manifest, write_manifest
+from MEDS_Inspect.registry import Dataset, DatasetRegistry, load_dataset
+
+
+def fake_loader(rows=1000, calls=None):
+    def load(file_path):
+        if calls is not None:
+            calls.append(file_path)
+            time.sleep(0.05)
+        results = {"top_codes": pl.DataFrame({"count": range(rows)})}
+        return Dataset(file_path, results, pl.DataFrame({"name": [file_path]}))
+
+    return load
+
+
+def test_registry_keys_by_resolved_path(tmp_path):
+    registry = DatasetRegistry(loader=fake_loader())
+    (tmp_path / "a").mkdir()
+    dataset = registry.get(tmp_path / "a")
+    assert registry.get(f"{tmp_path}/b/../a/") is dataset
+    assert len(registry) == 1
+
+
+def test_registry_evicts_least_recently_used(tmp_path):
+    registry = DatasetRegistry(max_datasets=2, loader=fake_loader())
+    registry.get(tmp_path / "a")
+    registry.get(tmp_path / "b")
+    registry.get(tmp_path / "a")
+    registry.get(tmp_path / "c")
+    assert tmp_path / "a" in registry
+    assert tmp_path / "b" not in registry
+    assert tmp_path / "c" in registry
+
+
+def test_registry_memory_budget_keeps_latest(tmp_path):
+    # Every fake dataset holds ~8 MB, above the 1 MB budget
+    registry = DatasetRegistry(memory_budget_mb=1, loader=fake_loader(rows=10**6))
+    registry.get(tmp_path / "a")
+    registry.get(tmp_path / "b")
+    assert len(registry) == 1
+    assert tmp_path / "b" in registry
+
+
+def test_registry_loads_once_for_concurrent_requests(tmp_path):
+    calls = []
+    registry = DatasetRegistry(loader=fake_loader(calls=calls))
+    threads = [
+        threading.Thread(target=registry.get, args=(tmp_path / "a",)) for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+
+
+def test_dataset_remembers_recent_searches(demo_dataset):
+    dataset = DatasetRegistry().get(demo_dataset)
+    results = dataset.search("lab", ["code", "description"], limit=100)
+    assert dataset.search("lab", ["description", "code"], limit=100) is results
+    assert dataset.search("lab", ["code"], limit=100) is not results
+
+
+def test_dataset_keeps_recent_cohorts(demo_dataset):
+    dataset = DatasetRegistry().get(demo_dataset)
+    size = dataset.size
+    assert dataset.cohort(None) is dataset
+    cohort = dataset.cohort({"split": "held_out"})
+    assert dataset.cohort({"split": "held_out"}) is cohort
+    assert dataset.size == size + cohort.size
+    assert dataset.cohort({"start": "3000-01-01"}) is None
+
+
+def test_registry_preloads_in_the_background(tmp_path):
+    calls = []
+    registry = DatasetRegistry(loader=fake_loader(calls=calls))
+    thread = registry.preload(tmp_path / "a")
+    assert registry.is_loading(tmp_path / "a")
+    dataset = registry.get(tmp_path / "a")
+    thread.join()
+    assert registry.get(tmp_path / "a") is dataset
+    assert not registry.is_loading(tmp_path / "a")
+    assert len(calls) == 1
+
+
+def test_registry_failed_load_is_not_loading(tmp_path):
+    def failing_loader(file_path):
+        raise FileNotFoundError(file_path)
+
+    registry = DatasetRegistry(loader=failing_loader)
+    with pytest.raises(FileNotFoundError):
+        registry.get(tmp_path / "a")
+    assert not registry.is_loading(tmp_path / "a")
+    registry.preload(tmp_path / "b").join()
+    assert not registry.is_loading(tmp_path / "b")
+    assert tmp_path / "b" not in registry
+
+
+def test_registry_checks_budget_when_cohorts_load(demo_dataset, tmp_path):
+    other = fake_loader(rows=10**5)
+
+    def loader(file_path):
+        return (
+            load_dataset(file_path)
+            if file_path == str(demo_dataset)
+            else other(file_path)
+        )
+
+    registry = DatasetRegistry(loader=loader)
+    dataset = registry.get(demo_dataset)
+    registry.get(tmp_path / "a")
+    registry.get(demo_dataset)
+    # Both fit, but not once a cohort of the demo dataset is loaded
+    registry.memory_budget = registry.size + 1
+    cohort = dataset.cohort({"split": "held_out"})
+    assert dataset.size > cohort.size > 0
+    assert tmp_path / "a" not in registry
+    assert demo_dataset in registry
+
+
+def test_registry_evicts_datasets_with_changed_shards(demo_dataset):
+    registry = DatasetRegistry()
+    dataset = registry.get(demo_dataset)
+    assert not registry.evict_outdated(demo_dataset)
+    cache_dir = get_cache_dir(demo_dataset)
+    manifest = read_manifest(cache_dir)
+    next(iter(manifest["shards"].values()))["hash"] = "changed"
+    write_manifest(cache_dir, manifest)
+    assert registry.evict_outdated(demo_dataset)
+    assert registry.get(demo_dataset) is not dataset
@@ -0,0 +1,40 @@
+import json
+
+import polars as pl
+import pytest
+
+from MEDS_Inspect.cache.cache_results import cache_results
+from MEDS_Inspect.report import TOP_CODES, write_report
+
+
+def test_report_holds_only_aggregates(demo_dataset):
+    results = cache_results(str(demo_dataset))
+    report_dir = write_report(demo_dataset, results)
+    assert {p.name for p in report_dir.iterdir()} == {
+        "index.html",
+        "profile.json",
+        "plotly.min.js",
+    }
+    with open(report_dir / "profile.json") as f:
+        profile = json.load(f)
+    assert profile["general_statistics"] == json.loads(
+        results["general_statistics"].write_json()
+    )
+    assert len(profile["top_codes"]) == min(TOP_CODES, len(results["top_codes"]))
+    assert sum(profile["code_count_subjects"]["counts"]) == len(
+        results["code_count_subjects"]
+    )
+    # Per-subject rows are binned, so no subject id ends up in the report
+    subject_ids = pl.read_parquet(demo_dataset / "data" / "*" / "*.parquet")[
+        "subject_id"
+    ]
+    text = (report_dir / "profile.json").read_text()
+    assert not any(str(subject_id) in text for subject_id in subject_ids.unique())
+    numeric = profile["numeric_codes"][0]
+    assert sum(numeric["counts"]) == pytest.approx(
+        numeric["count"] - numeric["underflow"] - numeric["overflow"]
+    )
+
+    html = (report_dir / "index.html").read_text()
+    assert '<script src="plotly.min.js"></script>' in html
+    assert html.count("Plotly.newPlot") == 5
@@ -0,0 +1,35 @@
+import numpy as np
+import polars as pl
+import pytest
+
+from MEDS_Inspect.cache.sketches import (
+    CountMinSketch,
+    HeavyHitters,
+    HyperLogLog,
+    hash_values,
+)
+
+
+def test_hyperloglog_merge_matches_union():
+    left, right = HyperLogLog(), HyperLogLog()
+    left.add_hashes(hash_values(pl.Series(np.arange(0, 60_000))))
+    right.add_hashes(hash_values(pl.Series(np.arange(40_000, 100_000))))
+    merged = left.merge(right).count()
+    assert abs(merged - 100_000) <= 3 * left.relative_error * 100_000
+
+
+def test_sketches_round_trip(tmp_path):
+    sketch = HyperLogLog(precision=10)
+    sketch.add_hashes(hash_values(pl.Series(["a", "b", "c"])))
+    sketch.save(tmp_path / "hll.npz")
+    assert HyperLogLog.load(tmp_path / "hll.npz").count() == sketch.count() == 3
+
+    heavy_hitters = HeavyHitters(capacity=2)
+    heavy_hitters.add_counts(pl.Series(["a", "b", "c"]), pl.Series([5, 50, 20]))
+    heavy_hitters.save(tmp_path)
+    assert HeavyHitters.load(tmp_path).top()["code"].to_list() == ["b", "c"]
+
+
+def test_incompatible_sketches_do_not_merge():
+    with pytest.raises(ValueError):
+        CountMinSketch(width=16).merge(CountMinSketch(width=32))
@@ -0,0 +1,20 @@
+import polars as pl
+
+from MEDS_Inspect.cache.cache_results import cache_results
+from MEDS_Inspect.cache.subject_index import load_subject_events
+
+COLUMNS = ["time", "code", "numeric_value"]
+
+
+def test_subject_index_lookup_matches_scan(demo_dataset):
+    # Small row groups, so subjects span several of them
+    shard = demo_dataset / "data/tuning/0.parquet"
+    pl.read_parquet(shard).write_parquet(shard, row_group_size=1000)
+    subject_index = cache_results(str(demo_dataset))["subject_index"]
+    data = pl.scan_parquet(demo_dataset / "data/*/*.parquet")
+
+    for subject_id in subject_index["subject_id"].unique().to_list():
+        expected = data.filter(pl.col("subject_id") == subject_id).select(COLUMNS)
+        actual = load_subject_events(demo_dataset, subject_id, subject_index, COLUMNS)
+        assert actual.equals(expected.collect())
+    assert load_subject_events(demo_dataset, -1, subject_index, COLUMNS) is None
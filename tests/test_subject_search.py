@@ -0,0 +1,40 @@
+import numpy as np
+import polars as pl
+
+from MEDS_Inspect.subject_search import SubjectIds
+
+
+def subject_ids(ids):
+    rng = np.random.default_rng(0)
+    return SubjectIds(
+        pl.DataFrame(
+            {
+                "Subject ID": ids,
+                "Code count": pl.Series(
+                    rng.integers(1, 1000, len(ids)), dtype=pl.UInt32
+                ),
+            }
+        ).sample(fraction=1, shuffle=True, seed=0)
+    )
+
+
+def test_prefix_matches_string_prefixes():
+    ids = [0, 1, 7, 12, 120, 1234, 1299, 13, 5012, 10**12 + 5]
+    subjects = subject_ids(ids)
+    for term in ["1", "12", "129", "0", "05", "5", "99", "1000000000005"]:
+        matches = subjects.ids[subjects.prefix(term)].tolist()
+        assert sorted(matches) == sorted(i for i in ids if str(i).startswith(term))
+    assert subjects.ids[subjects.prefix("1", limit=3)].tolist() == [1, 12, 13]
+    assert len(subjects.prefix("x1")) == 0
+
+
+def test_quick_filters():
+    subjects = subject_ids(list(range(100, 300)))
+    top = subjects.most_events(10)
+    assert len(top) == 10
+    assert subjects.counts[top].min() >= np.sort(subjects.counts)[-10]
+    assert np.all(np.diff(subjects.counts[top]) <= 0)
+    assert len(np.unique(subjects.random(20, seed=1))) == 20
+    assert subjects.find(150) is not None and subjects.find(99) is None
+    options = subjects.options(subjects.prefix("150"))
+    assert options[0]["value"] == 150
@@ -0,0 +1,70 @@
+import polars as pl
+
+from MEDS_Inspect.cache.cache_results import cache_results, get_cache_dir
+from MEDS_Inspect.cache.task_index import (
+    build_task_index,
+    get_task_summary_path,
+    load_task_labels,
+)
+from MEDS_Inspect.figures import task_label_trace
+
+TASK = "ICU Mortality first 24h"
+
+
+def test_task_labels_are_indexed_by_subject(demo_dataset):
+    results = cache_results(str(demo_dataset))
+    cache_dir = get_cache_dir(demo_dataset)
+    labels = pl.read_parquet(demo_dataset / "tasks" / f"{TASK}.parquet")
+    subject_id = labels["subject_id"][0]
+    expected = labels.filter(pl.col("subject_id") == subject_id).sort("prediction_time")
+    assert load_task_labels(cache_dir, TASK, subject_id).equals(expected)
+    assert load_task_labels(cache_dir, "unknown", subject_id) is None
+
+    summary = results["task_summary"].row(0, named=True)
+    assert summary["Labels"] == len(labels)
+    assert summary["Subjects"] == labels["subject_id"].n_unique()
+    assert summary["Label prevalence"] == labels["boolean_value"].mean()
+    assert summary["Prediction times per subject (max)"] == (
+        labels.group_by("subject_id").len()["len"].max()
+    )
+
+
+def test_task_index_is_rebuilt_when_labels_change(demo_dataset):
+    cache_results(str(demo_dataset))
+    cache_dir = get_cache_dir(demo_dataset)
+    mtime = get_task_summary_path(cache_dir).stat().st_mtime_ns
+    build_task_index(demo_dataset, cache_dir)
+    assert get_task_summary_path(cache_dir).stat().st_mtime_ns == mtime
+
+    labels = pl.read_parquet(demo_dataset / "tasks" / f"{TASK}.parquet")
+    labels.head(10).write_parquet(demo_dataset / "tasks" / f"{TASK}.parquet")
+    build_task_index(demo_dataset, cache_dir)
+    summary = pl.read_parquet(get_task_summary_path(cache_dir))
+    assert summary["Labels"].item() == 10
+
+
+def test_prediction_times_are_one_trace():
+    labels = pl.DataFrame(
+        {
+            "subject_id": [1, 1, 1],
+            "prediction_time": pl.datetime_range(
+                pl.datetime(2020, 1, 1), pl.datetime(2020, 1, 3), "1d", eager=True
+            ),
+            "boolean_value": [True, False, None],
+        }
+    )
+    trace = task_label_trace(labels, "task")
+    assert len(trace.x) == 9 and trace.x[2] is None
+    assert list(trace.marker.color[1::3]) == ["red", "green", "green"]
+    assert "Boolean Value: true" in trace.hovertext[0]
+
+
+def test_malformed_label_file_is_skipped(demo_dataset, caplog):
+    (demo_dataset / "tasks" / "broken.parquet").write_bytes(b"not parquet")
+    pl.DataFrame({"subject_id": [1]}).write_parquet(
+        demo_dataset / "tasks" / "no_times.parquet"
+    )
+    results = cache_results(str(demo_dataset))
+    assert results["task_summary"]["Task"].to_list() == [TASK]
+    assert "Skipping the labels of task broken" in caplog.text
+    assert "Skipping the labels of task no_times" in caplog.text